@@ -1,21 +1,54 @@
 import sys
 import os
+from datetime import date
 from urllib.parse import urlencode
 
 from flask import Flask, request, abort, jsonify, render_template, session, \
-    redirect, flash, url_for
-from models import Task, Volunteer, setup_db
+    redirect, flash, url_for, Response
+from models import db, Task, Volunteer, TableVersion, setup_db
 from forms import TaskForm, VolunteerForm
-from auth import AuthError, requires_auth, has_permission
+from auth import AuthError, requires_auth, get_permission_snapshot
+from pagination import get_page_args, keyset_page, DEFAULT_PAGE_SIZE, \
+    MAX_PAGE_SIZE
+import search
+from cache import response_cache
+from db_pool import pool_metrics
+from metrics import init_metrics, render_metrics
+from query_budget import init_query_budget
+from replica import read_only
+from fieldsets import get_fieldset
+from stats import current_stats
+from conditional import make_etag, conditional_response
+from validation import validate_task, validate_volunteer, \
+    validate_assignment
+from bulk import bulk_create, bulk_assign, BULK_MAX_ITEMS
+from export import export_response, task_export_query, \
+    volunteer_export_query, TASK_COLUMNS, VOLUNTEER_COLUMNS
 from authlib.integrations.flask_client import OAuth
 
 
+@read_only
+def get_volunteer_names():
+    # returns {id: name} of every volunteer in name order.  It is cached
+    # until a volunteer is added, changed or deleted, by this worker or any
+    # other, so the forms do not load the whole table each time.  warm_up()
+    # fills it before the workers start
+    def build_names():
+        return dict(db.session.query(Volunteer.id, Volunteer.name)
+                    .order_by(Volunteer.name, Volunteer.id))
+
+    return response_cache.get_or_set(
+        ('volunteer_names', TableVersion.current('volunteer')), build_names)
+
+
 def create_app():
     # create the app
     static_folder = os.path.abspath('../frontend/static')
     app = Flask(__name__, template_folder='../frontend/templates',
                 static_folder=static_folder)
     setup_db(app)
+    init_metrics(app)
+    init_query_budget(app)
 
     auth0_domain = os.environ.get('AUTH0_DOMAIN')
     auth0_base_url = 'https://' + auth0_domain
@@ -82,24 +115,16 @@ def create_app():
         print('token:', token)
         print('')
 
-        if has_permission(token, 'get:volunteer'):
+        # the token is decoded once and all of the permission flags are
+        # built from the same payload
+        session.update(get_permission_snapshot(token))
+        if not session['public_user']:
             # the user is either assistant or director and will be redirected
             # to the dashboard
-            session['public_user'] = False
-            session['delete_task_ok'] = str(has_permission(token,
-                                                           'delete:task'))
-            session['delete_vol_ok'] = str(has_permission(token, 'delete:volun'
-                                                                 'teer'))
-            session['add_task_ok'] = str(has_permission(token, 'post:task'))
-            session['add_vol_ok'] = str(has_permission(token,
-                                                       'post:volunteer'))
-            session['update_task_ok'] = str(has_permission(token,
-                                                           'patch:task'))
             return redirect('/dashboard')
         else:
             # the user is a member of the public and has no permissions
             # they will be redirected to the index route
-            session['public_user'] = True
             return redirect('/')
 
     @app.route('/dashboard')
@@ -112,7 +137,9 @@ def create_app():
         else:
             return render_template('dashboard.html',
                                    userinfo=session['user'],
-                                   permit_add=session['add_task_ok'])
+                                   permit_add=session['add_task_ok'],
+                                   stats=load_stats(TableVersion.current(
+                                       'task', 'volunteer')))
 
 
         # if session.get('jwt_token', False):
@@ -122,46 +149,125 @@ def create_app():
         # else:
         #     return redirect('/')
         #
+    def load_stats(versions):
+        # the counts only change with the tasks, and the volunteer names
+        # with the volunteers, so versions are the versions of both tables.
+        # The week that is this week changes with the date
+        today = date.today()
+
+        def build_stats():
+            return current_stats(today)
+
+        return response_cache.get_or_set(('stats', today, versions),
+                                         build_stats)
+
+    @app.route('/stats')
+    @requires_auth('get:volunteer')
+    @read_only
+    def get_stats():
+        # returns the task counts by status, by week and by volunteer, read
+        # from the task_stat summary rows
+        versions = TableVersion.current('task', 'volunteer')
+
+        def build_json():
+            return dict(load_stats(versions), success=True)
+
+        etag = make_etag('stats', date.today(), *versions)
+        return conditional_response(etag, build_json)
+
     # Tasks routes ------------------------------------------------------------
     @app.route('/tasks')
+    @read_only
     def get_tasks():
-        # returns a list of all tasks
-        tasks = Task.query.order_by('id').all()
-        if not tasks:
-            abort(404)
+        # returns one page of tasks in id order.  Pass the returned
+        # next_cursor back as ?cursor= to get the next page.  Api clients
+        # may ask for only some of the fields with ?fields= and ?include=
+        limit, cursor = get_page_args()
+        fields, include = None, None
+        if not session.get('return_html', False):
+            fields, include = get_fieldset(Task)
+
+        def build_page():
+            tasks, next_cursor = keyset_page(
+                Task.query_fields(fields, include), [Task.id], cursor, limit)
+            return [task.format(fields, include) for task in tasks], \
+                next_cursor
+
+        # volunteer names are part of each task, so a change to either
+        # table invalidates the cached page.  The versions are read from the
+        # database, so a write made through another worker is seen as well
+        versions = TableVersion.current('task', 'volunteer')
+
+        def load_page():
+            formatted_tasks, next_cursor = response_cache.get_or_set(
+                ('tasks', limit, cursor, fields, include, versions),
+                build_page)
+            if not formatted_tasks and not cursor:
+                abort(404)
+            return formatted_tasks, next_cursor
 
-        formatted_tasks = [task.format() for task in tasks]
         if session.get('return_html', False):
+            formatted_tasks, next_cursor = load_page()
+            next_url = None
+            if next_cursor:
+                next_url = url_for('get_tasks', limit=limit,
+                                   cursor=next_cursor)
             return render_template('task_list.html',
                                    tasks=formatted_tasks,
+                                   next_url=next_url,
                                    permit_add=session.get('add_task_ok',
                                                           'False'))
         else:
-            return {
-                'success': True,
-                'tasks': formatted_tasks
-            }
+            def build_json():
+                formatted_tasks, next_cursor = load_page()
+                return {
+                    'success': True,
+                    'tasks': formatted_tasks,
+                    'next_cursor': next_cursor
+                }
+
+            # the page only changes when a task or volunteer does
+            etag = make_etag('tasks', limit, cursor, fields, include,
+                             *versions)
+            return conditional_response(etag, build_json)
 
     @app.route('/tasks/open')
+    @read_only
     def get_open_tasks():
-        # returns a list of all tasks with status of 'Open'
-        tasks = Task.query.filter(Task.status == 'Open') \
-            .order_by(Task.id).all()
-        formatted_tasks = [task.format() for task in tasks]
+        # returns a list of all tasks with status of 'Open'.  This is the
+        # public landing page, so the formatted list is cached until a task
+        # or volunteer changes
+        def build_list():
+            tasks = Task.query_with_volunteer() \
+                .filter(Task.status == 'Open') \
+                .order_by(Task.id).all()
+            return [task.format() for task in tasks]
+
+        # keyed on the table versions too, as get_tasks is
+        formatted_tasks = response_cache.get_or_set(
+            ('open_tasks', TableVersion.current('task', 'volunteer')),
+            build_list)
 
         session['return_html'] = True
         return render_template('task_list.html',
                                tasks=formatted_tasks,
                                permit_add=session.get('add_task_ok', 'False'))
 
+    @app.route('/tasks/export')
+    @requires_auth('get:volunteer')
+    def export_tasks():
+        # streams all of the tasks as ndjson or csv.  They can be filtered
+        # by status, date_from, date_to and volunteer_id
+        return export_response(task_export_query(), TASK_COLUMNS, 'tasks')
+
     @app.route('/tasks/<int:task_id>')
+    @read_only
     def get_task(task_id):
         # returns the task having id = task_id
-        task = Task.query.get(task_id)
-        if not task:
-            abort(404)
-
         if session.get('return_html', False):
+            task = Task.query_with_volunteer().get(task_id)
+            if not task:
+                abort(404)
             public_user = session.get('public_user', True)
             # a public user is not allowed to view other volunteers so we
             # have to say (not public_user)
@@ -174,30 +280,92 @@ def create_app():
                                                              'False'),
                                    permit_view_vol=permit_view_vol)
         else:
+            # the task includes its volunteer's name, so the etag covers
+            # both rows
+            fields, include = get_fieldset(Task)
+            versions = db.session.query(Task.version, Volunteer.version) \
+                .outerjoin(Task.volunteers) \
+                .filter(Task.id == task_id).first()
+            if not versions:
+                abort(404)
+
+            def build_json():
+                task = Task.query_fields(fields, include).get(task_id)
+                return {
+                    'success': True,
+                    'task': task.format(fields, include)
+                }
+
+            return conditional_response(
+                make_etag('task', fields, include, *versions), build_json)
+
+    def get_search_args():
+        # returns the search term, limit and page number from the json body,
+        # the form or the query string
+        values = request.get_json(silent=True)
+        if not isinstance(values, dict):
+            values = request.values
+        search_term = str(values.get('search_term', ''))
+        try:
+            limit = int(values.get('limit', DEFAULT_PAGE_SIZE))
+            page = int(values.get('page', 1))
+        except (TypeError, ValueError):
+            abort(400)
+        if limit < 1 or page < 1:
+            abort(400)
+        return search_term, min(limit, MAX_PAGE_SIZE), page
+
+    def wants_json():
+        # the search routes return json to api clients and html to the gui
+        return request.is_json or request.args.get('format') == 'json'
+
+    @app.route('/tasks/search', methods=['GET', 'POST'])
+    @read_only
+    def search_tasks():
+        # returns one page of the tasks whose title or details contain the
+        # search term, best match first
+        search_term, limit, page = get_search_args()
+        fields, include = None, None
+        if wants_json():
+            fields, include = get_fieldset(Task)
+        tasks, has_more = search.search_tasks(search_term, limit,
+                                              (page - 1) * limit, fields,
+                                              include)
+        formatted_tasks = [task.format(fields, include) for task in tasks]
+        if wants_json():
             return {
                 'success': True,
-                'task': task.format()
+                'tasks': formatted_tasks,
+                'page': page,
+                'has_more': has_more
             }
 
-    @app.route('/tasks/search', methods=['POST'])
-    def search_tasks():
-        # returns a list of all tasks whose title contains the search term
-        search_term = request.form.get('search_term', '')
-        tasks = Task.query.filter(Task.title.ilike('%{}%'.format(
-            search_term))).order_by('id').all()
         if not tasks:
             flash('No tasks match "' + search_term + '"')
             return redirect('/dashboard')
 
+        next_url = None
+        if has_more:
+            next_url = url_for('search_tasks', search_term=search_term,
+                               limit=limit, page=page + 1)
         return render_template('task_list.html',
-                               tasks=[task.format() for task in tasks],
+                               tasks=formatted_tasks,
+                               next_url=next_url,
                                permit_add=session.get('add_task_ok', 'False'))
 
-    def get_volunteer_choices():
-        # returns a list of tuples of all volunteer ids and names that is used
-        # to populate the assign volunteer select field on the task form
-        volunteers = Volunteer.query.order_by('name').all()
-        choices = [(v.id, v.name) for v in volunteers]
+    def get_volunteer_choices(volunteer_id=None):
+        # returns a list of tuples of volunteer ids and names that is used
+        # to populate the assign volunteer select field on the task form.
+        # A submitted form is checked against every volunteer.  A form that
+        # is sent to the browser only holds volunteer_id, and the others are
+        # looked up as the user types with /volunteers/typeahead
+        names = get_volunteer_names()
+        if volunteer_id is None:
+            choices = list(names.items())
+        elif volunteer_id in names:
+            choices = [(volunteer_id, names[volunteer_id])]
+        else:
+            choices = []
         choices.insert(0, (0, 'None'))
         return choices
 
@@ -208,8 +376,9 @@ def create_app():
         task = Task.query.get(task_id)
         form = TaskForm(obj=task)
 
-        # get all volunteers in name order for volunteer choices in form
-        form.volunteer_id.choices = get_volunteer_choices()
+        # only the assigned volunteer, the form looks up the others
+        form.volunteer_id.choices = get_volunteer_choices(
+            getattr(task, 'volunteer_id', None) or 0)
 
         return render_template('task_form.html',
                                form=form,
@@ -233,6 +402,8 @@ def create_app():
                                                     ' were invalid:')
             for field, message in form.errors.items():
                 flash(field + ' ' + message[0])
+            form.volunteer_id.choices = get_volunteer_choices(
+                form.volunteer_id.data or 0)
             task = form.data
             task['id'] = task_id
             return render_template('task_form.html',
@@ -298,6 +469,46 @@ def create_app():
             'task': task.format()
         }
 
+    @app.route('/tasks/assign', methods=['POST'])
+    @requires_auth('patch:task')
+    def assign_tasks():
+        # applies a list of {task_id, volunteer_id, status} changes in one
+        # transaction and returns the updated tasks.  Either field may be
+        # left out of a change; a volunteer_id of null unassigns the task.
+        # Nothing is changed unless every change is valid
+        changes = request.get_json()
+        if not changes or not isinstance(changes, list):
+            abort(400)
+        if len(changes) > BULK_MAX_ITEMS:
+            abort(413)
+
+        checked = [validate_assignment(change) for change in changes]
+        results = [{'index': index, 'success': False, 'errors': errors}
+                   for index, (values, errors) in enumerate(checked)
+                   if errors]
+        tasks = None
+        if not results:
+            try:
+                tasks, results = bulk_assign([values
+                                              for values, errors in checked])
+            except Exception:
+                print('422 Error', sys.exc_info())
+                abort(422)
+
+        if tasks is None:
+            return jsonify({
+                'success': False,
+                'error': 400,
+                'message': 'Bad Request',
+                'results': [result for result in results
+                            if not result['success']]
+            }), 400
+        return {
+            'success': True,
+            'updated': len(tasks),
+            'tasks': [task.format() for task in tasks]
+        }
+
     @app.route('/tasks/<int:task_id>', methods=['DELETE'])
     @requires_auth('delete:task')
     def delete_task(task_id):
@@ -327,13 +538,10 @@ def create_app():
         if not body:
             abort(400)
 
-        title = body.get('title', None)
-        details = body.get('details', None)
-        date_needed = body.get('date_needed', None)
-        status = body.get('status', 'Open')
-        if title and details and date_needed:
+        values, errors = validate_task(body)
+        if not errors:
             try:
-                new_task = Task(title, details, date_needed, status)
+                new_task = Task(**values)
                 new_task.insert()
                 return {'success': True,
                         'task': new_task.format()
@@ -342,15 +550,23 @@ def create_app():
                 print('422 Error', sys.exc_info())
                 abort(422)
         else:
-            # request did not contain one or more required fields
+            # request did not contain one or more required fields, or one
+            # of them was invalid
             abort(400)
 
+    @app.route('/tasks/bulk', methods=['POST'])
+    @requires_auth('post:task')
+    def create_tasks_bulk():
+        # creates the tasks in a list, in one transaction
+        return create_bulk(Task, validate_task)
+
     @app.route('/tasks/add', methods=['GET'])
     @requires_auth('post:task')
     def add_task_form():
         # returns a blank task_form to the gui
         form = TaskForm()
-        form.volunteer_id.choices = get_volunteer_choices()
+        # a volunteer cannot be chosen when adding a task
+        form.volunteer_id.choices = get_volunteer_choices(0)
         return render_template('task_form.html',
                                form=form,
                                title="Add a New Task")
@@ -361,7 +577,7 @@ def create_app():
         # adds a new task with data from task_form and redirects to the
         # dashboard
         form = TaskForm()
-        form.volunteer_id.choices = get_volunteer_choices()
+        form.volunteer_id.choices = get_volunteer_choices(0)
 
         if not form.validate_on_submit():
             # if the form has errors, display error messages and resend the
@@ -395,55 +611,141 @@ def create_app():
     # Volunteers routes -------------------------------------------------------
     @app.route('/volunteers')
     @requires_auth('get:volunteer')
+    @read_only
     def get_volunteers():
-        # returns a list of all volunteers
-        volunteers = Volunteer.query.order_by('name').all()
+        # returns one page of volunteers in name order.  Pass the returned
+        # next_cursor back as ?cursor= to get the next page
+        limit, cursor = get_page_args()
+        fields, include = None, None
+        if not session.get('return_html', False):
+            fields, include = get_fieldset(Volunteer)
+
+        def load_page():
+            # the name is always loaded, as the next cursor is built from it
+            query = Volunteer.query_fields(
+                fields and fields + ('name',), include)
+            return keyset_page(query, [Volunteer.name, Volunteer.id],
+                               cursor, limit)
 
         if session.get('return_html', False):
+            volunteers, next_cursor = load_page()
+            next_url = None
+            if next_cursor:
+                next_url = url_for('get_volunteers', limit=limit,
+                                   cursor=next_cursor)
             return render_template('volunteer_list.html',
                                    volunteers=[v.format() for v in volunteers],
+                                   next_url=next_url,
                                    permit_add=session.get('add_vol_ok',
                                                           'False'))
         else:
-            return {'success': True,
-                    'volunteers': [vol.format() for vol in volunteers]
-                    }
+            def build_json():
+                volunteers, next_cursor = load_page()
+                return {'success': True,
+                        'volunteers': [vol.format(fields, include)
+                                       for vol in volunteers],
+                        'next_cursor': next_cursor
+                        }
+
+            # each volunteer includes their tasks, so a change to either
+            # table changes the page
+            etag = make_etag('volunteers', limit, cursor, fields, include,
+                             *TableVersion.current('volunteer', 'task'))
+            return conditional_response(etag, build_json)
+
+    @app.route('/volunteers/export')
+    @requires_auth('get:volunteer')
+    def export_volunteers():
+        # streams all of the volunteers as ndjson or csv.  They can be
+        # filtered by city and state
+        return export_response(volunteer_export_query(), VOLUNTEER_COLUMNS,
+                               'volunteers')
 
     @app.route('/volunteers/<int:vol_id>')
     @requires_auth('get:volunteer')
+    @read_only
     def get_volunteer(vol_id):
         # returns the volunteer whose id = vol_id
-        volunteer = Volunteer.query.get(vol_id)
-        if not volunteer:
-            abort(404)
-
         if session.get('return_html', False):
+            volunteer = Volunteer.query_with_tasks().get(vol_id)
+            if not volunteer:
+                abort(404)
             return render_template('show_volunteer.html',
                                    volunteer=volunteer.format(),
                                    permit_delete=session.get('delete_vol_ok',
                                                              'False'))
         else:
+            # the volunteer includes their tasks, and a task can be given to
+            # or taken from them without the volunteer row changing, so the
+            # etag also covers the task table's version
+            fields, include = get_fieldset(Volunteer)
+            versions = db.session.query(Volunteer.version,
+                                        TableVersion.version_of('task')) \
+                .filter(Volunteer.id == vol_id).first()
+            if not versions:
+                abort(404)
+
+            def build_json():
+                volunteer = Volunteer.query_fields(fields, include) \
+                    .get(vol_id)
+                return {
+                    'success': True,
+                    'volunteer': volunteer.format(fields, include)
+                }
+
+            return conditional_response(
+                make_etag('volunteer', fields, include, *versions),
+                build_json)
+
+    @app.route('/volunteers/search', methods=['GET', 'POST'])
+    @requires_auth('get:volunteer')
+    @read_only
+    def search_volunteers():
+        # returns one page of the volunteers whose name or city contains the
+        # search term, best match first
+        search_term, limit, page = get_search_args()
+        fields, include = None, None
+        if wants_json():
+            fields, include = get_fieldset(Volunteer)
+        volunteers, has_more = search.search_volunteers(
+            search_term, limit, (page - 1) * limit, fields, include)
+        formatted_volunteers = [vol.format(fields, include)
+                                for vol in volunteers]
+        if wants_json():
             return {
                 'success': True,
-                'volunteer': volunteer.format()
+                'volunteers': formatted_volunteers,
+                'page': page,
+                'has_more': has_more
             }
 
-    @app.route('/volunteers/search', methods=['POST'])
-    def search_volunteers():
-        # returns a list of all volunteers whose name contains the search term
-        # - gui only
-        search_term = request.form.get('search_term', '')
-        volunteers = Volunteer.query.filter(Volunteer.name.ilike(
-            '%{}%'.format(search_term))).order_by('name').all()
-
         if not volunteers:
             flash('No volunteers match "' + search_term + '"')
             return redirect('/dashboard')
 
+        next_url = None
+        if has_more:
+            next_url = url_for('search_volunteers', search_term=search_term,
+                               limit=limit, page=page + 1)
         return render_template('volunteer_list.html',
-                               volunteers=[vol.format() for vol in volunteers],
+                               volunteers=formatted_volunteers,
+                               next_url=next_url,
                                permit_add=session.get('add_vol_ok', 'False'))
 
+    @app.route('/volunteers/typeahead')
+    @requires_auth('patch:task')
+    @read_only
+    def volunteer_typeahead():
+        # returns the first few volunteers whose name starts with ?q=, for
+        # the assign volunteer field on the task form
+        volunteers = search.volunteers_by_prefix(request.args.get('q', ''),
+                                                 search.TYPEAHEAD_LIMIT)
+        return {
+            'success': True,
+            'volunteers': [{'id': vol_id, 'name': name}
+                           for vol_id, name in volunteers]
+        }
+
     @app.route('/volunteers/update/<int:vol_id>', methods=['GET'])
     @requires_auth('patch:volunteer')
     def update_volunteer_form(vol_id):
@@ -552,18 +854,11 @@ def create_app():
         if not body:
             abort(400)
 
-        name = body.get('name', None)
-        address = body.get('address', None)
-        city = body.get('city', None)
-        state = body.get('state', None)
-        zip_code = body.get('zip_code', None)
-        phone_number = body.get('phone_number', None)
-
         # all fields are required
-        if name and address and city and state and zip_code and phone_number:
+        values, errors = validate_volunteer(body)
+        if not errors:
             try:
-                new_volunteer = Volunteer(name, address, city, state,
-                                          zip_code, phone_number)
+                new_volunteer = Volunteer(**values)
                 new_volunteer.insert()
                 return {
                     'success': True,
@@ -572,9 +867,51 @@ def create_app():
             except Exception:
                 abort(422)
         else:
-            # request did not contain one or more required fields
+            # request did not contain one or more required fields, or one
+            # of them was invalid
+            abort(400)
+
+    @app.route('/volunteers/bulk', methods=['POST'])
+    @requires_auth('post:volunteer')
+    def create_volunteers_bulk():
+        # creates the volunteers in a list, in one transaction
+        return create_bulk(Volunteer, validate_volunteer)
+
+    def create_bulk(model, validate):
+        # the body is a list of objects.  With ?mode=partial the valid ones
+        # are created even if others are invalid, otherwise (mode=atomic)
+        # nothing is created unless all of them are valid
+        items = request.get_json()
+        if not items or not isinstance(items, list):
+            abort(400)
+        if len(items) > BULK_MAX_ITEMS:
+            abort(413)
+        mode = request.args.get('mode', 'atomic')
+        if mode not in ('atomic', 'partial'):
             abort(400)
 
+        try:
+            created, results = bulk_create(model, items, validate,
+                                           atomic=(mode == 'atomic'))
+        except Exception:
+            print('422 Error', sys.exc_info())
+            abort(422)
+
+        if mode == 'atomic' and created < len(items):
+            return jsonify({
+                'success': False,
+                'error': 400,
+                'message': 'Bad Request',
+                'created': 0,
+                'results': results
+            }), 400
+        return {
+            'success': True,
+            'created': created,
+            'failed': len(items) - created,
+            'results': results
+        }
+
     @app.route('/volunteers/add', methods=['GET'])
     @requires_auth('post:volunteer')
     def add_volunteer_form():
@@ -620,6 +957,22 @@ def create_app():
 
         return redirect('/dashboard')
 
+    # Status routes -----------------------------------------------------------
+    @app.route('/metrics')
+    def get_metrics():
+        # returns the request, sql, template, auth and pool metrics of all
+        # of the worker processes in the Prometheus text format
+        return Response(render_metrics(),
+                        mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics/pool')
+    def get_pool_metrics():
+        # returns the connection pool counts for this worker process
+        return {
+            'success': True,
+            'pool': pool_metrics.snapshot()
+        }
+
     # Error Handlers ----------------------------------------------------------
     @app.errorhandler(400)
     def bad_request(error):
@@ -645,6 +998,14 @@ def create_app():
             "message": "Method Not Allowed"
         }), 405
 
+    @app.errorhandler(413)
+    def payload_too_large(error):
+        return jsonify({
+            "success": False,
+            "error": 413,
+            "message": "Payload Too Large"
+        }), 413
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
@@ -669,7 +1030,7 @@ def create_app():
             "success": False,
             "error": "Authentication Error",
             "message": message
-        }), 401
+        }), error.status_code
 
     return app
 
@@ -0,0 +1,282 @@
+import os
+from types import SimpleNamespace
+from databases import Database
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.exceptions import BadRequest
+from werkzeug.http import parse_etags, quote_etag
+from sqlalchemy import select
+from models import Task, Volunteer, TableVersion, database_path
+from pagination import encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, \
+    MAX_PAGE_SIZE
+from cache import LRUBackend
+from conditional import make_etag
+from fieldsets import parse_fieldset
+import search
+
+# the database the async tier reads from, DATABASE_URL by default.  It can
+# be the read replica, as the lists and single tasks only change when the
+# table versions it reads from the same database do
+ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL', database_path)
+# connections kept open, and the most that may be open, by each worker
+ASYNC_POOL_MIN_SIZE = int(os.environ.get('ASYNC_POOL_MIN_SIZE', 1))
+ASYNC_POOL_MAX_SIZE = int(os.environ.get('ASYNC_POOL_MAX_SIZE', 10))
+
+'''
+Async read only tier
+An ASGI app that answers the public read only JSON routes: /tasks,
+/tasks/open, /tasks/<id> and /tasks/search.  Routes that need a token, such
+as the volunteer search, are left to the Flask app.  It runs under uvicorn
+next to the Flask app, and a proxy sends API reads for those paths here,
+where a slow client or a slow query waits on the event loop instead of
+holding a whole sync worker.
+
+The queries are SQLAlchemy Core selects on the models' tables, run with the
+databases package on asyncpg (aiosqlite for SQLite) through its own pool.
+Rows are turned into the same JSON as the Flask routes by Task.format, and
+the etags are built from the same table and row versions, so a client can
+switch between the two tiers without refetching.  Formatted lists are cached
+per worker, keyed on the table versions, so a write through the Flask app is
+seen on the next request.
+'''
+
+database = Database(
+    ASYNC_DATABASE_URL,
+    **({'min_size': ASYNC_POOL_MIN_SIZE, 'max_size': ASYNC_POOL_MAX_SIZE}
+       if ASYNC_DATABASE_URL.startswith('postgres') else {}))
+cache = LRUBackend()
+
+task_table = Task.__table__
+volunteer_table = Volunteer.__table__
+
+# the task columns with the assigned volunteer's name and version, which
+# are needed to format a task and to build its etag
+TASK_COLUMNS = [task_table.c.id, task_table.c.title, task_table.c.details,
+                task_table.c.date_needed, task_table.c.status,
+                task_table.c.volunteer_id, task_table.c.version,
+                volunteer_table.c.name.label('volunteer_name'),
+                volunteer_table.c.version.label('volunteer_version')]
+TASKS_WITH_VOLUNTEER = task_table.outerjoin(
+    volunteer_table, task_table.c.volunteer_id == volunteer_table.c.id)
+
+
+class TaskRow(SimpleNamespace):
+    # a task read by the async tier, formatted exactly as a Task
+    FIELDS, INCLUDES = Task.FIELDS, Task.INCLUDES
+    format = Task.format
+
+
+def task_row(row, volunteer=None):
+    # rows selected with only some of the fields have only those attributes
+    row = dict(row)
+    name = row.pop('volunteer_name', None)
+    row.pop('volunteer_version', None)
+    volunteer = volunteer or (SimpleNamespace(name=name)
+                              if name is not None else None)
+    return TaskRow(volunteers=volunteer, **row)
+
+
+def select_tasks(fields=None, include=None):
+    # selects the columns of fields, with the id and version that every
+    # route needs, as Task.query_fields() does
+    if fields is None and include is None:
+        return select(TASK_COLUMNS).select_from(TASKS_WITH_VOLUNTEER)
+    names = set(Task.FIELDS if fields is None else fields)
+    columns = [column for column in TASK_COLUMNS[:7]
+               if column.key in names | {'id', 'version'}]
+    if include is None or 'volunteer' in include:
+        return select(columns + TASK_COLUMNS[7:]) \
+            .select_from(TASKS_WITH_VOLUNTEER)
+    return select(columns)
+
+
+async def table_versions(*names):
+    rows = await database.fetch_all(
+        select([TableVersion.name, TableVersion.version])
+        .where(TableVersion.name.in_(names)))
+    versions = {row['name']: row['version'] for row in rows}
+    return tuple(versions.get(name, 0) for name in names)
+
+
+async def cached(key, versions, build):
+    # returns the value cached for key at versions, awaiting build() to
+    # create it if it is missing
+    full_key = repr((key, versions))
+    value = cache.get(full_key)
+    if value is None:
+        value = await build()
+        cache.set(full_key, value)
+    return value
+
+
+async def conditional(request, etag, build):
+    # the same as conditional_response in the Flask app
+    if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+        response = Response(status_code=304)
+    else:
+        response = JSONResponse(await build())
+    response.headers['ETag'] = quote_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def int_arg(request, name, default):
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        raise HTTPException(400)
+    if value < 1:
+        raise HTTPException(400)
+    return value
+
+
+def fieldset_args(request, model):
+    try:
+        return parse_fieldset(model, request.query_params.get('fields'),
+                              request.query_params.get('include'))
+    except ValueError:
+        raise HTTPException(400)
+
+
+'''
+Routes
+'''
+
+
+async def get_tasks(request):
+    limit = min(int_arg(request, 'limit', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+    cursor = request.query_params.get('cursor')
+    fields, include = fieldset_args(request, Task)
+
+    async def build_json():
+        async def build_page():
+            query = select_tasks(fields, include)
+            if cursor:
+                try:
+                    after = decode_cursor(cursor, [task_table.c.id])[0]
+                except BadRequest:
+                    raise HTTPException(400)
+                query = query.where(task_table.c.id > after)
+            rows = await database.fetch_all(
+                query.order_by(task_table.c.id).limit(limit + 1))
+            tasks = [task_row(row).format(fields, include)
+                     for row in rows[:limit]]
+            next_cursor = None
+            if len(rows) > limit:
+                next_cursor = encode_cursor([rows[limit - 1]['id']])
+            return tasks, next_cursor
+
+        tasks, next_cursor = await cached(
+            ('tasks', limit, cursor, fields, include), versions, build_page)
+        if not tasks and not cursor:
+            raise HTTPException(404)
+        return {'success': True, 'tasks': tasks, 'next_cursor': next_cursor}
+
+    versions = await table_versions('task', 'volunteer')
+    return await conditional(request,
+                             make_etag('tasks', limit, cursor, fields,
+                                       include, *versions),
+                             build_json)
+
+
+async def get_open_tasks(request):
+    async def build_list():
+        rows = await database.fetch_all(
+            select_tasks().where(task_table.c.status == 'Open')
+            .order_by(task_table.c.id))
+        return [task_row(row).format() for row in rows]
+
+    versions = await table_versions('task', 'volunteer')
+    tasks = await cached('open_tasks', versions, build_list)
+    return JSONResponse({'success': True, 'tasks': tasks})
+
+
+async def get_task(request):
+    fields, include = fieldset_args(request, Task)
+    # the volunteer's version is part of the etag whatever is included
+    row = await database.fetch_one(
+        select_tasks(fields, None if include is None else ('volunteer',))
+        .where(task_table.c.id == request.path_params['id']))
+    if row is None:
+        raise HTTPException(404)
+
+    async def build_json():
+        return {'success': True,
+                'task': task_row(row).format(fields, include)}
+
+    return await conditional(request, make_etag('task', fields, include,
+                                                row['version'],
+                                                row['volunteer_version']),
+                             build_json)
+
+
+def search_args(request):
+    term = request.query_params.get('search_term', '')
+    limit = min(int_arg(request, 'limit', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+    page = int_arg(request, 'page', 1)
+    return term, limit, page
+
+
+async def page_of_ids(statement, limit, page):
+    # one extra row is fetched to find out if there is another page
+    rows = await database.fetch_all(
+        statement.limit(limit + 1).offset((page - 1) * limit))
+    ids = [row[0] for row in rows]
+    return ids[:limit], len(ids) > limit
+
+
+async def search_tasks(request):
+    term, limit, page = search_args(request)
+    fields, include = fieldset_args(request, Task)
+    ids, has_more = await page_of_ids(search_backend.task_ids(term), limit,
+                                      page)
+    rows = []
+    if ids:
+        rows = await database.fetch_all(
+            select_tasks(fields, include).where(task_table.c.id.in_(ids)))
+    tasks = search.in_order([task_row(row) for row in rows], ids)
+    return JSONResponse({'success': True,
+                         'tasks': [task.format(fields, include)
+                                   for task in tasks],
+                         'page': page, 'has_more': has_more})
+
+
+ERROR_MESSAGES = {
+    400: 'Bad Request',
+    404: 'Resource Not Found',
+    405: 'Method Not Allowed',
+}
+
+
+async def http_error(request, exc):
+    return JSONResponse({
+        'success': False,
+        'error': exc.status_code,
+        'message': ERROR_MESSAGES.get(exc.status_code, exc.detail)
+    }, status_code=exc.status_code)
+
+
+def search_backend_for(url):
+    # the sqlite fts tables only exist in a database made by the
+    # migrations, so the async tier uses plain LIKE matching on SQLite
+    dialect = url.split(':', 1)[0].split('+', 1)[0]
+    if dialect == 'sqlite':
+        return search.LikeSearchBackend()
+    return search.backend_for(
+        'postgresql' if dialect.startswith('postgres') else dialect)
+
+
+search_backend = search_backend_for(ASYNC_DATABASE_URL)
+
+app = Starlette(
+    routes=[
+        Route('/tasks', get_tasks),
+        Route('/tasks/open', get_open_tasks),
+        Route('/tasks/search', search_tasks),
+        Route('/tasks/{id:int}', get_task),
+    ],
+    exception_handlers={HTTPException: http_error},
+    on_startup=[database.connect],
+    on_shutdown=[database.disconnect])
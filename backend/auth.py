@@ -1,14 +1,44 @@
 import os
+import ast
+import sys
 import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from flask import request, session
 from functools import wraps
-from jose import jwt
+from jose import jwt, jwk
 from urllib.request import urlopen
+from metrics import registry
 
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN')
-ALGORITHMS = os.environ.get('ALGORITHMS')
 API_AUDIENCE = os.environ.get('API_AUDIENCE')
 
+# JWKS cache settings, all in seconds
+JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', 3600))
+JWKS_REFRESH_AHEAD = int(os.environ.get('JWKS_REFRESH_AHEAD', 300))
+JWKS_REFRESH_COOLDOWN = int(os.environ.get('JWKS_REFRESH_COOLDOWN', 60))
+JWKS_FETCH_TIMEOUT = int(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+
+# verified token cache settings
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_MAX_TTL = int(os.environ.get('TOKEN_CACHE_MAX_TTL', 300))
+
+
+def parse_algorithms(value):
+    # ALGORITHMS is set as a list, ['RS256'], or as a single name
+    try:
+        algorithms = ast.literal_eval(value or '')
+    except (ValueError, SyntaxError):
+        algorithms = value
+    if isinstance(algorithms, str):
+        algorithms = [algorithms]
+    return [algorithm for algorithm in algorithms or [] if algorithm]
+
+
+ALGORITHMS = parse_algorithms(os.environ.get('ALGORITHMS'))
+
 '''
 AuthError Exception
 A standardized way to communicate auth failure modes
@@ -21,6 +51,227 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+'''
+JWKSCache
+Keeps the Auth0 signing keys in memory so that verifying a token does not
+need a round trip to Auth0.  The keys are refreshed in the background shortly
+before they expire, refreshed right away when a token names a kid that is not
+in the cache (at most once per cooldown period), and the last known keys are
+kept when a refresh fails.  A failed fetch is not retried until the cooldown
+has passed, even when there are no keys yet.  Only one thread fetches at a
+time: while it does, the others keep serving the stale keys, and only wait
+for it when there are no keys at all.  The keys are only ever built for one
+of the allowed ALGORITHMS, never for the alg a token claims.
+'''
+
+
+class JWKSCache:
+    def __init__(self, url, ttl=JWKS_CACHE_TTL,
+                 refresh_ahead=JWKS_REFRESH_AHEAD,
+                 cooldown=JWKS_REFRESH_COOLDOWN,
+                 timeout=JWKS_FETCH_TIMEOUT,
+                 algorithms=ALGORITHMS):
+        self.url = url
+        self.algorithms = algorithms
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.fetches = 0
+        self.failures = 0
+        self.clear()
+
+    def clear(self):
+        # forget all keys
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._jwks = None
+        self._keys = {}
+        self._parsed = {}
+        self._expires_at = 0
+        self._last_forced = 0
+        self._refreshing = False
+
+    def fetch(self):
+        self.fetches += 1
+        jsonurl = urlopen(self.url, timeout=self.timeout)
+        return json.loads(jsonurl.read())
+
+    def after_fork(self):
+        # keeps the keys fetched before a fork, but not the lock or the
+        # refreshing flag, which belong to the parent's threads
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self):
+        # fetches the jwks and replaces the cached keys.  Returns False and
+        # keeps the current keys if Auth0 could not be reached
+        try:
+            jwks = self.fetch()
+            keys = {key['kid']: key for key in jwks['keys']}
+        except Exception:
+            self.failures += 1
+            print('JWKS refresh failed', sys.exc_info())
+            with self._lock:
+                self._refreshing = False
+                # try again after the cooldown instead of on every call
+                self._expires_at = time.time() + self.cooldown
+            return False
+
+        with self._lock:
+            self._jwks = jwks
+            self._keys = keys
+            self._parsed = {}
+            self._expires_at = time.time() + self.ttl
+            self._refreshing = False
+        return True
+
+    def get_jwks(self):
+        now = time.time()
+        if now >= self._expires_at:
+            # the keys are stale.  One caller refreshes them while the
+            # others serve the stale keys, or wait if there are none yet
+            if self._fetch_lock.acquire(blocking=self._jwks is None):
+                try:
+                    # another caller may have refreshed while we waited
+                    if time.time() >= self._expires_at:
+                        self.refresh()
+                finally:
+                    self._fetch_lock.release()
+        elif now >= self._expires_at - self.refresh_ahead:
+            self._refresh_in_background()
+
+        if self._jwks is None:
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch the signing keys.'
+            }, 503)
+        return self._jwks
+
+    def get_key(self, kid):
+        # returns the parsed public key for kid, or None if Auth0 does not
+        # know about it
+        self.get_jwks()
+        if kid not in self._keys and self._may_force_refresh():
+            self._locked_refresh()
+
+        key = self._parsed.get(kid)
+        if key is None and kid in self._keys:
+            key_data = self._keys[kid]
+            algorithm = key_data.get('alg', self.algorithms[0]
+                                     if self.algorithms else None)
+            if algorithm not in self.algorithms:
+                raise AuthError({
+                    'code': 'invalid_header',
+                    'description': 'Unsupported signing algorithm.'
+                }, 401)
+            try:
+                key = jwk.construct({
+                    'kty': key_data['kty'],
+                    'kid': key_data['kid'],
+                    'use': key_data['use'],
+                    'n': key_data['n'],
+                    'e': key_data['e']
+                }, algorithm)
+            except Exception:
+                raise AuthError({
+                    'code': 'invalid_header',
+                    'description': 'Unable to parse the signing key.'
+                }, 401)
+            self._parsed[kid] = key
+        return key
+
+    def _may_force_refresh(self):
+        # an unknown kid forces a refresh, but only once per cooldown so
+        # that a stream of bad tokens cannot hammer Auth0
+        with self._lock:
+            now = time.time()
+            if now - self._last_forced < self.cooldown:
+                return False
+            self._last_forced = now
+            return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        thread = threading.Thread(target=self._locked_refresh, daemon=True)
+        thread.start()
+
+    def _locked_refresh(self):
+        with self._fetch_lock:
+            self.refresh()
+
+
+jwks_cache = JWKSCache(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+
+'''
+TokenCache
+A bounded LRU cache of the payloads of tokens that have already been
+verified.  Entries are keyed by a hash of the token, so the tokens themselves
+are not kept in memory, and are only valid until the token's exp claim or
+max_ttl seconds, whichever comes first.
+'''
+
+
+class TokenCache:
+    def __init__(self, max_size=TOKEN_CACHE_SIZE, max_ttl=TOKEN_CACHE_MAX_TTL):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.clear()
+
+    def clear(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires_at = entry
+                if time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, token, payload):
+        expires_at = time.time() + self.max_ttl
+        if 'exp' in payload:
+            expires_at = min(expires_at, payload['exp'])
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+token_cache = TokenCache()
+
+
 def get_token_auth_header():
     auth = request.headers.get('Authorization', None)
     if not auth:
@@ -66,30 +317,32 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except Exception:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
     if rsa_key:
+        # hand jose the already parsed public key so it does not rebuild it
+        # from the jwk on every decode
+        prepared_key = getattr(rsa_key, 'prepared_key', None)
+        if prepared_key is not None:
+            key = [prepared_key]
+        else:
+            key = rsa_key.to_dict()
         try:
             payload = jwt.decode(
                 token,
-                rsa_key,
+                key,
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
                 issuer='https://' + AUTH0_DOMAIN + '/'
@@ -119,6 +372,21 @@ def verify_decode_jwt(token):
     }, 400)
 
 
+def get_verified_payload(token):
+    # returns the payload of token, only verifying the signature and claims
+    # the first time the token is seen
+    payload = token_cache.get(token)
+    if payload is None:
+        start = time.perf_counter()
+        try:
+            payload = verify_decode_jwt(token)
+        finally:
+            registry.observe('auth_verify_seconds',
+                             time.perf_counter() - start)
+        token_cache.put(token, payload)
+    return payload
+
+
 def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
@@ -126,7 +394,7 @@ def requires_auth(permission=''):
             token = session.get('jwt_token')
             if not token:
                 token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
+            payload = get_verified_payload(token)
             check_permissions(permission, payload)
             return f(*args, **kwargs)
 
@@ -135,8 +403,32 @@ def requires_auth(permission=''):
 
 
 def has_permission(token, permission):
-    payload = verify_decode_jwt(token)
-    if payload['permissions'] and permission in payload['permissions']:
+    payload = get_verified_payload(token)
+    if payload.get('permissions') and permission in payload['permissions']:
         return True
 
     return False
+
+
+# the session flags used by the templates to hide buttons, and the
+# permission each one requires
+UI_PERMISSION_FLAGS = {
+    'delete_task_ok': 'delete:task',
+    'delete_vol_ok': 'delete:volunteer',
+    'add_task_ok': 'post:task',
+    'add_vol_ok': 'post:volunteer',
+    'update_task_ok': 'patch:task',
+}
+
+
+def get_permission_snapshot(token):
+    # decodes the token once and returns every permission flag the gui
+    # needs.  public_user is a bool, the other flags are the strings 'True'
+    # or 'False' because that is what the templates compare against
+    payload = get_verified_payload(token)
+    permissions = payload.get('permissions') or []
+
+    snapshot = {'public_user': 'get:volunteer' not in permissions}
+    for flag, permission in UI_PERMISSION_FLAGS.items():
+        snapshot[flag] = str(permission in permissions)
+    return snapshot
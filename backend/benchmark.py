@@ -0,0 +1,505 @@
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+from models import db, Task, Volunteer
+from pagination import encode_cursor
+from datagen import WORDS, FIRST_NAMES
+from validation import TASK_STATUSES
+
+# file the results of the last good run are kept in
+BENCHMARK_BASELINE = os.environ.get('BENCHMARK_BASELINE',
+                                    'benchmark_baseline.json')
+# fraction by which a route may get slower, or lose throughput, before the
+# run counts as a regression
+BENCHMARK_THRESHOLD = float(os.environ.get('BENCHMARK_THRESHOLD', 0.2))
+
+'''
+Benchmarks
+run_benchmark() sends requests to the app through its WSGI interface from
+several threads at once, one route family at a time, and records the
+throughput and the latency percentiles of each family.  The ids used are
+picked from the database, and the search terms from the words that datagen
+builds its rows from, so a run works against any data set.  With
+server='asgi' the same requests go to the async tier instead, as tasks on
+one event loop.
+
+To compare the memory the two tiers need, a run with workers set starts the
+tier as its own gunicorn server with that many worker processes, each
+limited to memory_limit_mb when it is given, and sends the requests over
+HTTP.  The peak RSS of the master and of every worker is read from /proc
+before the server is stopped, so the benchmark's own memory is not counted.
+Without workers the requests go to the tier in this process, and only the
+peak memory of the whole process is recorded.
+
+The results of a run are compared against the last good run, kept as JSON
+in BENCHMARK_BASELINE.  A family whose p95 latency rises, or whose
+throughput falls, by more than BENCHMARK_THRESHOLD is a regression.
+Timings are only comparable between runs on the same machine with the same
+data set, so a baseline recorded with a different number of rows is not
+compared.
+'''
+
+
+def sample_ids(model, count=1000):
+    # returns about count ids of model spread across the whole table,
+    # without reading every id into memory
+    step = max(model.query.count() // count, 1)
+    return [row[0] for row in db.session.query(model.id)
+            .filter(model.id % step == 0).order_by(model.id).limit(count)]
+
+
+'''
+Route families
+Each family builds a request from the sampled ids, a random number
+generator and the auth headers.  Families marked as writes change the data,
+so they are left out of a run unless it asks for them: the seeded data stays
+the same from run to run and the timings stay comparable.
+'''
+
+
+def tasks_page(rng, ids, headers):
+    cursor = encode_cursor([rng.choice(ids['task'])])
+    return 'GET', '/tasks?limit=50&cursor=' + cursor, None, headers
+
+
+def open_tasks(rng, ids, headers):
+    return 'GET', '/tasks/open', None, {}
+
+
+def task_detail(rng, ids, headers):
+    return 'GET', '/tasks/{}'.format(rng.choice(ids['task'])), None, headers
+
+
+def task_search(rng, ids, headers):
+    return ('GET', '/tasks/search?format=json&search_term=' +
+            rng.choice(WORDS), None, headers)
+
+
+def volunteers_page(rng, ids, headers):
+    return 'GET', '/volunteers?limit=50', None, headers
+
+
+def volunteer_detail(rng, ids, headers):
+    return ('GET', '/volunteers/{}'.format(rng.choice(ids['volunteer'])),
+            None, headers)
+
+
+def volunteer_search(rng, ids, headers):
+    return ('GET', '/volunteers/search?format=json&search_term=' +
+            rng.choice(FIRST_NAMES), None, headers)
+
+
+def task_update(rng, ids, headers):
+    return ('PATCH', '/tasks/{}'.format(rng.choice(ids['task'])),
+            {'status': rng.choice(TASK_STATUSES)}, headers)
+
+
+# name: (build request, needs a token, writes, served by the async tier)
+ROUTE_FAMILIES = {
+    'tasks page': (tasks_page, False, False, True),
+    'open tasks': (open_tasks, False, False, True),
+    'task detail': (task_detail, False, False, True),
+    'task search': (task_search, False, False, True),
+    'volunteers page': (volunteers_page, True, False, False),
+    'volunteer detail': (volunteer_detail, True, False, False),
+    'volunteer search': (volunteer_search, True, False, False),
+    'task update': (task_update, True, True, False),
+}
+
+
+def percentile(values, fraction):
+    # the nearest rank percentile of a sorted list
+    if not values:
+        return None
+    rank = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(latencies, errors, wall):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / wall if wall else 0,
+        'mean': sum(latencies) / len(latencies) if latencies else None,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+def wsgi_sender(app):
+    # returns a function that sends one request to the Flask app and returns
+    # its status code.  Without cookies, so the html session flag set by
+    # /tasks/open does not change what the other routes return
+    client = app.test_client(use_cookies=False)
+
+    def send(method, path, body, headers):
+        res = client.open(path, method=method, json=body, headers=headers)
+        res.get_data()
+        return res.status_code
+    return send
+
+
+def http_sender(base_url):
+    # the same as wsgi_sender, for a server listening on base_url
+    client = httpx.Client(base_url=base_url, timeout=60)
+
+    def send(method, path, body, headers):
+        return client.request(method, path, json=body,
+                              headers=headers).status_code
+    return send
+
+
+def run_family(sender, build, ids, headers, requests, concurrency,
+               seed_value):
+    # sends requests requests built by build from concurrency threads, each
+    # with its own sender(), and returns the family's results
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(number):
+        rng = random.Random('{}-{}'.format(seed_value, number))
+        send = sender()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            method, path, body, request_headers = build(rng, ids, headers)
+            start = time.perf_counter()
+            status_code = send(method, path, body, request_headers)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if status_code >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+async def run_async_family(client, build, ids, headers, requests,
+                           concurrency, seed_value):
+    # the same as run_family, with concurrency tasks on one event loop
+    # sending requests to the async tier
+    latencies = []
+    errors = [0]
+    remaining = [requests]
+
+    async def worker(number):
+        rng = random.Random('{}-{}'.format(seed_value, number))
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            method, path, body, request_headers = build(rng, ids, headers)
+            start = time.perf_counter()
+            res = await client.request(method, path, json=body,
+                                       headers=request_headers)
+            latencies.append(time.perf_counter() - start)
+            if res.status_code >= 400:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+async def run_async_families(families, ids, headers, requests, concurrency,
+                             warmup, seed_value):
+    # benchmarks the async tier in this process.  It is only imported here,
+    # so that benchmarking the Flask app does not load it
+    from asgi import app as asgi_app
+    results = {}
+    await asgi_app.router.startup()
+    try:
+        async with httpx.AsyncClient(app=asgi_app,
+                                     base_url='http://benchmark') as client:
+            for name in families:
+                build = ROUTE_FAMILIES[name][0]
+                await run_async_family(client, build, ids, headers, warmup,
+                                       1, seed_value)
+                results[name] = await run_async_family(
+                    client, build, ids, headers, requests, concurrency,
+                    seed_value)
+    finally:
+        await asgi_app.router.shutdown()
+    return results
+
+
+def max_rss_mb():
+    # the most memory this process has used, in megabytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+'''
+Server processes
+serve() runs either tier under gunicorn with the same number of worker
+processes, the Flask app on the workers of its production profile and the
+async tier on uvicorn workers.
+'''
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the gunicorn worker class, app and settings file of each tier.  The Flask
+# app runs with the production profile, which preloads and warms it; the
+# async tier has no settings file of its own
+SERVERS = {
+    'wsgi': ('sync', 'app:app', os.path.join(BACKEND_DIR, 'gunicorn.conf.py')),
+    'asgi': ('uvicorn.workers.UvicornWorker', 'asgi:app', None),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def limit_memory(memory_limit_mb):
+    # returns a function that limits the address space of the process it
+    # runs in, which gunicorn's workers inherit
+    def limit():
+        size = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (size, size))
+    return limit
+
+
+def child_pids(pid):
+    # the pids of pid's child processes, from /proc
+    children = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name)) as f:
+                # the parent pid follows the command name, which may itself
+                # contain spaces but ends with the last ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(name))
+    return sorted(children)
+
+
+def peak_rss_mb(pid):
+    # the most memory process pid has used, in megabytes, or None if it is
+    # not known
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def process_memory(pid):
+    # the peak memory of the server process pid and of each of its workers
+    return [{'pid': process, 'role': 'master' if process == pid else 'worker',
+             'max_rss_mb': peak_rss_mb(process)}
+            for process in [pid] + child_pids(pid)]
+
+
+@contextmanager
+def serve(server, workers, memory_limit_mb=None, timeout=30):
+    # starts the tier as a gunicorn server with workers worker processes
+    # and yields its process and base url, stopping it afterwards
+    worker_class, app_path, config = SERVERS[server]
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn.app.wsgiapp',
+               '--chdir', BACKEND_DIR, '--workers', str(workers),
+               '--worker-class', worker_class,
+               '--bind', '127.0.0.1:{}'.format(port)]
+    if config:
+        command += ['--config', config]
+    # started from the directory above, so that gunicorn does not pick up
+    # the Flask app's settings file for the async tier
+    process = subprocess.Popen(
+        command + [app_path], cwd=os.path.dirname(BACKEND_DIR),
+        preexec_fn=limit_memory(memory_limit_mb) if memory_limit_mb
+        else None)
+    base_url = 'http://127.0.0.1:{}'.format(port)
+    try:
+        # wait until every worker has started and the server answers
+        deadline = time.time() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError('The {} server exited with code {}'
+                                   .format(server, process.returncode))
+            try:
+                if len(child_pids(process.pid)) >= workers:
+                    httpx.get(base_url + '/tasks/open', timeout=timeout)
+                    break
+            except httpx.TransportError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError('The {} server did not start'
+                                   .format(server))
+            time.sleep(0.1)
+        yield process, base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_benchmark(app, requests=200, concurrency=8, families=None,
+                  token=None, writes=False, warmup=5, seed_value=0,
+                  server='wsgi', workers=None, memory_limit_mb=None):
+    # benchmarks each route family in turn and returns the results.  token
+    # is sent as a bearer token; families that need one are skipped without
+    # it, as are the families that write unless writes is True.  With
+    # server='asgi' the async tier is benchmarked instead of the Flask app,
+    # and the families it does not serve are skipped.  With workers the tier
+    # runs as its own server, see serve()
+    families = families or list(ROUTE_FAMILIES)
+    headers = {}
+    if token:
+        headers['Authorization'] = 'Bearer ' + token
+
+    with app.app_context():
+        ids = {'task': sample_ids(Task),
+               'volunteer': sample_ids(Volunteer)}
+        meta = {'tasks': Task.query.count(),
+                'volunteers': Volunteer.query.count(),
+                'database': db.engine.dialect.name}
+        db.session.remove()
+
+    results = {
+        'meta': dict(meta, **{
+            'server': server,
+            'workers': workers,
+            'memory_limit_mb': memory_limit_mb,
+            'requests': requests,
+            'concurrency': concurrency,
+            'python': platform.python_version(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }),
+        'routes': {},
+        'skipped': [],
+    }
+    runnable = []
+    for name in families:
+        build, needs_token, writes_data, async_tier = ROUTE_FAMILIES[name]
+        if (needs_token and not token) or (writes_data and not writes) or \
+                (server == 'asgi' and not async_tier) or \
+                not ids['task'] or not ids['volunteer']:
+            results['skipped'].append(name)
+        else:
+            runnable.append(name)
+
+    def run_families(sender):
+        for name in runnable:
+            build = ROUTE_FAMILIES[name][0]
+            # a few requests first, so caches and connections are warm
+            run_family(sender, build, ids, headers, warmup, 1, seed_value)
+            results['routes'][name] = run_family(sender, build, ids, headers,
+                                                 requests, concurrency,
+                                                 seed_value)
+
+    if workers:
+        with serve(server, workers, memory_limit_mb) as (process, base_url):
+            run_families(lambda: http_sender(base_url))
+            processes = process_memory(process.pid)
+        results['meta']['processes'] = processes
+        results['meta']['max_rss_mb'] = sum(
+            process['max_rss_mb'] or 0 for process in processes)
+    elif server == 'asgi':
+        results['routes'] = asyncio.run(run_async_families(
+            runnable, ids, headers, requests, concurrency, warmup,
+            seed_value))
+        results['meta']['max_rss_mb'] = max_rss_mb()
+    else:
+        run_families(lambda: wsgi_sender(app))
+        results['meta']['max_rss_mb'] = max_rss_mb()
+    return results
+
+
+def comparable(baseline, results):
+    # timings are only comparable for the same server, run the same way, on
+    # the same database with the same data
+    return all(baseline['meta'].get(key) == results['meta'].get(key)
+               for key in ('tasks', 'volunteers', 'database', 'server',
+                           'workers', 'memory_limit_mb'))
+
+
+def compare(baseline, results, threshold=BENCHMARK_THRESHOLD):
+    # returns a list of the route families that regressed since baseline
+    problems = []
+    for name, current in results['routes'].items():
+        previous = baseline['routes'].get(name)
+        if not previous:
+            continue
+        if current['errors'] > previous['errors']:
+            problems.append('{}: {} errors, up from {}'.format(
+                name, current['errors'], previous['errors']))
+        if previous['p95'] and \
+                current['p95'] > previous['p95'] * (1 + threshold):
+            problems.append('{}: p95 {:.1f}ms, up from {:.1f}ms'.format(
+                name, current['p95'] * 1000, previous['p95'] * 1000))
+        if current['throughput'] < previous['throughput'] * (1 - threshold):
+            problems.append('{}: {:.1f} requests/s, down from {:.1f}'.format(
+                name, current['throughput'], previous['throughput']))
+    return problems
+
+
+def load_baseline(path=BENCHMARK_BASELINE):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BENCHMARK_BASELINE):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def format_results(results):
+    # returns the results as a table for the console
+    lines = ['{:<18} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9}'.format(
+        'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms',
+        'p99 ms')]
+    for name, route in results['routes'].items():
+        lines.append('{:<18} {:>8} {:>7} {:>10.1f} {:>9.1f} {:>9.1f} '
+                     '{:>9.1f}'.format(name, route['requests'],
+                                       route['errors'], route['throughput'],
+                                       route['p50'] * 1000,
+                                       route['p95'] * 1000,
+                                       route['p99'] * 1000))
+    for name in results['skipped']:
+        lines.append('{:<18} skipped'.format(name))
+    meta = results['meta']
+    for process in meta.get('processes', []):
+        lines.append('{:<6} {:>8} peak memory {}'.format(
+            process['role'], process['pid'],
+            'unknown' if process['max_rss_mb'] is None
+            else '{:.0f}MB'.format(process['max_rss_mb'])))
+    where = meta['server']
+    if meta.get('workers'):
+        where = '{} with {} workers'.format(where, meta['workers'])
+        if meta.get('memory_limit_mb'):
+            where += ' limited to {}MB each'.format(meta['memory_limit_mb'])
+    lines.append('Peak memory {:.0f}MB with {} concurrent clients on {}'
+                 .format(meta['max_rss_mb'], meta['concurrency'], where))
+    return '\n'.join(lines)
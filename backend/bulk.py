@@ -0,0 +1,191 @@
+import os
+import sys
+from collections import Counter
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Task, Volunteer, TableVersion
+from stats import task_keys, add_counts
+
+# largest number of items accepted by one bulk request
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 1000))
+# rows sent in each multi-row INSERT statement
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 500))
+
+'''
+Bulk inserts
+Every item is validated first, then all of the valid rows are inserted in
+one transaction.  On PostgreSQL each chunk of rows is a single
+INSERT ... VALUES (...), (...) RETURNING id statement, so 2,000 items take a
+handful of statements and one commit instead of 2,000 of each.  Other
+databases insert the rows one statement at a time, still in one transaction.
+
+In atomic mode nothing is inserted unless every item is valid.  In partial
+mode the valid items are inserted and the invalid ones are reported.  If the
+database rejects the batch in partial mode, each row is retried in its own
+savepoint so that only the rows it rejects are lost.
+'''
+
+
+def insert_rows(table, rows):
+    # inserts rows, a list of column dicts, and returns their ids in the same
+    # order.  The caller commits
+    ids = []
+    if db.engine.dialect.name == 'postgresql':
+        for start in range(0, len(rows), BULK_CHUNK_SIZE):
+            chunk = rows[start:start + BULK_CHUNK_SIZE]
+            result = db.session.execute(table.insert().values(chunk)
+                                        .returning(table.c.id))
+            ids.extend(row[0] for row in result)
+    else:
+        for row in rows:
+            result = db.session.execute(table.insert().values(row))
+            ids.append(result.inserted_primary_key[0])
+    return ids
+
+
+def insert_rows_one_by_one(table, rows):
+    # inserts each row in its own savepoint.  Returns a list holding the id
+    # of each row, or None for a row that the database rejected
+    ids = []
+    for row in rows:
+        savepoint = db.session.begin_nested()
+        try:
+            result = db.session.execute(table.insert().values(row))
+            savepoint.commit()
+            ids.append(result.inserted_primary_key[0])
+        except SQLAlchemyError:
+            print('Bulk insert error', sys.exc_info())
+            savepoint.rollback()
+            ids.append(None)
+    return ids
+
+
+def bulk_create(model, items, validate, atomic=True):
+    # validates and inserts items, a list of request objects.  Returns
+    # (created, results) where results holds one dict per item, in order.
+    # Raises SQLAlchemyError if the database rejects an atomic batch
+    table = model.__table__
+    results = []
+    valid = []
+    for index, item in enumerate(items):
+        values, errors = validate(item)
+        if errors:
+            results.append({'index': index, 'success': False,
+                            'errors': errors})
+        else:
+            results.append({'index': index, 'success': False})
+            valid.append((index, values))
+
+    if not valid or (atomic and len(valid) < len(items)):
+        return 0, results
+
+    rows = [values for index, values in valid]
+    try:
+        ids = insert_rows(table, rows)
+    except SQLAlchemyError:
+        db.session.rollback()
+        if atomic:
+            raise
+        ids = insert_rows_one_by_one(table, rows)
+
+    created = 0
+    for (index, values), new_id in zip(valid, ids):
+        if new_id is None:
+            results[index]['errors'] = {
+                model.__tablename__: 'was rejected by the database'}
+        else:
+            results[index] = {'index': index, 'success': True, 'id': new_id}
+            created += 1
+
+    # these statements bypass the orm, so the change counters and the task
+    # counts are updated here rather than by the flush listeners
+    if created:
+        TableVersion.bump(db.session, [model.__tablename__])
+    if created and model is Task:
+        counts = Counter()
+        for (index, values), new_id in zip(valid, ids):
+            if new_id is not None:
+                counts.update(task_keys(values['status'],
+                                        values['date_needed'],
+                                        values.get('volunteer_id')))
+        add_counts(db.session, counts)
+    db.session.commit()
+    return created, results
+
+
+def bulk_assign(changes):
+    # applies changes, a list of validated assignment values, to the tasks
+    # in one transaction.  Returns (tasks, results): the updated tasks, or
+    # None if any change was rejected, and one result per change
+    results = [{'index': index, 'success': True}
+               for index in range(len(changes))]
+
+    # every referenced task and volunteer is checked with one query each.
+    # The tasks' current values are needed to move their counts, so the
+    # tasks are locked, in id order, until the commit; a write made between
+    # this read and the update would otherwise be counted from old values
+    task_ids = [change['task_id'] for change in changes]
+    volunteer_ids = {change['volunteer_id'] for change in changes
+                     if change.get('volunteer_id') is not None}
+    found_tasks = {row[0]: row for row in db.session.query(
+        Task.id, Task.status, Task.date_needed, Task.volunteer_id)
+        .filter(Task.id.in_(task_ids)).order_by(Task.id)
+        .with_for_update()}
+    found_volunteers = set()
+    if volunteer_ids:
+        found_volunteers = {row[0] for row in db.session.query(Volunteer.id)
+                            .filter(Volunteer.id.in_(volunteer_ids))}
+
+    seen = set()
+    for index, change in enumerate(changes):
+        errors = {}
+        if change['task_id'] in seen:
+            errors['task_id'] = 'is changed more than once'
+        elif change['task_id'] not in found_tasks:
+            errors['task_id'] = 'was not found'
+        seen.add(change['task_id'])
+        volunteer_id = change.get('volunteer_id')
+        if volunteer_id is not None and volunteer_id not in found_volunteers:
+            errors['volunteer_id'] = 'was not found'
+        if errors:
+            results[index] = {'index': index, 'success': False,
+                              'errors': errors}
+    if not all(result['success'] for result in results):
+        return None, results
+
+    # changes that set the same values are applied together, so assigning a
+    # weekend's tasks to a few volunteers takes a few UPDATE ... WHERE id IN
+    # statements rather than one per task
+    groups = {}
+    for change in changes:
+        values = tuple(sorted((column, value)
+                              for column, value in change.items()
+                              if column != 'task_id'))
+        groups.setdefault(values, []).append(change['task_id'])
+
+    table = Task.__table__
+    for values, ids in groups.items():
+        # the row versions are incremented by hand, as the orm would
+        db.session.execute(table.update()
+                           .where(table.c.id.in_(ids))
+                           .values(version=table.c.version + 1,
+                                   **dict(values)))
+
+    counts = Counter()
+    for change in changes:
+        task = found_tasks[change['task_id']]
+        counts.subtract(task_keys(task.status, task.date_needed,
+                                  task.volunteer_id))
+        counts.update(task_keys(change.get('status', task.status),
+                                task.date_needed,
+                                change.get('volunteer_id',
+                                           task.volunteer_id)))
+
+    # these statements bypass the orm, so the change counter and the task
+    # counts are updated here rather than by the flush listeners
+    TableVersion.bump(db.session, ['task'])
+    add_counts(db.session, counts)
+    db.session.commit()
+
+    tasks = Task.query_with_volunteer().filter(Task.id.in_(task_ids)) \
+        .order_by(Task.id).all()
+    return tasks, results
@@ -0,0 +1,169 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# lru keeps the entries in each worker's memory, redis shares them between
+# all of the workers, none turns the cache off
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'lru')
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL',
+                                    'redis://localhost:6379/0')
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+
+'''
+Response cache
+Caches the formatted results of the public task lists and of the other
+read only lookups that every page needs.  The callers put the versions of
+the tables a value was built from (TableVersion.current) in its key.  Every
+write to a table increments that table's version in the same transaction,
+whichever worker or command makes it, so later lookups use a new key and
+the stale entries are never read again; they simply age out of the cache.
+
+The backend is chosen by RESPONSE_CACHE_BACKEND.  The hits and misses of
+each worker are reported on /metrics.
+'''
+
+
+class LRUBackend:
+    # in process backend, holding at most max_size entries
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def after_fork(self):
+        # keeps the entries cached before a fork with a lock of its own
+        self._lock = threading.Lock()
+
+
+class RedisBackend:
+    # backend shared by every worker.  Entries expire after ttl seconds, and
+    # the server should be set to evict the least recently used keys when it
+    # is full.  Needs the redis package
+    def __init__(self, url=RESPONSE_CACHE_URL, ttl=RESPONSE_CACHE_TTL,
+                 prefix='response_cache:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.max_size = None
+
+    def __len__(self):
+        # scans every key, so it is only used by stats()
+        return sum(1 for _ in self.client.scan_iter(self.prefix + '*'))
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def after_fork(self):
+        # the client notices by itself that it has been forked, and opens
+        # new connections
+        pass
+
+
+class NullBackend:
+    # caches nothing, so every lookup builds its value
+    max_size = 0
+
+    def __len__(self):
+        return 0
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+    def after_fork(self):
+        pass
+
+
+BACKENDS = {
+    'lru': LRUBackend,
+    'redis': RedisBackend,
+    'none': NullBackend,
+}
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_set(self, key, build):
+        # returns the cached value for key, calling build() to create it if
+        # it is missing.  key must include the versions of the tables the
+        # value is built from
+        full_key = repr(key)
+        value = self.backend.get(full_key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = build()
+        self.backend.set(full_key, value)
+        return value
+
+    def clear(self):
+        self.backend.clear()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.backend),
+            'max_size': getattr(self.backend, 'max_size', None),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+def make_backend(name=RESPONSE_CACHE_BACKEND):
+    # returns a new backend of the type named by RESPONSE_CACHE_BACKEND
+    if name not in BACKENDS:
+        raise ValueError('RESPONSE_CACHE_BACKEND must be one of ' +
+                         ', '.join(sorted(BACKENDS)))
+    return BACKENDS[name]()
+
+
+response_cache = ResponseCache(make_backend())
@@ -0,0 +1,31 @@
+import hashlib
+from flask import request, make_response
+
+'''
+Conditional responses
+Etags are built from version counters rather than from the response body:
+each task and volunteer row has a version column that is incremented by
+every update, and the table_version table counts the changes to each whole
+table.  Checking whether a client's copy is current therefore costs one
+small query and no serialization.  When the client sends a matching
+If-None-Match header an empty 304 response is returned instead of the body.
+'''
+
+
+def make_etag(*parts):
+    # returns an etag for the given versions and request arguments
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def conditional_response(etag, build):
+    # returns 304 if the client already has the version identified by etag,
+    # otherwise the response made from build()
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    # the responses depend on the caller's permissions, so shared caches
+    # must not keep them, and clients must revalidate before reusing them
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,219 @@
+import csv
+import io
+import os
+import sys
+import time
+import numpy as np
+from datetime import date
+from models import db, Task, Volunteer, TableVersion
+from forms import VolunteerForm
+from validation import TASK_STATUSES
+from stats import rebuild_stats
+
+# rows generated and written at a time
+DATAGEN_CHUNK_SIZE = int(os.environ.get('DATAGEN_CHUNK_SIZE', 100000))
+# task dates are spread around this date, so that the same seed gives the
+# same rows on any day
+DATAGEN_START = date(2020, 6, 1)
+
+'''
+Synthetic data
+Generates tasks and volunteers at volume for scaling tests and benchmarks.
+Every column of a chunk is sampled at once with NumPy, and each chunk is
+written with COPY on PostgreSQL or one executemany insert elsewhere, so
+millions of rows take seconds rather than the hours that ORM inserts would.
+
+The rows pass the same checks as the forms: phone numbers are xxx-xxx-xxxx,
+states come from VolunteerForm's choices and zip codes have five digits.
+Task dates are spread over two years around the start date, most of them in
+the weeks after it.  Tasks in the past are mostly Complete, the ones in the
+future are Open or Filled, and every Filled or Complete task has a
+volunteer, with a few busy volunteers taking many of the tasks.
+
+The same seed, start date and chunk size always give the same rows.
+'''
+
+# the sizes that can be given by name
+SIZES = {'1k': 1000, '100k': 100000, '1M': 1000000}
+
+WORDS = ['food', 'pantry', 'delivery', 'school', 'lunch', 'weekend',
+         'backpack', 'sort', 'pack', 'drive', 'garden', 'kitchen', 'market',
+         'truck', 'shelter', 'summer', 'breakfast', 'snack', 'fruit',
+         'bread']
+FIRST_NAMES = ['Ann', 'Ben', 'Carla', 'Dev', 'Emma', 'Farid', 'Grace',
+               'Hugo', 'Iris', 'Jamal', 'Kim', 'Luis', 'Maya', 'Nate',
+               'Olga', 'Priya', 'Quinn', 'Rosa', 'Sam', 'Tara']
+LAST_NAMES = ['Adams', 'Baker', 'Chen', 'Diaz', 'Evans', 'Ford', 'Garcia',
+              'Hill', 'Ito', 'Jones', 'Khan', 'Lopez', 'Moore', 'Nguyen',
+              'Ortiz', 'Patel', 'Reed', 'Smith', 'Turner', 'Young']
+CITIES = ['Springfield', 'Franklin', 'Greenville', 'Bristol', 'Clinton',
+          'Fairview', 'Salem', 'Madison', 'Georgetown', 'Arlington']
+STREETS = ['Main St', 'Oak Ave', 'Pine St', 'Maple Dr', 'Cedar Ln',
+           'Elm St', 'Park Rd', 'Lake Dr', 'Hill Rd', 'Church St']
+STATES = [value for value, label in VolunteerForm.state.kwargs['choices']]
+
+# chance of each status, in the order of TASK_STATUSES, for tasks needed
+# before and after the start date
+PAST_STATUS_WEIGHTS = [0.05, 0.15, 0.80]
+FUTURE_STATUS_WEIGHTS = [0.60, 0.40, 0.00]
+
+
+def parse_size(size):
+    # returns the number of rows for a size such as 1000, '100k' or '1M'
+    if size in SIZES:
+        return SIZES[size]
+    size = str(size)
+    multiplier = 1
+    if size[-1:] in ('k', 'K'):
+        multiplier, size = 1000, size[:-1]
+    elif size[-1:] in ('m', 'M'):
+        multiplier, size = 1000000, size[:-1]
+    return int(float(size) * multiplier)
+
+
+def chunk_rng(seed, table, number):
+    # every chunk has its own generator, so a chunk's rows depend only on
+    # the seed and the chunk's position
+    return np.random.default_rng([seed, table, number])
+
+
+def join(*parts):
+    # joins arrays of strings element by element
+    result = parts[0]
+    for part in parts[1:]:
+        result = np.char.add(result, part)
+    return result
+
+
+def digits(rng, low, high, count, width):
+    # random zero padded numbers between low and high as strings
+    return np.char.zfill(rng.integers(low, high, count).astype(str), width)
+
+
+def volunteer_columns(rng, count):
+    # returns {column: list of values} for count volunteers
+    names = join(rng.choice(FIRST_NAMES, count), ' ',
+                 rng.choice(LAST_NAMES, count))
+    addresses = join(rng.integers(1, 10000, count).astype(str), ' ',
+                     rng.choice(STREETS, count))
+    phones = join(digits(rng, 201, 990, count, 3), '-',
+                  digits(rng, 200, 1000, count, 3), '-',
+                  digits(rng, 0, 10000, count, 4))
+    return {
+        'name': names.tolist(),
+        'address': addresses.tolist(),
+        'city': rng.choice(CITIES, count).tolist(),
+        'state': rng.choice(STATES, count).tolist(),
+        'zip_code': digits(rng, 501, 99951, count, 5).tolist(),
+        'phone_number': phones.tolist(),
+    }
+
+
+def task_columns(rng, count, volunteer_ids, start):
+    # returns {column: list of values} for count tasks.  volunteer_ids is a
+    # numpy array of the ids the tasks may be assigned to
+    titles = join(np.char.capitalize(rng.choice(WORDS, count)), ' ',
+                  rng.choice(WORDS, count), ' ', rng.choice(WORDS, count))
+    details = rng.choice(WORDS, (count, 8))
+    details = join(*[join(details[:, i], ' ') for i in range(7)] +
+                   [details[:, 7]])
+
+    # most tasks are needed in the next few weeks, with a long tail of
+    # older ones, all within a year either side of start
+    offsets = np.clip(np.rint(rng.normal(21, 90, count)), -365, 365)
+    dates = np.datetime64(start, 'D') + offsets.astype('timedelta64[D]')
+
+    past = offsets < 0
+    statuses = np.where(
+        past,
+        rng.choice(len(TASK_STATUSES), count, p=PAST_STATUS_WEIGHTS),
+        rng.choice(len(TASK_STATUSES), count, p=FUTURE_STATUS_WEIGHTS))
+
+    # squaring a uniform number favours the first volunteers, so a few of
+    # them do many of the tasks
+    volunteer_index = (len(volunteer_ids) *
+                       rng.random(count) ** 2).astype(np.int64)
+    assigned = (statuses != 0) & (len(volunteer_ids) > 0)
+    volunteers = [int(volunteer_ids[i]) if is_assigned else None
+                  for i, is_assigned in zip(volunteer_index.tolist(),
+                                            assigned.tolist())]
+    return {
+        'title': titles.tolist(),
+        'details': details.tolist(),
+        'date_needed': dates.tolist(),
+        'status': np.array(TASK_STATUSES)[statuses].tolist(),
+        'volunteer_id': volunteers,
+    }
+
+
+def copy_rows(conn, table, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(zip(*[['\\N' if value is None else value
+                            for value in values]
+                           for values in columns.values()]))
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv, "
+                       "NULL '\\N')".format(table.name, ', '.join(columns)),
+                       buffer)
+    cursor.close()
+
+
+def write_rows(conn, table, columns, use_copy):
+    if use_copy:
+        copy_rows(conn, table, columns)
+    else:
+        names = list(columns)
+        conn.execute(table.insert(), [dict(zip(names, values))
+                                      for values in zip(*columns.values())])
+
+
+def generate(tasks, volunteers=None, seed=0, start=DATAGEN_START,
+             chunk_size=DATAGEN_CHUNK_SIZE, use_copy=True, out=sys.stdout):
+    # replaces every task and volunteer with tasks generated tasks and
+    # volunteers generated volunteers (a tenth of tasks by default) and
+    # returns the counts
+    if volunteers is None:
+        volunteers = max(tasks // 10, 1)
+    postgresql = db.engine.dialect.name == 'postgresql'
+    use_copy = use_copy and postgresql
+    task_table = Task.__table__
+    volunteer_table = Volunteer.__table__
+    began = time.time()
+
+    with db.engine.connect() as conn:
+        with conn.begin():
+            if postgresql:
+                conn.execute('TRUNCATE task, volunteer RESTART IDENTITY')
+            else:
+                conn.execute(task_table.delete())
+                conn.execute(volunteer_table.delete())
+
+        for number, first in enumerate(range(0, volunteers, chunk_size)):
+            count = min(chunk_size, volunteers - first)
+            columns = volunteer_columns(chunk_rng(seed, 0, number), count)
+            with conn.begin():
+                write_rows(conn, volunteer_table, columns, use_copy)
+            out.write('{} volunteers written\n'.format(first + count))
+
+        volunteer_ids = np.array([row[0] for row in conn.execute(
+            db.select([volunteer_table.c.id])
+            .order_by(volunteer_table.c.id))], dtype=np.int64)
+
+        for number, first in enumerate(range(0, tasks, chunk_size)):
+            count = min(chunk_size, tasks - first)
+            columns = task_columns(chunk_rng(seed, 1, number), count,
+                                   volunteer_ids, start)
+            with conn.begin():
+                write_rows(conn, task_table, columns, use_copy)
+            elapsed = time.time() - began
+            out.write('{} tasks written ({:.0f} rows/s)\n'.format(
+                first + count, (volunteers + first + count) / elapsed
+                if elapsed else 0))
+
+        with conn.begin():
+            rebuild_stats(conn)
+            TableVersion.bump(conn, ['task', 'volunteer'])
+    return {'tasks': tasks, 'volunteers': volunteers,
+            'seconds': time.time() - began}
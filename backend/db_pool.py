@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+import weakref
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool, QueuePool
+
+# connections kept open by each worker process
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+# extra connections opened when the pool is empty, closed when returned
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# seconds to wait for a connection before failing the request
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# seconds after which a connection is replaced, so connections are not
+# silently dropped by the server or a proxy while they sit idle
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# test each connection with a round trip when it is checked out
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() \
+    in ('1', 'true', 'yes')
+
+'''
+Connection pool
+The pool settings come from the environment.  Pool events keep live counts
+of the connections opened, checked out and invalidated, and TimedQueuePool
+records how long each checkout waited for a connection in a histogram, so
+pool exhaustion shows up as a growing wait time instead of as timeouts.
+
+Connections must never be shared between processes.  Every connection
+remembers the pid that opened it, and after a fork (gunicorn with
+preload_app, for example) each engine is given a new, empty pool in the
+child, so the child opens its own connections and leaves the parent's alone.
+'''
+
+# upper bounds, in seconds, of the checkout wait time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float('inf'))
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_counts = [0] * len(WAIT_BUCKETS)
+            self.wait_sum = 0.0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def observe_wait(self, seconds):
+        with self._lock:
+            self.wait_sum += seconds
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.wait_counts[i] += 1
+                    break
+
+    def snapshot(self):
+        # the counts, with the histogram as cumulative bucket counts
+        with self._lock:
+            cumulative = []
+            total = 0
+            for count in self.wait_counts:
+                total += count
+                cumulative.append(total)
+            return {
+                'checked_out': self.checkouts - self.checkins,
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_seconds': {
+                    # the last bound is infinite, which json cannot hold
+                    'buckets': [['+Inf' if bound == float('inf') else bound,
+                                 count]
+                                for bound, count in zip(WAIT_BUCKETS,
+                                                        cumulative)],
+                    'count': total,
+                    'sum': self.wait_sum
+                }
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    # a QueuePool that records how long each checkout waits for a connection
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.incr('timeouts')
+            raise
+        finally:
+            pool_metrics.observe_wait(time.perf_counter() - start)
+
+
+def engine_options(database_uri):
+    # returns the create_engine arguments for database_uri.  sqlite has its
+    # own pools, which do not take the size settings
+    options = {
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'pool_recycle': DB_POOL_RECYCLE,
+    }
+    if not database_uri.startswith('sqlite'):
+        options.update({
+            'poolclass': TimedQueuePool,
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+        })
+    return options
+
+
+@event.listens_for(Pool, 'connect')
+def on_connect(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+    pool_metrics.incr('connects')
+
+
+class ForeignConnectionError(exc.DisconnectionError):
+    # raised on checkout of a connection opened by another process
+    pass
+
+
+@event.listens_for(Pool, 'checkout')
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    # a connection opened by another process is dropped, without being
+    # closed, and the pool opens a new one in its place.  It is counted
+    # here, and not by the invalidate listeners below
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        connection_record.connection = connection_proxy.connection = None
+        pool_metrics.incr('invalidations')
+        raise ForeignConnectionError(
+            'Connection belongs to pid {}, not {}'.format(
+                connection_record.info['pid'], pid))
+    pool_metrics.incr('checkouts')
+
+
+@event.listens_for(Pool, 'checkin')
+def on_checkin(dbapi_connection, connection_record):
+    pool_metrics.incr('checkins')
+
+
+@event.listens_for(Pool, 'invalidate')
+def on_invalidate(dbapi_connection, connection_record, exception):
+    if not isinstance(exception, ForeignConnectionError):
+        pool_metrics.incr('invalidations')
+
+
+@event.listens_for(Pool, 'soft_invalidate')
+def on_soft_invalidate(dbapi_connection, connection_record, exception):
+    if not isinstance(exception, ForeignConnectionError):
+        pool_metrics.incr('invalidations')
+
+
+_engines = weakref.WeakSet()
+
+
+@event.listens_for(Engine, 'engine_connect')
+def track_engine(connection, branch):
+    _engines.add(connection.engine)
+
+
+def reset_after_fork():
+    # gives every engine an empty pool in a newly forked child.  The old
+    # pool is not disposed, since closing its connections would also close
+    # them for the parent
+    for engine in list(_engines):
+        engine.pool = engine.pool.recreate()
+    pool_metrics.reset()
+
+
+def dispose_engines():
+    # closes every pooled connection.  Run in the master process before it
+    # forks, so the workers start with no connections to share at all
+    for engine in list(_engines):
+        engine.dispose()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_after_fork)
@@ -0,0 +1,148 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from flask import request, abort, Response, stream_with_context
+from models import db, Task, Volunteer
+from validation import TASK_STATUSES
+
+# rows fetched from the server side cursor, and written to the response,
+# at a time
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+'''
+Exports
+Streams every matching row as NDJSON (one json object per line) or CSV.
+Rows are selected as plain columns rather than model objects, fetched from a
+server side cursor EXPORT_BATCH_SIZE rows at a time and written out as they
+arrive, so memory use stays the same however many rows are exported.
+'''
+
+TASK_COLUMNS = ['id', 'title', 'details', 'date_needed', 'status',
+                'volunteer_id', 'volunteer_name']
+VOLUNTEER_COLUMNS = ['id', 'name', 'address', 'city', 'state', 'zip_code',
+                     'phone_number']
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+def get_date_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        abort(400)
+
+
+def get_int_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
+
+
+def task_export_query():
+    # the tasks matching the status, date_from, date_to and volunteer_id
+    # query string filters, in id order
+    query = db.session.query(Task.id, Task.title, Task.details,
+                             Task.date_needed, Task.status,
+                             Task.volunteer_id,
+                             Volunteer.name.label('volunteer_name')) \
+        .outerjoin(Volunteer, Task.volunteer_id == Volunteer.id)
+
+    status = request.args.get('status')
+    if status is not None:
+        if status not in TASK_STATUSES:
+            abort(400)
+        query = query.filter(Task.status == status)
+    date_from = get_date_arg('date_from')
+    if date_from:
+        query = query.filter(Task.date_needed >= date_from)
+    date_to = get_date_arg('date_to')
+    if date_to:
+        query = query.filter(Task.date_needed <= date_to)
+    volunteer_id = get_int_arg('volunteer_id')
+    if volunteer_id is not None:
+        query = query.filter(Task.volunteer_id == volunteer_id)
+    return query.order_by(Task.id)
+
+
+def volunteer_export_query():
+    # the volunteers matching the city and state query string filters, in
+    # name order
+    query = db.session.query(*[getattr(Volunteer, column)
+                               for column in VOLUNTEER_COLUMNS])
+    city = request.args.get('city')
+    if city is not None:
+        query = query.filter(Volunteer.city == city)
+    state = request.args.get('state')
+    if state is not None:
+        query = query.filter(Volunteer.state == state)
+    return query.order_by(Volunteer.name, Volunteer.id)
+
+
+def to_text(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def generate_ndjson(rows, columns):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, map(to_text, row)))))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def generate_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(['' if value is None else to_text(value)
+                         for value in row])
+        count += 1
+        if count >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
+
+
+def export_response(query, columns, name):
+    # returns a streamed response of the rows of query in the format given
+    # by ?format=, ndjson by default
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in FORMATS:
+        abort(400)
+    mimetype, extension = FORMATS[export_format]
+
+    # yield_per streams the rows from a server side cursor instead of
+    # loading them all when the query runs
+    rows = query.yield_per(EXPORT_BATCH_SIZE)
+    if export_format == 'csv':
+        body = generate_csv(rows, columns)
+    else:
+        body = generate_ndjson(rows, columns)
+
+    # stream_with_context keeps the request, and so the database session,
+    # open until the last row has been sent
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = \
+        'attachment; filename={}.{}'.format(name, extension)
+    return response
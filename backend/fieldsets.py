@@ -0,0 +1,45 @@
+from flask import request, abort
+
+'''
+Sparse fieldsets
+The JSON routes for tasks and volunteers take two optional query
+parameters.  ?fields=id,title,status returns only those columns, and only
+those columns are selected (the others are left out with load_only), so a
+client that does not need the task details never has them read from the
+database.  ?include= names the related rows to return: volunteer (the
+assigned volunteer's name) for tasks and tasks (each volunteer's tasks) for
+volunteers.  A related row that is not included is not loaded at all.
+
+Without either parameter every column and every related row is returned,
+as before.  When fields is given without include, no related rows are
+returned.
+'''
+
+
+def parse_fieldset(model, fields, include):
+    # returns (fields, include) for the raw parameter values, each a tuple
+    # or None for the default.  Raises ValueError for an unknown name
+    if fields is not None:
+        fields = tuple(name for name in fields.split(',') if name)
+        unknown = set(fields) - set(model.FIELDS)
+        if unknown or not fields:
+            raise ValueError('unknown fields ' + ', '.join(sorted(unknown)))
+    if include is not None:
+        include = tuple(name for name in include.split(',') if name)
+        unknown = set(include) - set(model.INCLUDES)
+        if unknown:
+            raise ValueError('unknown includes ' +
+                             ', '.join(sorted(unknown)))
+    elif fields is not None:
+        include = ()
+    return fields, include
+
+
+def get_fieldset(model):
+    # returns (fields, include) from the query string, aborts with a 400 if
+    # it names a field or relationship that model does not have
+    try:
+        return parse_fieldset(model, request.args.get('fields'),
+                              request.args.get('include'))
+    except ValueError:
+        abort(400)
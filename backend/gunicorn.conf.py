@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+
+'''
+Gunicorn settings
+The production server profile:
+    gunicorn --chdir backend --config backend/gunicorn.conf.py app:app
+
+The app is preloaded in the master process and the workers are forked from
+it.  Every setting can be changed with the environment variable named next
+to it.
+'''
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+
+# WEB_CONCURRENCY worker processes, two per cpu plus one by default
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             multiprocessing.cpu_count() * 2 + 1))
+# GUNICORN_THREADS threads in each worker.  Each thread may hold a database
+# connection, so DB_POOL_SIZE should be at least this
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# each worker is replaced after GUNICORN_MAX_REQUESTS requests, plus up to
+# GUNICORN_MAX_REQUESTS_JITTER more so the workers are not all replaced at
+# once, which stops a slow leak from growing without bound
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+preload_app = True
+accesslog = '-'
+
+
+def on_starting(server):
+    import warmup
+    warmup.clear_metrics_dir()
+
+
+def when_ready(server):
+    # the app has been loaded, and no worker has been forked yet
+    import warmup
+    from app import app
+    warmup.warm_up(app)
+    server.log.info('Caches warmed up')
+
+
+def post_fork(server, worker):
+    import warmup
+    warmup.after_fork()
+
+
+def worker_exit(server, worker):
+    # runs in the worker as it exits, so its last requests are counted
+    from metrics import registry
+    registry.maybe_flush(force=True)
+
+
+def child_exit(server, worker):
+    # runs in the master once the worker has gone
+    import metrics
+    metrics.mark_process_dead(worker.pid)
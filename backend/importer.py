@@ -0,0 +1,237 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+from itertools import islice
+from sqlalchemy import select, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import db, Task, Volunteer, TableVersion
+from forms import TaskForm, VolunteerForm
+from validation import validate_with_form, VOLUNTEER_FIELDS
+from stats import rebuild_stats
+
+# rows validated and written in each transaction
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+
+'''
+Importer
+Loads tasks or volunteers from a CSV or NDJSON file.  The file is read and
+validated a chunk at a time, with the same rules as TaskForm and
+VolunteerForm, and each chunk is written in one transaction.
+
+On PostgreSQL a chunk is sent with COPY into a temporary staging table and
+then moved into the real table with INSERT ... SELECT, which updates the
+existing row instead wherever an id is given that is already in use.
+Other databases (or --no-copy) get the same result with executemany
+statements.  Rows without an id are always inserted as new rows.
+'''
+
+# table: (model, form, fields)
+IMPORTS = {
+    'task': (Task, TaskForm, ['title', 'details', 'date_needed', 'status']),
+    'volunteer': (Volunteer, VolunteerForm, VOLUNTEER_FIELDS),
+}
+
+
+def read_rows(path, file_format):
+    # yields (line number, row) for each row in the file.  row is None for
+    # a line that could not be parsed
+    with open(path, newline='') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_num, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_num, json.loads(line)
+                except ValueError:
+                    yield line_num, None
+
+
+def check_row(table, row):
+    # returns (values, errors) for one row of the file
+    model, form_class, fields = IMPORTS[table]
+    if not isinstance(row, dict):
+        return {}, {'row': 'could not be read'}
+
+    if table == 'task' and not row.get('status'):
+        row = dict(row, status='Open')
+    values, errors = validate_with_form(form_class, row, fields)
+
+    # an id is optional.  When it is given the row replaces that task or
+    # volunteer
+    row_id = row.get('id', None)
+    values['id'] = None
+    if row_id not in (None, ''):
+        try:
+            values['id'] = int(row_id)
+        except (TypeError, ValueError):
+            errors['id'] = 'must be a whole number'
+    return values, errors
+
+
+def unique_ids(rows):
+    # keeps only the last row for each id, since one statement cannot write
+    # the same row twice
+    by_id = {}
+    new_rows = []
+    for row in rows:
+        if row['id'] is None:
+            new_rows.append(row)
+        else:
+            by_id[row['id']] = row
+    return new_rows + list(by_id.values())
+
+
+def create_staging_table(conn, table, fields):
+    # a temporary table with the imported columns but none of the
+    # constraints, emptied by every commit
+    staging = db.Table('import_' + table.name, db.MetaData(),
+                       *[db.Column(column.name, column.type)
+                         for column in [table.c.id] +
+                         [table.c[field] for field in fields]],
+                       prefixes=['TEMPORARY'],
+                       postgresql_on_commit='DELETE ROWS')
+    staging.create(bind=conn)
+    return staging
+
+
+def copy_upsert(conn, table, staging, fields, rows):
+    columns = ['id'] + fields
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if row[column] is None else row[column]
+                         for column in columns])
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv, "
+                       "NULL '\\N')".format(staging.name, ', '.join(columns)),
+                       buffer)
+    cursor.close()
+
+    conn.execute(table.insert().from_select(
+        fields, select([staging.c[field] for field in fields])
+        .where(staging.c.id.is_(None))))
+
+    upsert = pg_insert(table).from_select(
+        columns, select([staging.c[column] for column in columns])
+        .where(staging.c.id.isnot(None)))
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_=dict({field: upsert.excluded[field] for field in fields},
+                  version=table.c.version + 1))
+    conn.execute(upsert)
+
+
+def executemany_upsert(conn, table, fields, rows):
+    ids = [row['id'] for row in rows if row['id'] is not None]
+    existing = set()
+    if ids:
+        existing = {r[0] for r in conn.execute(
+            select([table.c.id]).where(table.c.id.in_(ids)))}
+
+    updates = [row for row in rows if row['id'] in existing]
+    if updates:
+        conn.execute(table.update()
+                     .where(table.c.id == bindparam('b_id'))
+                     .values(version=table.c.version + 1,
+                             **{field: bindparam('b_' + field)
+                                for field in fields}),
+                     [{'b_' + key: value for key, value in row.items()}
+                      for row in updates])
+
+    # rows are grouped by whether they bring their own id, as every row of
+    # an executemany statement must have the same columns
+    with_id = [row for row in rows
+               if row['id'] is not None and row['id'] not in existing]
+    if with_id:
+        conn.execute(table.insert(), with_id)
+    without_id = [{field: row[field] for field in fields}
+                  for row in rows if row['id'] is None]
+    if without_id:
+        conn.execute(table.insert(), without_id)
+
+
+def fix_sequence(conn, table):
+    # rows inserted with their own ids do not advance the id sequence
+    conn.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                 "(SELECT COALESCE(MAX(id), 1) FROM {0}))"
+                 .format(table.name))
+
+
+def import_file(table, path, file_format=None, use_copy=True,
+                chunk_size=IMPORT_CHUNK_SIZE, rejects=None, out=sys.stdout):
+    # imports the rows of a csv or ndjson file into table ('task' or
+    # 'volunteer') and returns the number of rows read, imported and
+    # rejected.  Each rejected row is written to rejects as a line of json
+    model, form_class, fields = IMPORTS[table]
+    target = model.__table__
+    if not file_format:
+        file_format = 'csv' if path.lower().endswith('.csv') else 'ndjson'
+    postgresql = db.engine.dialect.name == 'postgresql'
+    use_copy = use_copy and postgresql
+
+    counts = {'read': 0, 'imported': 0, 'rejected': 0}
+    start = time.time()
+    rows = read_rows(path, file_format)
+    with db.engine.connect() as conn:
+        staging = None
+        if use_copy:
+            staging = create_staging_table(conn, target, fields)
+
+        try:
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+
+                valid = []
+                for line_num, row in chunk:
+                    values, errors = check_row(table, row)
+                    if errors:
+                        counts['rejected'] += 1
+                        if rejects:
+                            rejects.write(json.dumps(
+                                {'line': line_num, 'errors': errors}) + '\n')
+                    else:
+                        valid.append(values)
+                counts['read'] += len(chunk)
+
+                if valid:
+                    valid = unique_ids(valid)
+                    with conn.begin():
+                        if use_copy:
+                            copy_upsert(conn, target, staging, fields, valid)
+                        else:
+                            executemany_upsert(conn, target, fields, valid)
+                        if postgresql and any(row['id'] is not None
+                                              for row in valid):
+                            fix_sequence(conn, target)
+                        TableVersion.bump(conn, [table])
+                    counts['imported'] += len(valid)
+
+                elapsed = time.time() - start
+                out.write('{read} rows read, {imported} imported, {rejected} '
+                          'rejected ({rate:.0f} rows/s)\n'.format(
+                              rate=counts['read'] / elapsed if elapsed else 0,
+                              **counts))
+        finally:
+            # the connection goes back to the pool, so the staging table is
+            # dropped rather than left for the next user
+            if staging is not None:
+                staging.drop(bind=conn)
+
+    if table == 'task':
+        # the rows were written without the orm, so the task counts are
+        # recounted rather than updated
+        with db.engine.begin() as conn:
+            rebuild_stats(conn)
+    counts['seconds'] = time.time() - start
+    return counts
@@ -1,8 +1,16 @@
-from flask_script import Manager
+import os
+import sys
+from datetime import datetime
+from flask_script import Manager, Command, Option, prompt_bool
 from flask_migrate import Migrate, MigrateCommand
 
 from app import app
-from models import db
+from models import db, TableVersion
+from query_plans import find_seq_scans
+from importer import import_file, IMPORTS, IMPORT_CHUNK_SIZE
+import benchmark
+import datagen
+import stats
 
 migrate = Migrate(app, db)
 manager = Manager(app)
@@ -10,5 +18,171 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def check_plans():
+    """Fails if any of the hot queries reads a whole table"""
+    problems = find_seq_scans()
+    for name, tables in problems.items():
+        print('Sequential scan in "{}" on {}'.format(name, ', '.join(tables)))
+    if problems:
+        sys.exit(1)
+    print('All hot queries use an index')
+
+
+@manager.command
+def rebuild_stats():
+    """Recounts the dashboard statistics from the task table"""
+    with db.engine.begin() as conn:
+        rows = stats.rebuild_stats(conn)
+        # the counts may have changed, so cached copies and etags must too
+        TableVersion.bump(conn, ['task'])
+    print('Rebuilt {} task_stat rows'.format(rows))
+
+
+class ImportCommand(Command):
+    """Imports tasks or volunteers from a CSV or NDJSON file"""
+
+    option_list = (
+        Option('table', choices=sorted(IMPORTS)),
+        Option('path'),
+        Option('--format', dest='file_format', choices=['csv', 'ndjson'],
+               help='defaults to csv for .csv files, otherwise ndjson'),
+        Option('--rejects', dest='rejects_path',
+               help='file to write the rejected rows and their errors to'),
+        Option('--chunk-size', dest='chunk_size', type=int,
+               default=IMPORT_CHUNK_SIZE),
+        Option('--no-copy', dest='use_copy', action='store_false',
+               help='use executemany statements instead of COPY'),
+    )
+
+    def run(self, table, path, file_format, rejects_path, chunk_size,
+            use_copy):
+        rejects = open(rejects_path, 'w') if rejects_path else None
+        try:
+            counts = import_file(table, path, file_format=file_format,
+                                 use_copy=use_copy, chunk_size=chunk_size,
+                                 rejects=rejects)
+        finally:
+            if rejects:
+                rejects.close()
+
+        rate = counts['read'] / counts['seconds'] if counts['seconds'] else 0
+        print('Imported {} of {} rows in {:.1f}s ({:.0f} rows/s), {} '
+              'rejected'.format(counts['imported'], counts['read'],
+                                counts['seconds'], rate, counts['rejected']))
+        if counts['rejected'] and not rejects_path:
+            print('Use --rejects to see why rows were rejected')
+
+
+manager.add_command('import', ImportCommand())
+
+
+class SeedCommand(Command):
+    """Replaces every task and volunteer with generated data"""
+
+    option_list = (
+        Option('size', help='number of tasks: 1k, 100k, 1M or any number'),
+        Option('--volunteers', dest='volunteers',
+               help='defaults to a tenth of the number of tasks'),
+        Option('--seed', dest='seed', type=int, default=0,
+               help='the same seed always gives the same rows'),
+        Option('--start', dest='start',
+               default=datagen.DATAGEN_START.isoformat(),
+               help='date (YYYY-MM-DD) the task dates are spread around'),
+        Option('--chunk-size', dest='chunk_size', type=int,
+               default=datagen.DATAGEN_CHUNK_SIZE),
+        Option('--no-copy', dest='use_copy', action='store_false',
+               help='use executemany inserts instead of COPY'),
+        Option('--yes', dest='confirmed', action='store_true',
+               help='do not ask before deleting the existing rows'),
+    )
+
+    def run(self, size, volunteers, seed, start, chunk_size, use_copy,
+            confirmed):
+        tasks = datagen.parse_size(size)
+        if volunteers is not None:
+            volunteers = datagen.parse_size(volunteers)
+        start = datetime.strptime(start, '%Y-%m-%d').date()
+        if not confirmed and not prompt_bool(
+                'Delete every task and volunteer in {}'.format(db.engine.url)):
+            return
+        counts = datagen.generate(tasks, volunteers, seed=seed, start=start,
+                                  chunk_size=chunk_size, use_copy=use_copy)
+        print('Generated {tasks} tasks and {volunteers} volunteers in '
+              '{seconds:.1f}s'.format(**counts))
+
+
+manager.add_command('seed', SeedCommand())
+
+
+class BenchmarkCommand(Command):
+    """Benchmarks each route family and compares it with the baseline"""
+
+    option_list = (
+        Option('--requests', dest='requests', type=int, default=200,
+               help='requests sent to each route family'),
+        Option('--concurrency', dest='concurrency', type=int, default=8,
+               help='clients sending requests at the same time'),
+        Option('--route', dest='families', action='append',
+               choices=sorted(benchmark.ROUTE_FAMILIES),
+               help='benchmark only this route family, may be repeated'),
+        Option('--writes', dest='writes', action='store_true',
+               help='also benchmark the route families that change data'),
+        Option('--server', dest='server', choices=['wsgi', 'asgi'],
+               default='wsgi',
+               help='benchmark the Flask app or the async read only tier'),
+        Option('--workers', dest='workers', type=int,
+               help='run the tier as its own server with this many worker '
+                    'processes and report the memory of each'),
+        Option('--memory-limit', dest='memory_limit_mb', type=int,
+               help='megabytes of memory each server process may use'),
+        Option('--baseline', dest='baseline_path',
+               default=benchmark.BENCHMARK_BASELINE),
+        Option('--threshold', dest='threshold', type=float,
+               default=benchmark.BENCHMARK_THRESHOLD,
+               help='fraction a route may slow down before the run fails'),
+        Option('--update', dest='update', action='store_true',
+               help='save this run as the baseline even if it regressed '
+                    'or was not comparable with it'),
+    )
+
+    def run(self, requests, concurrency, families, writes, server, workers,
+            memory_limit_mb, baseline_path, threshold, update):
+        results = benchmark.run_benchmark(
+            app, requests=requests, concurrency=concurrency,
+            families=families, token=os.environ.get('DIRECTOR_TOKEN'),
+            writes=writes, server=server, workers=workers,
+            memory_limit_mb=memory_limit_mb)
+        print(benchmark.format_results(results))
+
+        problems = []
+        baseline = benchmark.load_baseline(baseline_path)
+        comparable = baseline is not None and \
+            benchmark.comparable(baseline, results)
+        if baseline is None:
+            print('No baseline in {}'.format(baseline_path))
+        elif not comparable:
+            # a baseline of other data or settings is kept, so that a one
+            # off run does not replace it by accident
+            print('The baseline in {} was recorded with different data or '
+                  'settings, so this run is not compared with it and the '
+                  'baseline is kept.  Use --update to replace it'.format(
+                      baseline_path))
+        else:
+            problems = benchmark.compare(baseline, results, threshold)
+            for problem in problems:
+                print('Regression in ' + problem)
+
+        if update or baseline is None or (comparable and not problems):
+            benchmark.save_baseline(results, baseline_path)
+            print('Saved this run as the baseline in {}'.format(
+                baseline_path))
+        if problems:
+            sys.exit(1)
+
+
+manager.add_command('benchmark', BenchmarkCommand())
+
+
 if __name__ == '__main__':
-    manager.run()
\ No newline at end of file
+    manager.run()
@@ -0,0 +1,335 @@
+import glob
+import json
+import os
+import threading
+import time
+from flask import g, request, has_request_context
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from db_pool import pool_metrics
+from cache import response_cache
+
+# directory shared by all of the worker processes.  Each worker writes its
+# metrics there so that /metrics can add them up.  It should be emptied
+# before the server starts.  When it is not set /metrics only reports the
+# process that answers the request
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# seconds between writes of a worker's metrics to METRICS_DIR
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+'''
+Metrics
+A small registry of counters, gauges and histograms, rendered in the
+Prometheus text format by the /metrics route.  Every request records its
+latency and status, and the number and total time of the SQL statements it
+ran.  Template render times, token verification times and the response
+cache's hits and misses are recorded as well.
+
+Gunicorn runs several worker processes, each with its own registry.  With
+METRICS_DIR set, each worker writes its registry to its own file there, at
+most once every METRICS_FLUSH_INTERVAL seconds, and /metrics adds up the
+files of every worker.  Counters and histograms of workers that have exited
+are kept, since the requests they counted still happened, but their gauges
+are dropped.  When gunicorn reports that a worker has exited, its counters
+and histograms are added to the totals of all the exited workers, kept in
+one file, and its own file is deleted, so the directory does not grow with
+every worker that is replaced and a later worker given the same pid cannot
+overwrite them.
+'''
+
+# file in METRICS_DIR with the totals of the workers that have exited
+EXITED_FILE = 'metrics_exited.json'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'http_requests_total': (
+        'counter', 'Requests answered, by endpoint, method and status', None),
+    'http_request_duration_seconds': (
+        'histogram', 'Time taken to answer a request', LATENCY_BUCKETS),
+    'http_request_sql_queries': (
+        'histogram', 'SQL statements run by a request', QUERY_COUNT_BUCKETS),
+    'http_request_sql_seconds': (
+        'histogram', 'Total time of the SQL statements run by a request',
+        LATENCY_BUCKETS),
+    'template_render_seconds': (
+        'histogram', 'Time taken to render a template', LATENCY_BUCKETS),
+    'auth_verify_seconds': (
+        'histogram', 'Time taken to verify an access token', LATENCY_BUCKETS),
+    'db_pool_checked_out': (
+        'gauge', 'Database connections checked out of the pool', None),
+    'db_pool_connects_total': (
+        'counter', 'Database connections opened', None),
+    'db_pool_invalidations_total': (
+        'counter', 'Database connections invalidated', None),
+    'db_pool_timeouts_total': (
+        'counter', 'Checkouts that timed out waiting for a connection', None),
+    'response_cache_hits_total': (
+        'counter', 'Response cache lookups that found an entry', None),
+    'response_cache_misses_total': (
+        'counter', 'Response cache lookups that built the value', None),
+}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+        self.flushed_at = 0.0
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name, value, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self.values[key] = value
+
+    def observe(self, name, value, labels=None):
+        # histograms are kept as the count in each bucket followed by the
+        # sum and the count of the observed values
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+        self.maybe_flush()
+
+    def record_pool(self):
+        # copies this process's connection pool counts into the registry
+        pool = pool_metrics.snapshot()
+        self.set('db_pool_checked_out', pool['checked_out'])
+        self.set('db_pool_connects_total', pool['connects'])
+        self.set('db_pool_invalidations_total', pool['invalidations'])
+        self.set('db_pool_timeouts_total', pool['timeouts'])
+
+    def record_response_cache(self):
+        # copies this process's response cache counts into the registry
+        self.set('response_cache_hits_total', response_cache.hits)
+        self.set('response_cache_misses_total', response_cache.misses)
+
+    def dump(self):
+        self.record_pool()
+        self.record_response_cache()
+        with self._lock:
+            return [[name, list(labels), value]
+                    for (name, labels), value in self.values.items()]
+
+    def maybe_flush(self, force=False):
+        # writes this process's metrics to METRICS_DIR if the last write is
+        # older than METRICS_FLUSH_INTERVAL
+        if not METRICS_DIR:
+            return
+        now = time.time()
+        if not force and now - self.flushed_at < METRICS_FLUSH_INTERVAL:
+            return
+        self.flushed_at = now
+        path = os.path.join(METRICS_DIR, 'metrics_{}.json'.format(
+            os.getpid()))
+        # written to a temporary file and renamed, so a reader never sees a
+        # half written file
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.dump(), f)
+        os.replace(path + '.tmp', path)
+
+    def reset(self):
+        with self._lock:
+            self.values = {}
+            self.flushed_at = 0.0
+
+
+registry = MetricsRegistry()
+
+# a forked worker starts counting from zero
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_entries(path):
+    # the [name, labels, value] entries in a metrics file, or None if it
+    # could not be read
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def add_entries(totals, entries, alive=True):
+    # adds entries to totals, {(name, labels): value}.  The gauges of a
+    # process that is not alive are left out
+    for name, labels, value in entries:
+        if METRICS.get(name, ('counter',))[0] == 'gauge' and not alive:
+            continue
+        key = (name, tuple(map(tuple, labels)))
+        if key not in totals:
+            totals[key] = value
+        elif isinstance(value, list):
+            totals[key] = [a + b for a, b in zip(totals[key], value)]
+        else:
+            totals[key] += value
+
+
+def mark_process_dead(pid):
+    # adds the counters and histograms of the exited worker pid to the
+    # exited workers' totals and deletes its file.  Run by the gunicorn
+    # master, one worker at a time, from its child_exit hook
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, 'metrics_{}.json'.format(pid))
+    entries = read_entries(path)
+    if entries is None:
+        return
+    exited_path = os.path.join(METRICS_DIR, EXITED_FILE)
+    totals = {}
+    add_entries(totals, read_entries(exited_path) or [])
+    add_entries(totals, entries, alive=False)
+    with open(exited_path + '.tmp', 'w') as f:
+        json.dump([[name, list(labels), value]
+                   for (name, labels), value in totals.items()], f)
+    os.replace(exited_path + '.tmp', exited_path)
+    os.remove(path)
+
+
+def collect():
+    # returns {(name, labels): value} for every worker
+    if not METRICS_DIR:
+        return {(name, tuple(map(tuple, labels))): value
+                for name, labels, value in registry.dump()}
+
+    registry.maybe_flush(force=True)
+    totals = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics_*.json')):
+        name = os.path.basename(path)[len('metrics_'):-len('.json')]
+        entries = read_entries(path)
+        if entries is None:
+            continue
+        # the exited workers' file has no pid, and no gauges
+        add_entries(totals, entries, name.isdigit() and pid_alive(int(name)))
+    return totals
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')) for key, value in pairs) + '}'
+
+
+def render_metrics():
+    # returns every metric in the Prometheus text format
+    by_name = {}
+    for (name, labels), value in collect().items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(by_name):
+        metric_type, help_text, buckets = METRICS.get(
+            name, ('untyped', '', None))
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for labels, value in sorted(by_name[name]):
+            if metric_type != 'histogram':
+                lines.append('{}{} {}'.format(name, format_labels(labels),
+                                              value))
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels, [('le', bound)]),
+                    cumulative))
+            lines.append('{}_bucket{} {}'.format(
+                name, format_labels(labels, [('le', '+Inf')]), value[-1]))
+            lines.append('{}_sum{} {}'.format(name, format_labels(labels),
+                                              value[-2]))
+            lines.append('{}_count{} {}'.format(name, format_labels(labels),
+                                                value[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+class TimedTemplate(Template):
+    # a jinja template that records how long it takes to render
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            registry.observe('template_render_seconds',
+                             time.perf_counter() - start,
+                             {'template': self.name or ''})
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context,
+                      executemany):
+    # the start time is kept on the statement's execution context, so it is
+    # thrown away with the statement if the statement fails
+    if context is not None:
+        context.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context,
+                     executemany):
+    start = getattr(context, 'query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if has_request_context() and 'metrics_start' in g:
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+
+
+def init_metrics(app):
+    # records the metrics of every request made to app
+    app.jinja_env.template_class = TimedTemplate
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_start' not in g:
+            return response
+        # the endpoint name, rather than the path, keeps ids out of the
+        # labels
+        endpoint = request.endpoint or 'none'
+        registry.inc('http_requests_total', {
+            'endpoint': endpoint,
+            'method': request.method,
+            'status': str(response.status_code)})
+        labels = {'endpoint': endpoint}
+        registry.observe('http_request_sql_queries', g.sql_queries, labels)
+        registry.observe('http_request_sql_seconds', g.sql_seconds, labels)
+        registry.observe('http_request_duration_seconds',
+                         time.perf_counter() - g.metrics_start, labels)
+        return response
@@ -0,0 +1,35 @@
+"""add indexes for the hot queries
+
+Revision ID: 1bcf6a507e98
+Revises: 38cb09534931
+Create Date: 2026-10-18 09:12:44.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1bcf6a507e98'
+down_revision = '38cb09534931'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # /tasks/open: only the open tasks, in id order
+    op.create_index('ix_task_open', 'task', ['id'],
+                    postgresql_where=sa.text("status = 'Open'"),
+                    sqlite_where=sa.text("status = 'Open'"))
+    # a volunteer's tasks in id order
+    op.create_index('ix_task_volunteer_id', 'task', ['volunteer_id', 'id'])
+    op.create_index('ix_task_date_needed', 'task', ['date_needed'])
+    # volunteer lists and the volunteer choices are ordered by name
+    op.create_index('ix_volunteer_name', 'volunteer', ['name', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_volunteer_name', table_name='volunteer')
+    op.drop_index('ix_task_date_needed', table_name='task')
+    op.drop_index('ix_task_volunteer_id', table_name='task')
+    op.drop_index('ix_task_open', table_name='task')
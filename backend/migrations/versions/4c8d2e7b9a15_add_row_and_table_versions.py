@@ -0,0 +1,44 @@
+"""add row versions and table version counters for etags
+
+Revision ID: 4c8d2e7b9a15
+Revises: 7d3e91c4a2f0
+Create Date: 2026-10-18 12:03:44.918207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8d2e7b9a15'
+down_revision = '7d3e91c4a2f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('task') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(),
+                                      nullable=False, server_default='1'))
+    with op.batch_alter_table('volunteer') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(),
+                                      nullable=False, server_default='1'))
+
+    table_version = op.create_table(
+        'table_version',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_version, [
+        {'name': 'task', 'version': 0},
+        {'name': 'volunteer', 'version': 0},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_version')
+    with op.batch_alter_table('volunteer') as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('task') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,96 @@
+"""add trigram indexes for task and volunteer search
+
+Revision ID: 7d3e91c4a2f0
+Revises: 1bcf6a507e98
+Create Date: 2026-10-18 10:41:07.530611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3e91c4a2f0'
+down_revision = '1bcf6a507e98'
+branch_labels = None
+depends_on = None
+
+# index name: (table, column)
+TRIGRAM_INDEXES = {
+    'ix_task_title_trgm': ('task', 'title'),
+    'ix_task_details_trgm': ('task', 'details'),
+    'ix_volunteer_name_trgm': ('volunteer', 'name'),
+    'ix_volunteer_city_trgm': ('volunteer', 'city'),
+}
+
+
+# sqlite fts5 table: (table, indexed columns)
+FTS_TABLES = {
+    'task_fts': ('task', ['title', 'details']),
+    'volunteer_fts': ('volunteer', ['name', 'city']),
+}
+
+
+def upgrade_sqlite():
+    # fts5 tables with the trigram tokenizer, and the triggers that keep
+    # them in step with the tables they index
+    for fts, (table, columns) in FTS_TABLES.items():
+        names = dict(fts=fts, table=table, cols=', '.join(columns),
+                     new=', '.join('new.' + c for c in columns),
+                     old=', '.join('old.' + c for c in columns))
+        op.execute(
+            "CREATE VIRTUAL TABLE {fts} USING fts5({cols}, "
+            "content='{table}', content_rowid='id', "
+            "tokenize='trigram')".format(**names))
+        op.execute(
+            "CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            "INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); "
+            "END".format(**names))
+        op.execute(
+            "CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, {cols}) "
+            "VALUES ('delete', old.id, {old}); "
+            "END".format(**names))
+        op.execute(
+            "CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+            "INSERT INTO {fts}({fts}, rowid, {cols}) "
+            "VALUES ('delete', old.id, {old}); "
+            "INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); "
+            "END".format(**names))
+        # index the rows that are already in the table
+        op.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')"
+                   .format(**names))
+
+
+def downgrade_sqlite():
+    for fts in FTS_TABLES:
+        for trigger in ('ai', 'ad', 'au'):
+            op.execute('DROP TRIGGER IF EXISTS {}_{}'.format(fts, trigger))
+        op.execute('DROP TABLE IF EXISTS {}'.format(fts))
+
+
+def upgrade():
+    # the trigram indexes are postgresql only.  On sqlite the search backend
+    # uses fts5 tables instead
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        upgrade_sqlite()
+    if dialect != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, (table, column) in TRIGRAM_INDEXES.items():
+        op.create_index(name, table, [column],
+                        postgresql_using='gin',
+                        postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        downgrade_sqlite()
+    if dialect != 'postgresql':
+        return
+
+    for name, (table, column) in TRIGRAM_INDEXES.items():
+        op.drop_index(name, table_name=table)
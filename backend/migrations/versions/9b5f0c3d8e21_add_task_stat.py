@@ -0,0 +1,45 @@
+"""add the task_stat summary table for the dashboard statistics
+
+Revision ID: 9b5f0c3d8e21
+Revises: 4c8d2e7b9a15
+Create Date: 2026-10-18 16:41:09.552871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b5f0c3d8e21'
+down_revision = '4c8d2e7b9a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'task_stat',
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'key')
+    )
+    op.create_index('ix_task_stat_kind_count', 'task_stat',
+                    ['kind', 'count'], unique=False)
+
+    # the counts of the existing tasks, as rebuild_stats() makes them
+    if op.get_bind().dialect.name == 'postgresql':
+        week = "to_char(date_trunc('week', date_needed), 'YYYY-MM-DD')"
+    else:
+        week = "date(date_needed, 'weekday 0', '-6 days')"
+    groups = [('status', 'status'), ('week', week),
+              ('volunteer', "coalesce(CAST(volunteer_id AS VARCHAR), '')")]
+    for kind, key in groups:
+        op.execute("INSERT INTO task_stat (kind, key, count) "
+                   "SELECT '{0}', {1}, count(*) FROM task GROUP BY {1}"
+                   .format(kind, key))
+
+
+def downgrade():
+    op.drop_index('ix_task_stat_kind_count', table_name='task_stat')
+    op.drop_table('task_stat')
@@ -0,0 +1,31 @@
+"""add an index on lower(volunteer.name) for the typeahead
+
+Revision ID: c2a7e4f19b36
+Revises: 9b5f0c3d8e21
+Create Date: 2026-10-18 17:25:37.104615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2a7e4f19b36'
+down_revision = '9b5f0c3d8e21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # text_pattern_ops lets PostgreSQL use the index for LIKE 'prefix%'
+    # whatever the database's collation
+    if op.get_bind().dialect.name == 'postgresql':
+        expression = 'lower(name) text_pattern_ops'
+    else:
+        expression = 'lower(name)'
+    op.create_index('ix_volunteer_lower_name', 'volunteer',
+                    [sa.text(expression)], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_volunteer_lower_name', table_name='volunteer')
@@ -1,17 +1,22 @@
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import event, DDL
+from sqlalchemy.orm import Session, object_session
 from datetime import datetime
 import os
+from db_pool import engine_options
+from replica import RoutingSQLAlchemy, init_replica, note_write
 
 
 database_path = os.environ['DATABASE_URL']
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 def setup_db(app):
     #  binds a flask application and an SQLAlchemy service
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    init_replica(app)
     db.app = app
     db.init_app(app)
     migrate = Migrate(app, db)
@@ -26,6 +31,19 @@ A task will have at most 1 volunteer associated with it
 
 class Task(db.Model):
     __tablename__ = 'task'
+    __table_args__ = (
+        # /tasks/open reads the open tasks in id order
+        db.Index('ix_task_open', 'id',
+                 postgresql_where=db.text("status = 'Open'"),
+                 sqlite_where=db.text("status = 'Open'")),
+        # a volunteer's tasks in id order, also used by the foreign key check
+        # when a volunteer is deleted.  Not a covering index: format() reads
+        # the free text title and details, and copying them into the index
+        # would make it about as large as the table, only to save reading
+        # the few heap pages that one volunteer's tasks are on
+        db.Index('ix_task_volunteer_id', 'volunteer_id', 'id'),
+        db.Index('ix_task_date_needed', 'date_needed'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String, nullable=False)
@@ -33,6 +51,9 @@ class Task(db.Model):
     date_needed = db.Column(db.Date, nullable=False)
     status = db.Column(db.String, nullable=False, default='Open')
     volunteer_id = db.Column(db.Integer, db.ForeignKey('volunteer.id'))
+    # incremented by every update, used for the task's etag
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
     volunteers = db.relationship('Volunteer',
                                  backref=db.backref(
                                      'volunteer_association')
@@ -45,19 +66,47 @@ class Task(db.Model):
         self.status = status
         self.volunteer_id = None
 
-    def format(self):
-        vol_name = ''
-        if self.volunteers:
-            vol_name = self.volunteers.name
-        return {
-            'id': self.id,
-            'title': self.title,
-            'details': self.details,
-            'date_needed': datetime.strftime(self.date_needed, '%Y-%m-%d'),
-            'status': self.status,
-            'volunteer_id': self.volunteer_id,
-            'volunteer_name': vol_name
-        }
+    # the columns and relationships that ?fields= and ?include= may name
+    FIELDS = ('id', 'title', 'details', 'date_needed', 'status',
+              'volunteer_id')
+    INCLUDES = ('volunteer',)
+
+    @classmethod
+    def query_with_volunteer(cls):
+        # tasks with the assigned volunteer's name selected in the same query
+        # by an outer join.  Any other relationship raises instead of lazy
+        # loading, so formatting a list of these tasks never issues another
+        # query
+        return cls.query_fields()
+
+    @classmethod
+    def query_fields(cls, fields=None, include=None):
+        # the same, selecting only the columns in fields and joining the
+        # volunteer only if it is in include.  None selects all of them
+        query = cls.query
+        if fields is not None:
+            query = query.options(db.load_only(*fields))
+        if include is None or 'volunteer' in include:
+            query = query.options(
+                db.joinedload(cls.volunteers).load_only('name'))
+        return query.options(db.raiseload('*'))
+
+    def format(self, fields=None, include=None):
+        # only the attributes in fields are read, so a task loaded by
+        # query_fields() with the same fields never loads the others
+        fields = self.FIELDS if fields is None else fields
+        include = self.INCLUDES if include is None else include
+        task = {}
+        for field in fields:
+            value = getattr(self, field)
+            if field == 'date_needed':
+                value = datetime.strftime(value, '%Y-%m-%d')
+            task[field] = value
+        if 'volunteer' in include:
+            task['volunteer_name'] = ''
+            if self.volunteers:
+                task['volunteer_name'] = self.volunteers.name
+        return task
 
     def insert(self):
         db.session.add(self)
@@ -81,6 +130,10 @@ multiple tasks
 
 class Volunteer(db.Model):
     __tablename__ = 'volunteer'
+    __table_args__ = (
+        # volunteers are listed and paged in (name, id) order
+        db.Index('ix_volunteer_name', 'name', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -89,7 +142,11 @@ class Volunteer(db.Model):
     state = db.Column(db.String(2), nullable=False)
     zip_code = db.Column(db.String(10), nullable=False)
     phone_number = db.Column(db.String(12), nullable=False)
+    # incremented by every update, used for the volunteer's etag
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
     tasks = db.relationship('Task',
+                            order_by='Task.id',
                             backref=db.backref(
                                 'task_association'))
 
@@ -101,19 +158,38 @@ class Volunteer(db.Model):
         self.zip_code = zip_code
         self.phone_number = phone_number
 
-    def format(self):
-        task_list = Task.query.filter_by(volunteer_id=self.id).order_by\
-            (Task.id).all()
-        return {
-            'id': self.id,
-            'name': self.name,
-            'address': self.address,
-            'city': self.city,
-            'state': self.state,
-            'zip_code': self.zip_code,
-            'phone_number': self.phone_number,
-            'tasks': [task.format() for task in task_list]
-        }
+    FIELDS = ('id', 'name', 'address', 'city', 'state', 'zip_code',
+              'phone_number')
+    INCLUDES = ('tasks',)
+
+    @classmethod
+    def query_with_tasks(cls):
+        # volunteers with all of their tasks loaded by one extra select for
+        # the whole result, instead of one select per volunteer in format()
+        return cls.query_fields()
+
+    @classmethod
+    def query_fields(cls, fields=None, include=None):
+        # the same, selecting only the columns in fields and loading the
+        # tasks only if they are in include.  None selects all of them
+        query = cls.query
+        if fields is not None:
+            query = query.options(db.load_only(*fields))
+        if include is None or 'tasks' in include:
+            return query.options(db.selectinload(cls.tasks))
+        return query.options(db.raiseload(cls.tasks))
+
+    def format(self, fields=None, include=None):
+        # the tasks come from the tasks relationship, which is already loaded
+        # when the volunteer came from query_with_tasks().  Each task's
+        # volunteer is this volunteer, which is found in the session's
+        # identity map rather than selected again
+        fields = self.FIELDS if fields is None else fields
+        include = self.INCLUDES if include is None else include
+        volunteer = {field: getattr(self, field) for field in fields}
+        if 'tasks' in include:
+            volunteer['tasks'] = [task.format() for task in self.tasks]
+        return volunteer
 
     def insert(self):
         db.session.add(self)
@@ -125,3 +201,134 @@ class Volunteer(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+
+
+# the typeahead on the task form matches the start of lower(name).  With
+# text_pattern_ops PostgreSQL answers LIKE 'prefix%' from this index whatever
+# the database's collation
+db.Index('ix_volunteer_lower_name',
+         db.func.lower(Volunteer.name).label('lower_name'),
+         postgresql_ops={'lower_name': 'text_pattern_ops'})
+
+
+'''
+TableVersion class
+One row per table holding a counter that is incremented in the same
+transaction as any insert, update or delete of that table's rows.  The list
+endpoints build their etags from these counters, so checking whether a list
+has changed costs one small query.
+
+Incrementing the counter in the writing transaction means a change and its
+new version are committed together.  Bumping after the commit instead would
+lose the bump, and keep serving the stale lists, if the process died between
+the two.  The cost is that every transaction writing a table locks that
+table's counter row from its flush until its commit, so writers of the same
+table are serialized for that part of their transaction.  The writes here
+commit right after their flush, so the wait is short.
+'''
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_version'
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    VERSIONED_TABLES = ('task', 'volunteer')
+
+    @classmethod
+    def current(cls, *names):
+        # returns the versions of the named tables as a tuple
+        rows = dict(db.session.query(cls.name, cls.version)
+                    .filter(cls.name.in_(names)))
+        return tuple(rows.get(name, 0) for name in names)
+
+    @classmethod
+    def version_of(cls, name):
+        # the version of one table as a scalar subquery, for adding to
+        # another query
+        return db.session.query(cls.version) \
+            .filter(cls.name == name).as_scalar()
+
+    @classmethod
+    def bump(cls, session, names):
+        # increments the versions of the named tables in session's
+        # transaction.  Inserts, updates and deletes through the orm do
+        # this automatically, statements run with session.execute() must
+        # call it themselves
+        if names:
+            note_write()
+            session.execute(cls.__table__.update()
+                            .where(cls.name.in_(list(names)))
+                            .values(version=cls.version + 1))
+
+
+'''
+TaskStat class
+The number of tasks in each group shown on the dashboard: one row per
+status, per week of date_needed (keyed by the Monday that starts it) and per
+volunteer (keyed by the volunteer id, or '' for unassigned tasks).  The rows
+are kept up to date by stats.py as tasks change, so the dashboard reads a
+few summary rows instead of counting the task table.
+'''
+
+
+class TaskStat(db.Model):
+    __tablename__ = 'task_stat'
+    __table_args__ = (
+        # the busiest volunteers are read in count order
+        db.Index('ix_task_stat_kind_count', 'kind', 'count'),
+    )
+
+    kind = db.Column(db.String, primary_key=True)
+    key = db.Column(db.String, primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+# create the counter rows along with the table
+event.listen(TableVersion.__table__, 'after_create',
+             DDL("INSERT INTO table_version (name, version) "
+                 "VALUES ('task', 0), ('volunteer', 0)"))
+
+
+@event.listens_for(Task, 'before_update')
+@event.listens_for(Volunteer, 'before_update')
+def bump_row_version(mapper, connection, target):
+    # the row version only identifies the row's state for its etag.  It is
+    # incremented by the UPDATE itself instead of being used for optimistic
+    # locking, so concurrent updates of a row do not fail: the last one wins
+    if object_session(target).is_modified(target,
+                                          include_collections=False):
+        target.version = mapper.c.version + 1
+
+
+@event.listens_for(db.Model, 'after_insert', propagate=True)
+@event.listens_for(db.Model, 'after_update', propagate=True)
+@event.listens_for(db.Model, 'after_delete', propagate=True)
+def record_changed_table(mapper, connection, target):
+    # mapper events also fire for rows the flush changes by itself, such as
+    # the tasks whose volunteer_id is cleared when their volunteer is deleted
+    session = object_session(target)
+    session.info.setdefault('changed_tables', set()) \
+        .add(mapper.local_table.name)
+
+
+@event.listens_for(Session, 'after_flush')
+def bump_changed_tables(session, flush_context):
+    changed = session.info.pop('changed_tables', set())
+    TableVersion.bump(session,
+                      changed.intersection(TableVersion.VERSIONED_TABLES))
+
+
+@event.listens_for(Session, 'after_bulk_update')
+def bump_bulk_updated_table(update_context):
+    table = update_context.mapper.local_table.name
+    TableVersion.bump(update_context.session,
+                      {table}.intersection(TableVersion.VERSIONED_TABLES))
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def bump_bulk_deleted_table(delete_context):
+    table = delete_context.mapper.local_table.name
+    TableVersion.bump(delete_context.session,
+                      {table}.intersection(TableVersion.VERSIONED_TABLES))
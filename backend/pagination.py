@@ -0,0 +1,74 @@
+import os
+import json
+import base64
+from flask import request, abort
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+
+'''
+Keyset (cursor) pagination
+A page is the first `limit` rows that sort after the cursor, so the database
+can seek straight to the start of the page using the index on the sort
+columns instead of reading and discarding all of the earlier rows.  The
+cursor is the sort key of the last row on the previous page, encoded so that
+clients treat it as an opaque string.
+'''
+
+
+def encode_cursor(values):
+    data = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    # returns the list of key values in cursor, aborts with a 400 if the
+    # cursor was not created by encode_cursor for a key of these columns
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except Exception:
+        abort(400)
+    if not isinstance(values, list) or len(values) != len(columns):
+        abort(400)
+    # a value of the wrong type would only fail once it reached the database
+    for value, column in zip(values, columns):
+        if isinstance(value, bool) or \
+                not isinstance(value, column.type.python_type):
+            abort(400)
+    return values
+
+
+def get_page_args():
+    # returns the limit and raw cursor from the query string
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    return min(limit, MAX_PAGE_SIZE), request.args.get('cursor')
+
+
+def keyset_page(query, columns, cursor, limit):
+    # returns the rows of query that follow cursor, ordered by columns, and
+    # the cursor for the next page (None when this is the last page).  The
+    # last column must be unique, normally the primary key, so that rows
+    # with equal leading values are neither skipped nor repeated
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        if len(columns) == 1:
+            query = query.filter(columns[0] > values[0])
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+
+    # one extra row is fetched to find out if there is a next page
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, column.key)
+                                    for column in columns)
+    return rows, next_cursor
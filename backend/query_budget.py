@@ -0,0 +1,110 @@
+import os
+from collections import Counter
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+Query budgets
+The most SQL statements each read endpoint may run, however many rows it
+returns.  An endpoint that runs one statement per row (an N+1 query) goes
+over its budget as soon as it returns more than a few rows, and usually
+runs the same statement again and again, which is reported as well.
+
+The tests check every endpoint against its budget.  In development
+(FLASK_ENV=development, or QUERY_BUDGET_WARNINGS=true) every request is
+checked too, and a warning is logged for any request that goes over.
+'''
+
+# endpoint: the most statements it may run
+QUERY_BUDGETS = {
+    'get_tasks': 2,
+    'get_open_tasks': 2,
+    'get_task': 2,
+    'search_tasks': 2,
+    'get_volunteers': 3,
+    'get_volunteer': 3,
+    'search_volunteers': 3,
+    'get_stats': 3,
+    'volunteer_typeahead': 1,
+    'export_tasks': 1,
+    'export_volunteers': 1,
+}
+# budget of the endpoints that are not listed above
+DEFAULT_QUERY_BUDGET = int(os.environ.get('DEFAULT_QUERY_BUDGET', 10))
+# a statement run this many times by one request is probably an N+1 query
+REPEATED_QUERY_THRESHOLD = int(os.environ.get('REPEATED_QUERY_THRESHOLD', 3))
+
+
+class QueryLog:
+    # collects the sql statements run on any engine while it is active
+    def __init__(self):
+        self.statements = []
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self.record)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+def repeated_statements(statements, threshold=REPEATED_QUERY_THRESHOLD):
+    # returns {statement: times run} for the statements run at least
+    # threshold times.  The parameters are not compared, since an N+1 query
+    # runs the same statement with a different id each time
+    return {statement: count
+            for statement, count in Counter(statements).items()
+            if count >= threshold}
+
+
+def check_budget(endpoint, statements):
+    # returns a list of the ways in which statements break endpoint's budget
+    problems = []
+    budget = QUERY_BUDGETS.get(endpoint, DEFAULT_QUERY_BUDGET)
+    if len(statements) > budget:
+        problems.append('{} ran {} queries, over its budget of {}'.format(
+            endpoint, len(statements), budget))
+    for statement, count in repeated_statements(statements).items():
+        problems.append('{} ran this query {} times, probably an N+1 '
+                        'query: {}'.format(endpoint, count,
+                                           ' '.join(statement.split())))
+    return problems
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def log_request_statement(conn, cursor, statement, parameters, context,
+                          executemany):
+    if has_request_context() and 'query_statements' in g:
+        g.query_statements.append(statement)
+
+
+def init_query_budget(app):
+    # in development, logs a warning for every request that goes over its
+    # endpoint's budget
+    enabled = os.environ.get('QUERY_BUDGET_WARNINGS')
+    if enabled is None:
+        enabled = app.debug
+    else:
+        enabled = enabled.lower() in ('1', 'true', 'yes')
+    if not enabled:
+        return
+
+    @app.before_request
+    def start_query_log():
+        g.query_statements = []
+
+    @app.after_request
+    def check_query_budget(response):
+        statements = g.pop('query_statements', None)
+        if statements is not None and request.endpoint:
+            for problem in check_budget(request.endpoint, statements):
+                app.logger.warning(problem)
+        return response
@@ -0,0 +1,114 @@
+import json
+from datetime import date, timedelta
+from models import db, Task, Volunteer
+from search import volunteer_prefix_query
+
+'''
+Query plan checks
+Runs EXPLAIN on the queries that the busiest routes issue and reports any
+that read a whole table.  On PostgreSQL sequential scans are switched off for
+the check, so a small seeded database gives the same answer as a large one:
+the planner only falls back to a sequential scan when no index can serve the
+query at all.  The check therefore finds missing indexes, but it does not
+show that the planner would choose an index with sequential scans allowed;
+that depends on the table sizes and statistics of the real database.
+'''
+
+
+def hot_queries():
+    # returns (name, query) pairs for the queries that must use an index
+    today = date.today()
+    return [
+        ('open tasks',
+         Task.query.filter(Task.status == 'Open').order_by(Task.id)),
+        ('tasks page',
+         Task.query.filter(Task.id > 0).order_by(Task.id).limit(50)),
+        ('tasks for volunteers',
+         Task.query.filter(Task.volunteer_id.in_([1, 2, 3]))
+         .order_by(Task.volunteer_id, Task.id)),
+        ('tasks by date needed',
+         Task.query.filter(Task.date_needed >= today,
+                           Task.date_needed < today + timedelta(days=7))),
+        ('volunteers page',
+         Volunteer.query.order_by(Volunteer.name, Volunteer.id).limit(50)),
+        ('volunteer typeahead', volunteer_prefix_query('jo', 10)),
+    ]
+
+
+def compile_query(query, dialect):
+    # returns the sql and parameters for query.  Values are inlined where
+    # the dialect can render them, since a partial index can only be used
+    # when the planner can see the value being compared
+    statement = query.statement
+    try:
+        sql = statement.compile(dialect=dialect,
+                                compile_kwargs={'literal_binds': True})
+        return str(sql), {}
+    except NotImplementedError:
+        compiled = statement.compile(dialect=dialect)
+        if compiled.positional:
+            return str(compiled), [compiled.params[name]
+                                   for name in compiled.positiontup]
+        return str(compiled), compiled.params
+
+
+def explain(query):
+    # returns a list of the tables that query reads with a full scan
+    engine = db.engine
+    sql, params = compile_query(query, engine.dialect)
+
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            if engine.dialect.name == 'postgresql':
+                # only for this transaction, which is rolled back.  On a
+                # few seeded rows a sequential scan is cheapest even where
+                # an index would serve the query
+                conn.execute('SET LOCAL enable_seqscan = off')
+                plan = conn.execute('EXPLAIN (FORMAT JSON) ' + sql,
+                                    params).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return _pg_seq_scans(plan[0]['Plan'])
+            elif engine.dialect.name == 'sqlite':
+                rows = conn.execute('EXPLAIN QUERY PLAN ' + sql,
+                                    params).fetchall()
+                return _sqlite_full_scans(row[-1] for row in rows)
+            else:
+                return []
+        finally:
+            trans.rollback()
+
+
+def _pg_seq_scans(node):
+    tables = []
+    if node.get('Node Type') == 'Seq Scan':
+        tables.append(node.get('Relation Name'))
+    for child in node.get('Plans', []):
+        tables.extend(_pg_seq_scans(child))
+    return tables
+
+
+def _sqlite_full_scans(details):
+    # sqlite reports "SCAN task" (or "SCAN TABLE task" before 3.36) for a
+    # full table scan and adds "USING ... INDEX" when an index is walked
+    tables = []
+    for detail in details:
+        words = detail.split()
+        if words and words[0] == 'SCAN' and 'USING' not in words:
+            if len(words) > 2 and words[1] == 'TABLE':
+                tables.append(words[2])
+            elif len(words) > 1:
+                tables.append(words[1])
+    return tables
+
+
+def find_seq_scans():
+    # returns {query name: [tables]} for every hot query that does a
+    # sequential scan.  An empty dict means every hot query uses an index
+    problems = {}
+    for name, query in hot_queries():
+        tables = explain(query)
+        if tables:
+            problems[name] = tables
+    return problems
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from functools import wraps
+from flask import g, session, current_app, has_app_context, \
+    has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+from sqlalchemy.sql.expression import Select, CompoundSelect
+
+# a read only copy of the database.  When it is not set every query goes to
+# DATABASE_URL
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+# seconds the replica may fall behind.  Reads go to the primary while the
+# replica is further behind than this, and for this long after a write
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+# seconds between checks of the replica's health and lag
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 10))
+
+REPLICA_BIND = 'replica'
+
+'''
+Read replica routing
+Routes marked with read_only send their SELECT statements to the replica,
+when one is configured.  Everything else, including every flush, every
+INSERT, UPDATE and DELETE and any text or DDL statement, uses the primary.
+A read goes to the primary instead when:
+- the replica could not be reached, or is more than REPLICA_MAX_LAG seconds
+  behind, at its last check
+- this worker wrote to the database in the last REPLICA_MAX_LAG seconds, so
+  its cached lists are never rebuilt from older data
+- the same browser session wrote in the last REPLICA_MAX_LAG seconds, so a
+  user always sees their own change on the page they are redirected to
+'''
+
+# the replica's lag in seconds.  NULL on a server that is not replicating,
+# and 0 when it has replayed everything it has received
+LAG_SQL = ("SELECT CASE WHEN pg_last_wal_receive_lsn() = "
+           "pg_last_wal_replay_lsn() THEN 0 ELSE EXTRACT(EPOCH FROM "
+           "now() - pg_last_xact_replay_timestamp()) END")
+
+
+class ReplicaStatus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.available = True
+        self.lag = 0.0
+        self.checked_at = 0.0
+        self.last_write = 0.0
+
+    def check(self, engine):
+        try:
+            with engine.connect() as conn:
+                if engine.dialect.name == 'postgresql':
+                    lag = conn.execute(LAG_SQL).scalar()
+                else:
+                    conn.execute('SELECT 1')
+                    lag = 0
+            self.lag = float(lag or 0)
+            self.available = True
+        except SQLAlchemyError:
+            self.available = False
+        self.checked_at = time.time()
+
+    def usable(self, engine):
+        # checks the replica if the last check is out of date.  Only one
+        # request checks at a time, the others use the last result
+        if time.time() - self.checked_at > REPLICA_CHECK_INTERVAL:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.check(engine)
+                finally:
+                    self._lock.release()
+        return self.available and self.lag <= REPLICA_MAX_LAG
+
+    def mark_down(self):
+        self.available = False
+        self.checked_at = time.time()
+
+
+replica_status = ReplicaStatus()
+
+
+def note_write():
+    # called whenever the primary is written to
+    replica_status.last_write = time.time()
+    if has_request_context():
+        g.wrote_primary = True
+
+
+def replica_engine(app):
+    return get_state(app).db.get_engine(app, bind=REPLICA_BIND)
+
+
+def replica_wanted():
+    # returns True if the reads of the current request should use the
+    # replica
+    if not has_app_context():
+        return False
+    if REPLICA_BIND not in (current_app.config.get('SQLALCHEMY_BINDS') or {}):
+        return False
+    now = time.time()
+    if now - replica_status.last_write < REPLICA_MAX_LAG:
+        return False
+    if has_request_context() and session.get('primary_until', 0) > now:
+        return False
+    return replica_status.usable(replica_engine(current_app))
+
+
+def read_only(f):
+    # sends the queries made by f to the replica when it is usable.  If the
+    # replica fails part way through, f is run again on the primary; an
+    # error from the primary is raised as it would be without a replica
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        previous = g.get('use_replica', False)
+        if previous or not replica_wanted():
+            return f(*args, **kwargs)
+
+        g.use_replica = True
+        g.replica_failed = False
+        try:
+            return f(*args, **kwargs)
+        except OperationalError:
+            db_session = get_state(current_app).db.session
+            if not g.get('replica_failed', False) or \
+                    db_session.new or db_session.dirty or db_session.deleted:
+                raise
+            replica_status.mark_down()
+            db_session.rollback()
+            g.use_replica = False
+            return f(*args, **kwargs)
+        finally:
+            g.use_replica = previous
+    return wrapper
+
+
+@event.listens_for(Engine, 'handle_error')
+def note_replica_error(context):
+    # remembers that a statement of this request failed on the replica,
+    # including failing to connect to it
+    if has_app_context() and g.get('use_replica', False) and \
+            context.engine is replica_engine(current_app):
+        g.replica_failed = True
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        # only a select may go to the replica.  Anything else, or a call
+        # without a statement, might write
+        if (has_app_context() and g.get('use_replica', False) and
+                not self._flushing and
+                isinstance(clause, (Select, CompoundSelect))):
+            return replica_engine(self.app)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def init_replica(app):
+    # adds the replica bind, if one is configured, and keeps a browser that
+    # has just written to the database on the primary for REPLICA_MAX_LAG
+    # seconds
+    if DATABASE_REPLICA_URL:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA_BIND] = DATABASE_REPLICA_URL
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('wrote_primary', False):
+            session['primary_until'] = time.time() + REPLICA_MAX_LAG
+        return response
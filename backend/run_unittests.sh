@@ -1,3 +1,4 @@
 export DATABASE_URL="postgresql://leegramling@localhost:5432/ftk_test"
+python3 manage.py db upgrade
 python3 test_app.py
 export DATABASE_URL="postgresql://leegramling@localhost:5432/capstone"
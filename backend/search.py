@@ -0,0 +1,206 @@
+import os
+from sqlalchemy import or_
+from models import db, Task, Volunteer
+
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+# volunteers returned by each typeahead lookup on the task form
+TYPEAHEAD_LIMIT = int(os.environ.get('TYPEAHEAD_LIMIT', 10))
+
+'''
+Search backends
+Task search matches the title and details, volunteer search matches the name
+and city.  Every backend builds a select of the matching ids, best match
+first, and returns (ids, has_more) for one page of it.  The routes then load
+the matching rows with a single query.
+
+PostgresSearchBackend uses the pg_trgm GIN indexes added by the search
+migration, so a substring match is an index lookup instead of a table scan,
+and ranks by trigram similarity.  SqliteSearchBackend uses the FTS5 tables
+with the trigram tokenizer that the same migration adds on SQLite, kept in
+step by triggers, so the same substring searches can be run and tested
+locally.  LikeSearchBackend is the unindexed fallback for any other
+database.
+'''
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%') \
+        .replace('_', '\\_')
+
+
+class LikeSearchBackend:
+    name = 'like'
+
+    def _contains(self, column, term):
+        return column.ilike('%' + escape_like(term) + '%', escape='\\')
+
+    def _page(self, statement, limit, offset):
+        # one extra row is fetched to find out if there is another page
+        ids = [row[0] for row in db.session.execute(
+            statement.limit(limit + 1).offset(offset))]
+        return ids[:limit], len(ids) > limit
+
+    def task_ids(self, term):
+        # a select of the ids of the matching tasks, best match first.  The
+        # async tier runs the same selects on its own connections
+        return db.select([Task.id]) \
+            .where(or_(self._contains(Task.title, term),
+                       self._contains(Task.details, term))) \
+            .order_by(Task.id)
+
+    def volunteer_ids(self, term):
+        return db.select([Volunteer.id]) \
+            .where(or_(self._contains(Volunteer.name, term),
+                       self._contains(Volunteer.city, term))) \
+            .order_by(Volunteer.name, Volunteer.id)
+
+    def search_tasks(self, term, limit, offset):
+        return self._page(self.task_ids(term), limit, offset)
+
+    def search_volunteers(self, term, limit, offset):
+        return self._page(self.volunteer_ids(term), limit, offset)
+
+
+class PostgresSearchBackend(LikeSearchBackend):
+    name = 'postgresql'
+
+    def _ranked(self, entity, columns, term):
+        # ILIKE is answered from the trigram indexes, similarity() orders
+        # the matches so the closest ones come first
+        rank = db.func.greatest(*[db.func.similarity(column, term)
+                                  for column in columns])
+        return db.select([entity.id]) \
+            .where(or_(*[self._contains(column, term)
+                         for column in columns])) \
+            .order_by(rank.desc(), entity.id)
+
+    def task_ids(self, term):
+        return self._ranked(Task, [Task.title, Task.details], term)
+
+    def volunteer_ids(self, term):
+        return self._ranked(Volunteer, [Volunteer.name, Volunteer.city],
+                            term)
+
+
+class SqliteSearchBackend(LikeSearchBackend):
+    name = 'sqlite'
+
+    # table: (fts table, indexed columns)
+    FTS_TABLES = {
+        'task': ('task_fts', ['title', 'details']),
+        'volunteer': ('volunteer_fts', ['name', 'city']),
+    }
+
+    # the trigram tokenizer cannot match fewer than 3 characters
+    MIN_TERM_LENGTH = 3
+
+    def __init__(self):
+        self.ready = None
+
+    def fts_ready(self):
+        # the fts tables and their triggers are made by the search
+        # migration.  A database made any other way, with db.create_all()
+        # for example, is searched with LIKE instead
+        if self.ready is None:
+            names = [fts for fts, columns in self.FTS_TABLES.values()]
+            found = db.session.execute(
+                db.select([db.func.count()])
+                .select_from(db.table('sqlite_master'))
+                .where(db.column('name').in_(names))).scalar()
+            self.ready = found == len(names)
+        return self.ready
+
+    def _ranked(self, table, term):
+        fts = self.FTS_TABLES[table][0]
+        # the term is quoted so that it is matched as a plain string
+        # rather than parsed as an fts5 query
+        return db.select([db.column('rowid')]) \
+            .select_from(db.table(fts)) \
+            .where(db.text('{0} MATCH :term'.format(fts)).bindparams(
+                term='"' + term.replace('"', '""') + '"')) \
+            .order_by(db.text('bm25({})'.format(fts)), db.column('rowid'))
+
+    def task_ids(self, term):
+        if len(term) < self.MIN_TERM_LENGTH or not self.fts_ready():
+            return super().task_ids(term)
+        return self._ranked('task', term)
+
+    def volunteer_ids(self, term):
+        if len(term) < self.MIN_TERM_LENGTH or not self.fts_ready():
+            return super().volunteer_ids(term)
+        return self._ranked('volunteer', term)
+
+
+BACKENDS = {
+    'like': LikeSearchBackend,
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+_backend = None
+
+
+def backend_for(dialect_name):
+    # returns a backend for a database of type dialect_name, or the one
+    # named by the SEARCH_BACKEND environment variable
+    name = SEARCH_BACKEND or dialect_name
+    return BACKENDS.get(name, LikeSearchBackend)()
+
+
+def get_search_backend():
+    # returns the backend for the configured database
+    global _backend
+    if _backend is None:
+        _backend = backend_for(db.engine.dialect.name)
+    return _backend
+
+
+def in_order(rows, ids):
+    # returns rows in the order of ids
+    by_id = {row.id: row for row in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def search_tasks(term, limit, offset=0, fields=None, include=None):
+    # returns (tasks, has_more), best match first.  fields and include are
+    # passed to Task.query_fields()
+    ids, has_more = get_search_backend().search_tasks(term, limit, offset)
+    if not ids:
+        return [], has_more
+    tasks = Task.query_fields(fields, include) \
+        .filter(Task.id.in_(ids)).all()
+    return in_order(tasks, ids), has_more
+
+
+def search_volunteers(term, limit, offset=0, fields=None, include=None):
+    # returns (volunteers, has_more), best match first
+    ids, has_more = get_search_backend().search_volunteers(term, limit,
+                                                           offset)
+    if not ids:
+        return [], has_more
+    volunteers = Volunteer.query_fields(fields, include) \
+        .filter(Volunteer.id.in_(ids)).all()
+    return in_order(volunteers, ids), has_more
+
+
+def volunteer_prefix_query(prefix, limit):
+    # a query of up to limit (id, name) of the volunteers whose name starts
+    # with prefix, which must not be empty, ignoring case, in name order.
+    # Answered from the index on lower(name): PostgreSQL uses it for
+    # LIKE 'prefix%', SQLite only for the range that every name with the
+    # prefix falls in
+    prefix = prefix.lower()
+    name = db.func.lower(Volunteer.name)
+    query = db.session.query(Volunteer.id, Volunteer.name) \
+        .filter(name.like(escape_like(prefix) + '%', escape='\\'))
+    if db.engine.dialect.name != 'postgresql':
+        following = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        query = query.filter(name >= prefix, name < following)
+    return query.order_by(name, Volunteer.id).limit(limit)
+
+
+def volunteers_by_prefix(prefix, limit):
+    # returns the volunteers of volunteer_prefix_query() as a list
+    if not prefix:
+        return []
+    return volunteer_prefix_query(prefix, limit).all()
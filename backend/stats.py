@@ -0,0 +1,206 @@
+import os
+from collections import Counter
+from datetime import date, timedelta
+from sqlalchemy import event, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, object_session, attributes
+from models import db, Task, Volunteer, TaskStat
+from validation import TASK_STATUSES
+
+# number of volunteers listed by /stats, busiest first
+STATS_TOP_VOLUNTEERS = int(os.environ.get('STATS_TOP_VOLUNTEERS', 10))
+
+'''
+Dashboard statistics
+The task counts by status, by week and by volunteer are kept in the
+task_stat table, so reading them costs two small queries however many tasks
+there are.  Every insert, update or delete of a task through the orm adds
++1 or -1 to the rows the task is counted in, and the changes of a flush are
+written in the same transaction as the tasks themselves.  On PostgreSQL the
+changes of a flush are one INSERT ... ON CONFLICT DO UPDATE statement, other
+databases update each row and insert it if it was missing.
+
+Statements that bypass the orm must keep the counts themselves:
+bulk_create() and bulk_assign() add their changes with add_counts(), while
+the importer and the data generator rebuild the table when they finish, as
+does `python manage.py rebuild_stats`.
+'''
+
+
+def week_of(day):
+    # the Monday that starts day's week, as the key of its week row
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def task_keys(status, date_needed, volunteer_id):
+    # the (kind, key) of each row a task with these values is counted in
+    return [('status', status),
+            ('week', week_of(date_needed)),
+            ('volunteer', '' if volunteer_id is None else str(volunteer_id))]
+
+
+def add_counts(session, counts):
+    # adds counts, {(kind, key): change}, to the task_stat rows in session's
+    # transaction.  The rows are changed in key order, so two transactions
+    # never wait on each other's rows
+    counts = sorted((key, change) for key, change in counts.items()
+                    if change)
+    if not counts:
+        return
+    table = TaskStat.__table__
+    if db.engine.dialect.name == 'postgresql':
+        upsert = pg_insert(table).values([
+            {'kind': kind, 'key': key, 'count': change}
+            for (kind, key), change in counts])
+        session.execute(upsert.on_conflict_do_update(
+            index_elements=[table.c.kind, table.c.key],
+            set_={'count': table.c.count + upsert.excluded.count}))
+        return
+    for (kind, key), change in counts:
+        result = session.execute(
+            table.update()
+            .where((table.c.kind == kind) & (table.c.key == key))
+            .values(count=table.c.count + change))
+        if result.rowcount == 0:
+            session.execute(table.insert().values(kind=kind, key=key,
+                                                  count=change))
+
+
+def pending_counts(target):
+    session = object_session(target)
+    return session.info.setdefault('task_stat_counts', Counter())
+
+
+def old_value(target, name):
+    # the value of name before the changes being flushed
+    history = attributes.get_history(target, name)
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, name)
+
+
+def keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+# with active history the old value of a counted column is loaded before it
+# is changed, even when it had been expired, so old_value() always finds it
+for column in (Task.status, Task.date_needed, Task.volunteer_id):
+    event.listen(column, 'set', keep_old_value, active_history=True,
+                 retval=True)
+
+
+@event.listens_for(Task, 'after_insert')
+def count_inserted_task(mapper, connection, target):
+    counts = pending_counts(target)
+    for key in task_keys(target.status, target.date_needed,
+                         target.volunteer_id):
+        counts[key] += 1
+
+
+@event.listens_for(Task, 'after_update')
+def count_updated_task(mapper, connection, target):
+    # the volunteer_id of a deleted volunteer's tasks is cleared by the
+    # flush, which is counted here as well
+    counts = pending_counts(target)
+    for key in task_keys(old_value(target, 'status'),
+                         old_value(target, 'date_needed'),
+                         old_value(target, 'volunteer_id')):
+        counts[key] -= 1
+    for key in task_keys(target.status, target.date_needed,
+                         target.volunteer_id):
+        counts[key] += 1
+
+
+@event.listens_for(Task, 'before_delete')
+def count_deleted_task(mapper, connection, target):
+    # before the delete, so that expired attributes can still be loaded
+    counts = pending_counts(target)
+    for key in task_keys(old_value(target, 'status'),
+                         old_value(target, 'date_needed'),
+                         old_value(target, 'volunteer_id')):
+        counts[key] -= 1
+
+
+@event.listens_for(Session, 'after_flush')
+def write_task_counts(session, flush_context):
+    add_counts(session, session.info.pop('task_stat_counts', {}))
+
+
+def week_expression(column):
+    # the Monday of column's week as a YYYY-MM-DD string, in sql
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(func.date_trunc('week', column), 'YYYY-MM-DD')
+    return func.date(column, 'weekday 0', '-6 days')
+
+
+def rebuild_stats(conn):
+    # recounts every task_stat row from the task table in conn's
+    # transaction and returns the number of rows written
+    if conn.dialect.name == 'postgresql':
+        # a task written while the rows are recounted would add its change
+        # to rows that are being replaced, and be counted twice or not at
+        # all.  SHARE mode waits for the writers that are running and holds
+        # off new ones until the transaction ends, but lets reads through.
+        # On SQLite the DELETE already holds the database's write lock
+        conn.execute('LOCK TABLE task IN SHARE MODE')
+    table = TaskStat.__table__
+    task = Task.__table__
+    groups = [
+        ('status', task.c.status),
+        ('week', week_expression(task.c.date_needed)),
+        ('volunteer', func.coalesce(db.cast(task.c.volunteer_id, db.String),
+                                    '')),
+    ]
+    conn.execute(table.delete())
+    rows = 0
+    for kind, key in groups:
+        key = key.label('key')
+        result = conn.execute(table.insert().from_select(
+            ['kind', 'key', 'count'],
+            db.select([db.literal(kind), key, func.count()])
+            .select_from(task).group_by(key)))
+        rows += result.rowcount
+    return rows
+
+
+def current_stats(today=None):
+    # returns the dashboard counts
+    today = today or date.today()
+    rows = db.session.query(TaskStat.kind, TaskStat.key, TaskStat.count) \
+        .filter(TaskStat.kind.in_(['status', 'week']) |
+                ((TaskStat.kind == 'volunteer') & (TaskStat.key == '')))
+    by_status = {status: 0 for status in TASK_STATUSES}
+    by_week = {}
+    unassigned = 0
+    for kind, key, count in rows:
+        if kind == 'status':
+            by_status[key] = count
+        elif kind == 'week':
+            if count:
+                by_week[key] = count
+        else:
+            unassigned = count
+
+    # the busiest volunteers are picked from the summary rows first and
+    # only their names are read from the volunteer table
+    top = db.session.query(TaskStat.key, TaskStat.count) \
+        .filter(TaskStat.kind == 'volunteer', TaskStat.key != '',
+                TaskStat.count > 0) \
+        .order_by(TaskStat.count.desc(), TaskStat.key) \
+        .limit(STATS_TOP_VOLUNTEERS).subquery()
+    volunteers = db.session.query(Volunteer.id, Volunteer.name, top.c.count) \
+        .join(top, Volunteer.id == db.cast(top.c.key, db.Integer)) \
+        .order_by(top.c.count.desc(), Volunteer.id)
+
+    return {
+        'total': sum(by_status.values()),
+        'by_status': by_status,
+        'this_week': by_week.get(week_of(today), 0),
+        'by_week': [{'week': week, 'count': by_week[week]}
+                    for week in sorted(by_week)],
+        'unassigned': unassigned,
+        'by_volunteer': [{'volunteer_id': volunteer_id, 'name': name,
+                          'count': count}
+                         for volunteer_id, name, count in volunteers],
+    }
@@ -1,8 +1,35 @@
+import io
 import os
+import tempfile
+import threading
 import unittest
 import json
+from unittest import mock
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+import auth
 from app import create_app
-from models import Volunteer
+from models import db, Task, Volunteer, TaskStat, TableVersion, \
+    database_path
+from query_plans import find_seq_scans
+from importer import import_file
+import replica
+import db_pool
+import pagination
+import metrics
+import benchmark
+import datagen
+import numpy
+import asgi
+import warmup
+from starlette.testclient import TestClient
+from forms import VolunteerForm
+from validation import validate_with_form, VOLUNTEER_FIELDS, TASK_STATUSES
+from query_budget import QueryLog, check_budget
+import cache
+from cache import response_cache
+from stats import rebuild_stats, current_stats, week_of
 
 
 class CapstoneTestCase(unittest.TestCase):
@@ -22,6 +49,9 @@ class CapstoneTestCase(unittest.TestCase):
         self.app = create_app()
         self.client = self.app.test_client
 
+        # every test starts with an empty response cache
+        response_cache.clear()
+
         # get Assistant and Director tokens from environment variables
         self.assistant_token = os.environ.get('ASSISTANT_TOKEN', '')
         self.director_token = os.environ.get('DIRECTOR_TOKEN', '')
@@ -45,6 +75,25 @@ class CapstoneTestCase(unittest.TestCase):
         # table before running.  It will be used to test delete_volunteer
         self.delete_volunteer_id = 101
 
+    def count_queries(self, url, headers=None):
+        # returns the number of sql statements executed while getting url
+        return len(self.get_queries(url, headers))
+
+    def get_queries(self, url, headers=None):
+        # returns the sql statements executed while getting url
+        with QueryLog() as log:
+            res = self.client().get(url, headers=headers)
+        self.assertEqual(res.status_code, 200)
+        return log.statements
+
+    def assertWithinQueryBudget(self, url, headers=None):
+        # the endpoint for url must stay within its query budget and must
+        # not run any statement over and over
+        endpoint = self.app.url_map.bind('localhost').match(
+            url.split('?')[0])[0]
+        problems = check_budget(endpoint, self.get_queries(url, headers))
+        self.assertEqual(problems, [])
+
     # Task Tests ############################################################
 
     # GET /tasks -- get_tasks
@@ -55,6 +104,134 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertIsNotNone(data['tasks'])
 
+    # GET /tasks?limit=&cursor= -- get_tasks
+    def test_get_tasks_paginated(self):
+        res = self.client().get('/tasks?limit=2')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['tasks']), 2)
+        self.assertIsNotNone(data['next_cursor'])
+
+        res = self.client().get('/tasks?limit=2&cursor=' +
+                                data['next_cursor'])
+        next_page = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(next_page['tasks'][0]['id'],
+                           data['tasks'][-1]['id'])
+
+    # GET /tasks -- get_tasks
+    def test_get_tasks_query_count(self):
+        # the assigned volunteers are joined, not loaded one task at a time
+        one = self.count_queries('/tasks?limit=1')
+        many = self.count_queries('/tasks?limit=100')
+        self.assertEqual(one, many)
+
+    # GET /tasks/open -- get_open_tasks
+    def test_get_open_tasks_single_query(self):
+        # the table versions, then the tasks with their volunteers
+        self.assertEqual(self.count_queries('/tasks/open'), 2)
+
+    # GET /tasks/open -- get_open_tasks
+    def test_get_open_tasks_cached(self):
+        # only the table versions are read once the list is cached
+        self.count_queries('/tasks/open')
+        self.assertEqual(self.count_queries('/tasks/open'), 1)
+        self.assertEqual(response_cache.hits, 1)
+
+    # GET /metrics -- get_metrics
+    def test_metrics_reports_response_cache(self):
+        self.client().get('/tasks/open')
+        self.client().get('/tasks/open')
+        text = self.client().get('/metrics').data.decode()
+        self.assertIn('response_cache_hits_total 1', text)
+        self.assertIn('response_cache_misses_total 1', text)
+
+    def test_response_cache_backends(self):
+        self.assertIsInstance(cache.make_backend('lru'), cache.LRUBackend)
+        with self.assertRaises(ValueError):
+            cache.make_backend('memcached')
+        # the none backend builds the value on every lookup
+        none = cache.ResponseCache(cache.make_backend('none'))
+        build = mock.Mock(return_value=['task'])
+        self.assertEqual(none.get_or_set(('tasks', 1), build), ['task'])
+        self.assertEqual(none.get_or_set(('tasks', 1), build), ['task'])
+        self.assertEqual(build.call_count, 2)
+        self.assertEqual(none.stats()['misses'], 2)
+
+    # GET /tasks -- get_tasks
+    def test_get_tasks_cache_sees_other_workers_writes(self):
+        # a write made by another worker, with a statement rather than the
+        # orm, is seen through the table versions in the database
+        urls = ['/tasks?limit=5&format=json', '/tasks/open']
+        for url in urls:
+            self.client().get(url)
+        title = 'Pick up donations - Aldi'
+        with self.app.app_context():
+            db.session.execute(Task.__table__.update()
+                               .where(Task.id == 1)
+                               .values(title=title, status='Open'))
+            TableVersion.bump(db.session, ['task'])
+            db.session.commit()
+        for url in urls:
+            res = self.client().get(url)
+            self.assertIn(title, res.data.decode(), url)
+
+    # GET /tasks -- get_tasks
+    def test_get_tasks_cache_invalidated_on_update(self):
+        res = self.client().get('/tasks/open')
+        self.assertEqual(res.status_code, 200)
+        title = 'Pick up donations - Kroger'
+        res = self.client().patch('/tasks/1', headers=self.director_header,
+                                  json={'title': title, 'status': 'Open'})
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/tasks/open')
+        self.assertIn(title, res.data.decode())
+
+    # GET /tasks with If-None-Match -- get_tasks
+    def test_get_tasks_not_modified(self):
+        res = self.client().get('/tasks')
+        self.assertEqual(res.status_code, 200)
+        etag = res.headers['ETag']
+
+        res = self.client().get('/tasks', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    # GET /tasks?cursor= -- get_tasks
+    def test_get_tasks_bad_cursor(self):
+        res = self.client().get('/tasks?cursor=not-a-cursor')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+        # well formed cursors whose values do not match the key's columns
+        for values in ([{}], ['1'], [True], [1, 2]):
+            res = self.client().get('/tasks?cursor=' +
+                                    pagination.encode_cursor(values))
+            self.assertEqual(res.status_code, 400)
+
+    # GET /tasks?fields=&include= -- get_tasks
+    def test_get_tasks_sparse_fieldset(self):
+        url = '/tasks?limit=5&fields=id,title,status'
+        statements = self.get_queries(url)
+        data = self.client().get(url).get_json()
+        self.assertEqual(set(data['tasks'][0]), {'id', 'title', 'status'})
+        # the unrequested columns and the volunteer are not selected
+        self.assertFalse(any('details' in statement or 'volunteer' in
+                             statement for statement in statements))
+
+        data = self.client().get(url + '&include=volunteer').get_json()
+        self.assertEqual(set(data['tasks'][0]),
+                         {'id', 'title', 'status', 'volunteer_name'})
+
+    # GET /tasks?fields= -- get_tasks
+    def test_get_tasks_unknown_field(self):
+        res = self.client().get('/tasks?fields=id,secret')
+        self.assertEqual(res.status_code, 400)
+        res = self.client().get('/tasks?include=tasks')
+        self.assertEqual(res.status_code, 400)
+
     # GET /tasks/<task_id> -- get_task
     def test_get_task_id_success(self):
         task_id = 1
@@ -64,6 +241,34 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertIsNotNone(data['task'])
 
+    # GET /tasks/<task_id> with If-None-Match -- get_task
+    def test_get_task_etag_changes_on_update(self):
+        res = self.client().get('/tasks/1')
+        etag = res.headers['ETag']
+        res = self.client().get('/tasks/1', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client().patch('/tasks/1', headers=self.director_header,
+                                  json={'details': 'Bring a truck'})
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/tasks/1', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_concurrent_task_updates_do_not_conflict(self):
+        # the version is only used for etags, so an update of a task that
+        # another worker changed after it was loaded still succeeds
+        with self.app.app_context():
+            task = Task.query.get(1)
+            version = task.version
+            table = Task.__table__
+            db.engine.execute(table.update().where(table.c.id == 1)
+                              .values(version=table.c.version + 1))
+            task.details = 'Bring two trucks'
+            task.update()
+            self.assertEqual(task.version, version + 2)
+
     # GET /tasks/<int:task_id> -- get_task
     def test_get_task_id_not_found(self):
         task_id = 99999
@@ -74,6 +279,29 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 404)
         self.assertEqual(data['message'], 'Resource Not Found')
 
+    # POST /tasks/search -- search_tasks
+    def test_search_tasks_json(self):
+        title = json.loads(self.client().get('/tasks/1').data)['task']['title']
+        res = self.client().post('/tasks/search',
+                                 json={'search_term': title, 'limit': 5})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertLessEqual(len(data['tasks']), 5)
+        self.assertIn(1, [task['id'] for task in data['tasks']])
+        for task in data['tasks']:
+            self.assertIn(title.lower(),
+                          (task['title'] + task['details']).lower())
+
+    # POST /tasks/search -- search_tasks
+    def test_search_tasks_no_match_json(self):
+        res = self.client().post('/tasks/search',
+                                 json={'search_term': 'zzqqxxnomatch'})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['tasks'], [])
+        self.assertEqual(data['has_more'], False)
+
     # PATCH tasks/<int:task_id> -- update_task
     def test_update_task_success(self):
         task_id = 2
@@ -143,7 +371,7 @@ class CapstoneTestCase(unittest.TestCase):
         res = self.client().delete('/tasks/' + str(task_id),
                                    headers=self.assistant_header)
         data = json.loads(res.data)
-        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.status_code, 403)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['error'], "Authentication Error")
 
@@ -186,6 +414,123 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 400)
         self.assertEqual(data['message'], 'Bad Request')
 
+    # POST tasks/bulk -- create_tasks_bulk
+    def test_create_tasks_bulk_success(self):
+        tasks = [{'title': 'Deliver meals ' + str(i),
+                  'details': 'Route ' + str(i),
+                  'date_needed': '2020-05-0' + str(i)} for i in range(1, 4)]
+        res = self.client().post('/tasks/bulk', headers=self.director_header,
+                                 json=tasks)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 3)
+        ids = [result['id'] for result in data['results']]
+        res = self.client().get('/tasks/' + str(ids[2]))
+        self.assertEqual(json.loads(res.data)['task']['title'],
+                         'Deliver meals 3')
+
+    # POST tasks/bulk -- create_tasks_bulk
+    def test_create_tasks_bulk_atomic_rejects_all(self):
+        tasks = [{'title': 'Sort cans', 'details': 'Food bank',
+                  'date_needed': '2020-05-01'},
+                 {'title': 'Sort boxes', 'details': 'Food bank',
+                  'date_needed': 'next week'}]
+        res = self.client().post('/tasks/bulk', headers=self.director_header,
+                                 json=tasks)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['created'], 0)
+        self.assertIn('date_needed', data['results'][1]['errors'])
+
+        res = self.client().post('/tasks/search?format=json',
+                                 json={'search_term': 'Sort cans'})
+        self.assertEqual(json.loads(res.data)['tasks'], [])
+
+    # POST tasks/bulk -- create_tasks_bulk
+    def test_create_tasks_bulk_rejects_bad_status(self):
+        task = {'title': 'Sort cans', 'details': 'Food bank',
+                'date_needed': '2020-05-01'}
+        tasks = [dict(task, status='Done'), dict(task, status=None)]
+        res = self.client().post('/tasks/bulk', headers=self.director_header,
+                                 json=tasks)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['created'], 0)
+        for result in data['results']:
+            self.assertIn('status', result['errors'])
+
+    # POST volunteers/bulk?mode=partial -- create_volunteers_bulk
+    def test_create_volunteers_bulk_partial(self):
+        volunteers = [{'name': 'Ann Lee', 'address': '1 Elm St',
+                       'city': 'Atlanta', 'state': 'GA', 'zip_code': '30303',
+                       'phone_number': '404-555-1234'},
+                      {'name': 'Bo Diaz'}]
+        res = self.client().post('/volunteers/bulk?mode=partial',
+                                 headers=self.director_header,
+                                 json=volunteers)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['failed'], 1)
+        self.assertTrue(data['results'][0]['success'])
+        self.assertIn('address', data['results'][1]['errors'])
+
+    # GET tasks/export -- export_tasks
+    def test_export_tasks_ndjson(self):
+        res = self.client().get('/tasks/export?status=Open',
+                                headers=self.director_header)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        tasks = [json.loads(line) for line in res.data.decode().splitlines()]
+        self.assertTrue(tasks)
+        for task in tasks:
+            self.assertEqual(task['status'], 'Open')
+
+    # GET volunteers/export?format=csv -- export_volunteers
+    def test_export_volunteers_csv(self):
+        res = self.client().get('/volunteers/export?format=csv',
+                                headers=self.director_header)
+        self.assertEqual(res.status_code, 200)
+        lines = res.data.decode().splitlines()
+        self.assertEqual(lines[0], 'id,name,address,city,state,zip_code,'
+                                   'phone_number')
+        self.assertGreater(len(lines), 1)
+
+    # GET tasks/export -- export_tasks
+    def test_export_tasks_bad_filter(self):
+        res = self.client().get('/tasks/export?date_from=yesterday',
+                                headers=self.director_header)
+        self.assertEqual(res.status_code, 400)
+
+    # POST tasks/assign -- assign_tasks
+    def test_assign_tasks_success(self):
+        changes = [{'task_id': 1, 'volunteer_id': 2, 'status': 'Filled'},
+                   {'task_id': 2, 'volunteer_id': 2, 'status': 'Filled'}]
+        res = self.client().post('/tasks/assign',
+                                 headers=self.director_header, json=changes)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], 2)
+        for task in data['tasks']:
+            self.assertEqual(task['volunteer_id'], 2)
+            self.assertEqual(task['status'], 'Filled')
+
+    # POST tasks/assign -- assign_tasks
+    def test_assign_tasks_unknown_volunteer(self):
+        res = self.client().get('/tasks/1')
+        before = json.loads(res.data)['task']
+        changes = [{'task_id': 1, 'status': 'Complete'},
+                   {'task_id': 2, 'volunteer_id': 99999}]
+        res = self.client().post('/tasks/assign',
+                                 headers=self.director_header, json=changes)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['results'][0]['index'], 1)
+        self.assertIn('volunteer_id', data['results'][0]['errors'])
+
+        res = self.client().get('/tasks/1')
+        self.assertEqual(json.loads(res.data)['task'], before)
+
     # Volunteer Tests #########################################################
 
     # GET volunteers/ -- get_volunteers()
@@ -197,6 +542,46 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertIsNotNone(data['volunteers'])
 
+    # GET volunteers?limit=&cursor= -- get_volunteers()
+    def test_get_volunteers_paginated(self):
+        res = self.client().get('/volunteers?limit=2',
+                                headers=self.director_header)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['volunteers']), 2)
+        self.assertIsNotNone(data['next_cursor'])
+
+        res = self.client().get('/volunteers?limit=2&cursor=' +
+                                data['next_cursor'],
+                                headers=self.director_header)
+        next_page = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        last = data['volunteers'][-1]
+        first = next_page['volunteers'][0]
+        self.assertGreater((first['name'], first['id']),
+                           (last['name'], last['id']))
+
+    # GET volunteers/ -- get_volunteers()
+    def test_get_volunteers_query_count(self):
+        # the number of queries must not grow with the number of volunteers
+        one = self.count_queries('/volunteers?limit=1',
+                                 headers=self.director_header)
+        many = self.count_queries('/volunteers?limit=100',
+                                  headers=self.director_header)
+        self.assertEqual(one, many)
+
+    # GET volunteers/?fields= -- get_volunteers()
+    def test_get_volunteers_sparse_fieldset(self):
+        # without include the tasks are neither loaded nor returned
+        url = '/volunteers?limit=2&fields=id,city'
+        statements = self.get_queries(url, headers=self.director_header)
+        data = self.client().get(url, headers=self.director_header) \
+            .get_json()
+        self.assertEqual(set(data['volunteers'][0]), {'id', 'city'})
+        self.assertIsNotNone(data['next_cursor'])
+        self.assertFalse(any('FROM task' in statement
+                             for statement in statements))
+
     # GET volunteers/<int: vol_id> -- get_volunteer(vol_id)
     def test_get_volunteer_id_success(self):
         volunteer_id = '1'
@@ -207,6 +592,15 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertIsNotNone(data['volunteer'])
 
+    # GET volunteers/<int: vol_id> with If-None-Match -- get_volunteer
+    def test_get_volunteer_not_modified(self):
+        res = self.client().get('/volunteers/1',
+                                headers=self.director_header)
+        headers = dict(self.director_header,
+                       **{'If-None-Match': res.headers['ETag']})
+        res = self.client().get('/volunteers/1', headers=headers)
+        self.assertEqual(res.status_code, 304)
+
     # GET volunteers/<int: vol_id> -- get_volunteer(vol_id)
     def test_get_volunteer_id_not_found(self):
         volunteer_id = '99999'
@@ -218,6 +612,61 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 404)
         self.assertEqual(data['message'], 'Resource Not Found')
 
+    # POST volunteers/search -- search_volunteers()
+    def test_search_volunteers_json(self):
+        res = self.client().get('/volunteers/1', headers=self.director_header)
+        name = json.loads(res.data)['volunteer']['name']
+        res = self.client().post('/volunteers/search',
+                                 json={'search_term': name},
+                                 headers=self.director_header)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn(1, [vol['id'] for vol in data['volunteers']])
+
+    # GET volunteers/search -- search_volunteers()
+    def test_search_volunteers_without_token(self):
+        # addresses and phone numbers are only shown to staff
+        res = self.client().get('/volunteers/search?search_term=Vol'
+                                '&format=json')
+        self.assertEqual(res.status_code, 401)
+
+    # GET volunteers/typeahead -- volunteer_typeahead()
+    def test_volunteer_typeahead(self):
+        res = self.client().get('/volunteers/typeahead?q=vOL 00',
+                                headers=self.director_header)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['volunteers'])
+        self.assertTrue(all(vol['name'].lower().startswith('vol 00')
+                            for vol in data['volunteers']))
+        names = [vol['name'].lower() for vol in data['volunteers']]
+        self.assertEqual(names, sorted(names))
+
+        res = self.client().get('/volunteers/typeahead?q=%25',
+                                headers=self.director_header)
+        self.assertEqual(json.loads(res.data)['volunteers'], [])
+
+    # GET tasks/update/<int:task_id> -- update_task_form(task_id)
+    def test_volunteer_choices_cached(self):
+        # the volunteer names are loaded once, and again after a volunteer
+        # is added
+        def names_loaded():
+            statements = self.get_queries('/tasks/update/1',
+                                          headers=self.director_header)
+            return any('ORDER BY volunteer.name' in statement
+                       for statement in statements)
+
+        self.assertTrue(names_loaded())
+        self.assertFalse(names_loaded())
+        self.client().post('/volunteers/create',
+                           headers=self.director_header,
+                           json={'name': 'Choice Test', 'address': '1 Elm',
+                                 'city': 'Town', 'state': 'GA',
+                                 'zip_code': '30303',
+                                 'phone_number': '404-555-0199'})
+        self.assertTrue(names_loaded())
+
     # PATCH volunteers/<int: vol_id> -- update_volunteer(vol_id)
     def test_update_volunteer_success(self):
         volunteer_id = '1'
@@ -347,7 +796,7 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertIsNotNone(data['volunteer'])
         self.assertEqual(data['volunteer']['zip_code'], new_zip_code)
 
-    def test_assistant_roll_create_task_401(self):
+    def test_assistant_roll_create_task_403(self):
         res = self.client().post('/tasks/create',
                                  headers=self.assistant_header,
                                  json={
@@ -357,10 +806,601 @@ class CapstoneTestCase(unittest.TestCase):
                                     'date_needed': '2020-05-31'
                                  })
         data = json.loads(res.data)
-        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.status_code, 403)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['error'], "Authentication Error")
 
+    # Query Budget Tests ######################################################
+
+    def test_query_budgets(self):
+        # every read endpoint stays within its budget whatever the page size
+        self.client().get('/tasks/search?search_term=Task&format=json')
+        self.client().get('/volunteers/search?search_term=Vol&format=json',
+                          headers=self.director_header)
+        for limit in (1, 100):
+            for url in ['/tasks?limit={}', '/volunteers?limit={}',
+                        '/tasks/search?search_term=a&format=json&limit={}',
+                        '/volunteers/search?search_term=a&format=json'
+                        '&limit={}']:
+                self.assertWithinQueryBudget(url.format(limit),
+                                             headers=self.director_header)
+        for url in ['/tasks/open', '/tasks/1', '/volunteers/1', '/stats']:
+            self.assertWithinQueryBudget(url, headers=self.director_header)
+
+    def test_repeated_query_is_reported(self):
+        # loading tasks one at a time is reported as an N+1 query
+        with self.app.app_context(), QueryLog() as log:
+            for task_id in range(1, 5):
+                db.session.query(Task).filter(Task.id == task_id).first()
+        problems = check_budget('get_tasks', log.statements)
+        self.assertEqual(len(problems), 2)
+        self.assertIn('N+1', problems[1])
+
+    def test_query_budget_warning(self):
+        # in development a request over its budget logs a warning
+        with mock.patch.dict(os.environ, {'QUERY_BUDGET_WARNINGS': 'true'}), \
+                mock.patch.dict('query_budget.QUERY_BUDGETS',
+                                {'get_tasks': 0}):
+            app = create_app()
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                res = app.test_client().get('/tasks?limit=5')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('over its budget of 0', logs.output[0])
+
+    # Query Plan Tests ########################################################
+
+    def test_hot_queries_use_indexes(self):
+        self.assertEqual(find_seq_scans(), {})
+
+    # Pool Tests ##############################################################
+
+    # GET /metrics/pool -- get_pool_metrics
+    def test_pool_metrics(self):
+        self.client().get('/tasks')
+        res = self.client().get('/metrics/pool')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(data['pool']['checkouts'], 0)
+        self.assertGreaterEqual(data['pool']['checked_out'], 0)
+
+    def test_pool_counts_foreign_connection_once(self):
+        # a connection inherited from another process is replaced on
+        # checkout and counted as one invalidation
+        engine = create_engine('sqlite://', poolclass=QueuePool)
+        with engine.connect() as conn:
+            conn.connection._connection_record.info['pid'] = -1
+        before = db_pool.pool_metrics.invalidations
+        with engine.connect() as conn:
+            self.assertEqual(conn.scalar('SELECT 1'), 1)
+            pid = conn.connection._connection_record.info['pid']
+        self.assertEqual(pid, os.getpid())
+        self.assertEqual(db_pool.pool_metrics.invalidations, before + 1)
+        engine.dispose()
+
+    # Metrics Tests ###########################################################
+
+    # GET /metrics -- get_metrics
+    def test_metrics_records_requests(self):
+        self.client().get('/tasks')
+        res = self.client().get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        text = res.data.decode()
+        self.assertIn('http_requests_total{endpoint="get_tasks",'
+                      'method="GET",status="200"}', text)
+        self.assertIn('http_request_sql_queries_count{endpoint="get_tasks"}',
+                      text)
+        self.assertIn('db_pool_connects_total', text)
+
+    # GET /metrics -- get_metrics
+    def test_metrics_adds_up_workers(self):
+        with tempfile.TemporaryDirectory() as metrics_dir, \
+                mock.patch('metrics.METRICS_DIR', metrics_dir):
+            # a worker that has exited
+            other = [['http_requests_total',
+                      [['endpoint', 'get_task'], ['method', 'GET'],
+                       ['status', '200']], 5]]
+            with open(os.path.join(metrics_dir, 'metrics_999999.json'),
+                      'w') as f:
+                json.dump(other, f)
+            metrics.registry.inc('http_requests_total', {
+                'endpoint': 'get_task', 'method': 'GET', 'status': '200'})
+            text = self.client().get('/metrics').data.decode()
+
+        count = [line for line in text.splitlines() if line.startswith(
+            'http_requests_total{endpoint="get_task",method="GET",'
+            'status="200"}')]
+        self.assertGreaterEqual(int(count[0].split()[-1]), 6)
+
+    def test_metrics_times_queries_after_a_failed_one(self):
+        # a failed statement leaves nothing behind on its connection, and
+        # the next statement is timed and counted as usual
+        with self.app.test_request_context(), db.engine.connect() as conn:
+            metrics.g.metrics_start = 0
+            metrics.g.sql_queries = 0
+            metrics.g.sql_seconds = 0.0
+            info = dict(conn.info)
+            with self.assertRaises(OperationalError):
+                conn.execute('SELECT * FROM no_such_table')
+            self.assertEqual(dict(conn.info), info)
+            conn.execute('SELECT 1')
+            self.assertEqual(metrics.g.sql_queries, 1)
+            self.assertGreater(metrics.g.sql_seconds, 0)
+
+    def test_metrics_merges_exited_workers(self):
+        # an exited worker's file is added to the exited workers' totals
+        # and deleted, and its gauges are dropped
+        requests = ['http_requests_total',
+                    [['endpoint', 'get_task'], ['method', 'GET'],
+                     ['status', '200']]]
+        with tempfile.TemporaryDirectory() as metrics_dir, \
+                mock.patch('metrics.METRICS_DIR', metrics_dir):
+            for pid, count in ((999998, 5), (999999, 7)):
+                with open(os.path.join(metrics_dir,
+                                       'metrics_{}.json'.format(pid)),
+                          'w') as f:
+                    json.dump([requests + [count],
+                               ['db_pool_checked_out', [], 3]], f)
+                metrics.mark_process_dead(pid)
+            self.assertEqual(os.listdir(metrics_dir), [metrics.EXITED_FILE])
+            metrics.mark_process_dead(999999)
+            with open(os.path.join(metrics_dir, metrics.EXITED_FILE)) as f:
+                self.assertEqual(json.load(f), [requests + [12]])
+
+            totals = metrics.collect()
+        key = (requests[0], tuple(map(tuple, requests[1])))
+        self.assertGreaterEqual(totals[key], 12)
+
+    # Replica Tests ###########################################################
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        with mock.patch('replica.DATABASE_REPLICA_URL',
+                        'sqlite:////nonexistent/replica.db'), \
+                mock.patch.object(replica, 'replica_status',
+                                  replica.ReplicaStatus()):
+            app = create_app()
+            res = app.test_client().get('/tasks/1')
+            self.assertEqual(res.status_code, 200)
+            self.assertFalse(replica.replica_status.available)
+
+    def replica_app(self):
+        # an app whose replica is the primary database itself
+        with mock.patch('replica.DATABASE_REPLICA_URL', database_path):
+            return create_app()
+
+    def test_replica_gets_only_selects(self):
+        app = self.replica_app()
+        with mock.patch.object(replica, 'replica_status',
+                               replica.ReplicaStatus()), \
+                app.test_request_context():
+            replica_engine = replica.replica_engine(app)
+
+            @replica.read_only
+            def binds():
+                return [db.session.get_bind(clause=clause) for clause in
+                        (db.select([Task.id]),
+                         db.text('UPDATE task SET title = title'),
+                         db.text('SELECT 1'),
+                         Task.__table__.update().values(title='x'),
+                         None)]
+
+            selects, *others = binds()
+            self.assertIs(selects, replica_engine)
+            for bind in others:
+                self.assertIsNot(bind, replica_engine)
+
+    def test_read_only_retries_only_replica_errors(self):
+        app = self.replica_app()
+        calls = []
+
+        @replica.read_only
+        def fails_on_primary():
+            calls.append('primary')
+            raise OperationalError('SELECT 1', {}, Exception('primary'))
+
+        @replica.read_only
+        def fails_on_replica():
+            calls.append('replica')
+            db.session.execute(db.select([db.column('id')])
+                               .select_from(db.table('no_such_table')))
+
+        with mock.patch.object(replica, 'replica_status',
+                               replica.ReplicaStatus()), \
+                app.test_request_context():
+            with self.assertRaises(OperationalError):
+                fails_on_primary()
+            self.assertEqual(calls, ['primary'])
+            self.assertTrue(replica.replica_status.available)
+
+            # the table is missing on both, so the retry fails as well
+            with self.assertRaises(OperationalError):
+                fails_on_replica()
+            self.assertEqual(calls, ['primary', 'replica', 'replica'])
+            self.assertFalse(replica.replica_status.available)
+
+    # Import Tests ############################################################
+
+    def test_import_volunteers_csv(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('name,address,city,state,zip_code,phone_number\n'
+                    'Imported One,1 Oak St,Decatur,GA,30030,404-555-0101\n'
+                    'Imported Two,2 Oak St,Decatur,XX,30030,404-555-0102\n')
+            f.flush()
+            rejects = io.StringIO()
+            with self.app.app_context():
+                counts = import_file('volunteer', f.name, rejects=rejects,
+                                     out=io.StringIO())
+                found = Volunteer.query.filter(
+                    Volunteer.name.like('Imported %')).count()
+
+        self.assertEqual(counts['imported'], 1)
+        self.assertEqual(counts['rejected'], 1)
+        self.assertEqual(found, 1)
+        self.assertIn('state', json.loads(rejects.getvalue())['errors'])
+
+    # Stats Tests #############################################################
+
+    def test_stats_follow_task_changes(self):
+        # the summary rows are updated by every write, and always agree with
+        # a recount of the task table
+        before = self.client().get('/stats', headers=self.director_header) \
+            .get_json()
+        self.assertEqual(before['total'], sum(before['by_status'].values()))
+
+        self.client().post('/tasks/bulk', headers=self.director_header,
+                           json=[{'title': 'Stats', 'details': 'd',
+                                  'date_needed': '2020-05-12',
+                                  'status': 'Filled'}])
+        self.client().patch('/tasks/3', headers=self.director_header,
+                            json={'volunteer_id': None})
+        after = self.client().get('/stats', headers=self.director_header) \
+            .get_json()
+        self.assertEqual(after['total'], before['total'] + 1)
+        self.assertEqual(after['by_status']['Filled'],
+                         before['by_status']['Filled'] + 1)
+
+        with self.app.app_context():
+            counts = {(row.kind, row.key): row.count
+                      for row in TaskStat.query if row.count}
+            with db.engine.begin() as conn:
+                rebuild_stats(conn)
+            rebuilt = {(row.kind, row.key): row.count
+                       for row in TaskStat.query if row.count}
+        self.assertEqual(counts, rebuilt)
+
+    def test_rebuild_stats_locks_tasks_on_postgresql(self):
+        # the rebuild holds off task writers before it reads the tasks
+        conn = mock.Mock()
+        conn.dialect.name = 'postgresql'
+        conn.execute.return_value.rowcount = 1
+        rebuild_stats(conn)
+        self.assertEqual(conn.execute.call_args_list[0],
+                         mock.call('LOCK TABLE task IN SHARE MODE'))
+
+    def test_stats_by_week(self):
+        with self.app.app_context():
+            task = Task.query.get(1)
+            week = week_of(task.date_needed)
+            result = current_stats(today=task.date_needed)
+        weeks = {row['week']: row['count'] for row in result['by_week']}
+        self.assertEqual(result['this_week'], weeks[week])
+        self.assertEqual(sum(weeks.values()), result['total'])
+
+    # Async Tier Tests ########################################################
+
+    def test_async_tier_matches_flask(self):
+        # the async tier returns the same json and etags as the Flask app
+        urls = ['/tasks?limit=5', '/tasks/1',
+                '/tasks/search?search_term=Task&limit=5',
+                '/tasks?limit=5&fields=id,status&include=volunteer',
+                '/tasks/1?fields=title,date_needed']
+        with TestClient(asgi.app) as async_client:
+            for url in urls:
+                res = self.client().get(url + '&format=json' if '?' in url
+                                        else url)
+                async_res = async_client.get(url)
+                self.assertEqual(async_res.status_code, 200, url)
+                self.assertEqual(async_res.json(), res.get_json(), url)
+                self.assertEqual(async_res.headers.get('ETag'),
+                                 res.headers.get('ETag'), url)
+
+            etag = async_client.get('/tasks/1').headers['ETag']
+            res = async_client.get('/tasks/1', headers={'If-None-Match': etag})
+            self.assertEqual(res.status_code, 304)
+            res = async_client.get('/tasks?cursor=' +
+                                   pagination.encode_cursor([{}]))
+            self.assertEqual(res.status_code, 400)
+            res = async_client.get('/tasks/99999')
+            self.assertEqual(res.status_code, 404)
+            self.assertEqual(res.json()['success'], False)
+            # the volunteer search needs a token, so it is not served here
+            res = async_client.get('/volunteers/search?search_term=Vol')
+            self.assertEqual(res.status_code, 404)
+            res = async_client.get('/tasks/open')
+            self.assertTrue(all(task['status'] == 'Open'
+                                for task in res.json()['tasks']))
+
+    # Benchmark Tests #########################################################
+
+    def test_benchmark_run(self):
+        # a short run covers every route family but the one that writes,
+        # which is left out unless it is asked for
+        results = benchmark.run_benchmark(self.app, requests=4,
+                                          concurrency=2,
+                                          token=self.director_token,
+                                          warmup=1)
+        self.assertEqual(results['skipped'], ['task update'])
+        for name, route in results['routes'].items():
+            self.assertEqual(route['requests'], 4, name)
+            self.assertEqual(route['errors'], 0, name)
+            self.assertLessEqual(route['p50'], route['p99'])
+
+    def test_benchmark_server_processes(self):
+        # a tier run as its own server reports the memory of each process
+        results = benchmark.run_benchmark(self.app, requests=2,
+                                          concurrency=1,
+                                          families=['task detail'],
+                                          warmup=1, workers=1)
+        self.assertEqual(results['routes']['task detail']['errors'], 0)
+        processes = results['meta']['processes']
+        self.assertEqual([process['role'] for process in processes],
+                         ['master', 'worker'])
+        self.assertTrue(all(process['max_rss_mb'] > 0
+                            for process in processes))
+        self.assertIn('with 1 workers', benchmark.format_results(results))
+
+    def test_benchmark_compare(self):
+        route = {'requests': 100, 'errors': 0, 'throughput': 100.0,
+                 'p50': 0.01, 'p95': 0.02, 'p99': 0.03}
+        baseline = {'meta': {'tasks': 10, 'volunteers': 5},
+                    'routes': {'task detail': route}}
+        slower = {'meta': {'tasks': 10, 'volunteers': 5},
+                  'routes': {'task detail': dict(route, p95=0.03,
+                                                 throughput=70.0)}}
+        self.assertEqual(benchmark.compare(baseline, baseline), [])
+        self.assertEqual(len(benchmark.compare(baseline, slower, 0.2)), 2)
+        self.assertEqual(benchmark.compare(baseline, slower, 0.6), [])
+        slower['meta']['tasks'] = 1000
+        self.assertFalse(benchmark.comparable(baseline, slower))
+        self.assertEqual(benchmark.percentile([1, 2, 3, 4], 0.5), 2)
+
+    def test_datagen_rows(self):
+        # generated rows are the same for the same seed and pass the form
+        # checks
+        volunteers = datagen.volunteer_columns(datagen.chunk_rng(7, 0, 0),
+                                               200)
+        self.assertEqual(volunteers, datagen.volunteer_columns(
+            datagen.chunk_rng(7, 0, 0), 200))
+        for row in zip(*volunteers.values()):
+            values, errors = validate_with_form(
+                VolunteerForm, dict(zip(volunteers, row)), VOLUNTEER_FIELDS)
+            self.assertEqual(errors, {})
+
+        tasks = datagen.task_columns(datagen.chunk_rng(7, 1, 0), 200,
+                                     numpy.arange(1, 21),
+                                     datagen.DATAGEN_START)
+        for status, volunteer_id in zip(tasks['status'],
+                                        tasks['volunteer_id']):
+            self.assertIn(status, TASK_STATUSES)
+            self.assertEqual(status == 'Open', volunteer_id is None)
+        self.assertEqual(datagen.parse_size('100k'), 100000)
+
+    # Warm Up Tests ###########################################################
+
+    def test_warm_up(self):
+        # warming up fills the response cache before any request is made,
+        # and a forked worker keeps what was cached
+        with mock.patch.object(auth.jwks_cache, 'refresh',
+                               return_value=True) as refresh:
+            warmup.warm_up(self.app)
+        self.assertEqual(refresh.call_count, 1)
+        # the two task lists and the volunteer names
+        self.assertEqual(len(response_cache.backend), 3)
+
+        warmup.after_fork()
+        self.assertEqual(len(response_cache.backend), 3)
+        res = self.client().get('/tasks/open')
+        self.assertEqual(res.status_code, 200)
+        res = self.client().get('/tasks/update/1',
+                                headers=self.director_header)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(response_cache.stats()['hits'], 2)
+
+    # Auth Tests ##############################################################
+
+    def jwks_cache(self, fetch):
+        # a cache with fetch mocked by fetch, a side_effect, and no
+        # background refreshes
+        cache = auth.JWKSCache('https://example.com/jwks.json', ttl=100,
+                               refresh_ahead=0, cooldown=10,
+                               algorithms=['RS256'])
+        cache.fetch = mock.Mock(side_effect=fetch)
+        return cache
+
+    jwks = {'keys': [{'kid': 'k1', 'kty': 'RSA', 'use': 'sig',
+                      'alg': 'RS256', 'n': '', 'e': 'AQAB'}]}
+
+    def test_jwks_cache_refetches_after_ttl(self):
+        cache = self.jwks_cache(lambda: self.jwks)
+        with mock.patch('auth.time.time', return_value=1000):
+            self.assertEqual(cache.get_jwks(), self.jwks)
+        with mock.patch('auth.time.time', return_value=1099):
+            cache.get_jwks()
+        self.assertEqual(cache.fetch.call_count, 1)
+        with mock.patch('auth.time.time', return_value=1100):
+            cache.get_jwks()
+        self.assertEqual(cache.fetch.call_count, 2)
+
+    def test_jwks_cache_unknown_kid_refreshes_once_per_cooldown(self):
+        cache = self.jwks_cache(lambda: self.jwks)
+        with mock.patch('auth.time.time', return_value=1000):
+            self.assertIsNone(cache.get_key('k2'))
+            self.assertIsNone(cache.get_key('k2'))
+        self.assertEqual(cache.fetch.call_count, 2)
+        with mock.patch('auth.time.time', return_value=1010):
+            self.assertIsNone(cache.get_key('k2'))
+        self.assertEqual(cache.fetch.call_count, 3)
+
+    def test_jwks_cache_keeps_stale_keys_on_failure(self):
+        cache = self.jwks_cache([self.jwks, OSError('unreachable')])
+        with mock.patch('auth.time.time', return_value=1000):
+            cache.get_jwks()
+        with mock.patch('auth.time.time', return_value=1100):
+            self.assertEqual(cache.get_jwks(), self.jwks)
+            self.assertEqual(cache.get_jwks(), self.jwks)
+        self.assertEqual(cache.fetch.call_count, 2)
+        self.assertEqual(cache.failures, 1)
+
+    def test_jwks_cache_failed_first_fetch_waits_for_cooldown(self):
+        cache = self.jwks_cache(OSError('down'))
+        with mock.patch('auth.time.time', return_value=1000):
+            for _ in range(3):
+                with self.assertRaises(auth.AuthError) as error:
+                    cache.get_jwks()
+                self.assertEqual(error.exception.status_code, 503)
+        self.assertEqual(cache.fetch.call_count, 1)
+        with mock.patch('auth.time.time', return_value=1010):
+            with self.assertRaises(auth.AuthError):
+                cache.get_jwks()
+        self.assertEqual(cache.fetch.call_count, 2)
+
+    def test_jwks_cache_rejects_bad_keys(self):
+        # a key that cannot be parsed, or is not for an allowed algorithm,
+        # fails the request with a 401 instead of a 500
+        hs256 = {'keys': [dict(self.jwks['keys'][0], kid='k2',
+                               alg='HS256')]}
+        for jwks, kid in ((self.jwks, 'k1'), (hs256, 'k2')):
+            cache = self.jwks_cache(lambda: jwks)
+            with self.assertRaises(auth.AuthError) as error:
+                cache.get_key(kid)
+            self.assertEqual(error.exception.status_code, 401)
+
+    def test_jwks_cache_serves_stale_keys_while_refreshing(self):
+        # only one caller fetches the expired keys, the others go on
+        # with the stale ones instead of fetching them too
+        fetching = threading.Event()
+        release = threading.Event()
+        fresh = {'keys': [dict(self.jwks['keys'][0], kid='k2')]}
+
+        def fetch():
+            if cache.fetch.call_count == 1:
+                return self.jwks
+            fetching.set()
+            release.wait(5)
+            return fresh
+
+        cache = self.jwks_cache(fetch)
+        with mock.patch('auth.time.time', return_value=1000):
+            cache.get_jwks()
+        with mock.patch('auth.time.time', return_value=1100):
+            refresher = threading.Thread(target=cache.get_jwks)
+            refresher.start()
+            self.assertTrue(fetching.wait(5))
+            self.assertEqual(cache.get_jwks(), self.jwks)
+            self.assertEqual(cache.get_jwks(), self.jwks)
+            release.set()
+            refresher.join(5)
+            self.assertEqual(cache.get_jwks(), fresh)
+        self.assertEqual(cache.fetch.call_count, 2)
+
+    def test_jwks_unavailable_returns_503(self):
+        cache = self.jwks_cache(OSError('down'))
+        auth.token_cache.clear()
+        with mock.patch('auth.jwks_cache', cache):
+            res = self.client().get('/volunteers',
+                                    headers=self.director_header)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['message'], 'jwks_unavailable - '
+                                          'Unable to fetch the signing keys.')
+
+    def test_token_cache_evicts_least_recently_used(self):
+        cache = auth.TokenCache(max_size=2, max_ttl=100)
+        cache.put('a', {'sub': 'a'})
+        cache.put('b', {'sub': 'b'})
+        self.assertEqual(cache.get('a'), {'sub': 'a'})
+        cache.put('c', {'sub': 'c'})
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'sub': 'a'})
+        self.assertEqual(cache.get('c'), {'sub': 'c'})
+
+    def test_token_cache_expires_at_exp_or_max_ttl(self):
+        cache = auth.TokenCache(max_size=10, max_ttl=100)
+        with mock.patch('auth.time.time', return_value=1000):
+            cache.put('soon', {'exp': 1050})
+            cache.put('later', {'exp': 5000})
+            cache.put('no exp', {})
+        with mock.patch('auth.time.time', return_value=1049):
+            for token in ('soon', 'later', 'no exp'):
+                self.assertIsNotNone(cache.get(token), token)
+        with mock.patch('auth.time.time', return_value=1050):
+            self.assertIsNone(cache.get('soon'))
+            self.assertIsNotNone(cache.get('later'))
+        with mock.patch('auth.time.time', return_value=1100):
+            self.assertIsNone(cache.get('later'))
+            self.assertIsNone(cache.get('no exp'))
+        self.assertEqual(len(cache), 0)
+
+    def test_token_cache_counts_hits_and_misses(self):
+        cache = auth.TokenCache(max_size=10, max_ttl=100)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', {'sub': 'a'})
+        cache.get('a')
+        cache.get('a')
+        self.assertEqual(cache.stats(), {'size': 1, 'max_size': 10,
+                                         'hits': 2, 'misses': 1})
+        cache.clear()
+        self.assertEqual(cache.stats(), {'size': 0, 'max_size': 10,
+                                         'hits': 0, 'misses': 0})
+
+    def test_requires_auth_reuses_verified_payload(self):
+        auth.token_cache.clear()
+        with mock.patch('auth.verify_decode_jwt',
+                        wraps=auth.verify_decode_jwt) as verify:
+            for _ in range(3):
+                res = self.client().get('/volunteers?limit=1',
+                                        headers=self.director_header)
+                self.assertEqual(res.status_code, 200)
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(auth.token_cache.hits, 2)
+
+    # GET /callback -- auth0_callback_handling
+    def test_callback_decodes_token_once(self):
+        # logging in should verify the token and fetch the jwks at most once
+        # no matter how many permission flags are set in the session
+        auth.token_cache.clear()
+        auth0 = self.app.extensions['authlib.integrations.flask_client'] \
+            .create_client('auth0')
+        userinfo = mock.Mock()
+        userinfo.json.return_value = {
+            'sub': 'auth0|director',
+            'email': 'director@ftk.com',
+            'nickname': 'director'
+        }
+        fetches = auth.jwks_cache.fetches
+
+        with mock.patch.object(auth0, 'authorize_access_token',
+                               return_value={
+                                   'access_token': self.director_token
+                               }), \
+                mock.patch.object(auth0, 'get', return_value=userinfo), \
+                mock.patch('auth.jwt.decode',
+                           wraps=auth.jwt.decode) as decode:
+            with self.client() as client:
+                res = client.get('/callback')
+                with client.session_transaction() as sess:
+                    flags = dict(sess)
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(decode.call_count, 1)
+        self.assertLessEqual(auth.jwks_cache.fetches - fetches, 1)
+        self.assertEqual(flags['public_user'], False)
+        self.assertEqual(flags['delete_task_ok'], 'True')
+        self.assertEqual(flags['delete_vol_ok'], 'True')
+        self.assertEqual(flags['add_task_ok'], 'True')
+        self.assertEqual(flags['add_vol_ok'], 'True')
+        self.assertEqual(flags['update_task_ok'], 'True')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,136 @@
+from datetime import datetime
+from wtforms import DateField
+from wtforms.validators import ValidationError, StopValidation
+from models import Task, Volunteer
+
+'''
+Request validation
+The rules for the task and volunteer objects sent to the api, shared by the
+single item and the bulk endpoints.  Each function returns (values, errors):
+values holds the columns to write and errors maps each invalid field to a
+message, so an empty errors dict means the object can be written.
+'''
+
+TASK_FIELDS = ['title', 'details', 'date_needed']
+VOLUNTEER_FIELDS = ['name', 'address', 'city', 'state', 'zip_code',
+                    'phone_number']
+TASK_STATUSES = ['Open', 'Filled', 'Complete']
+
+
+def check_lengths(table, values, errors):
+    # strings must fit in their columns
+    for field, value in values.items():
+        length = getattr(table.c[field].type, 'length', None)
+        if length and isinstance(value, str) and len(value) > length:
+            errors[field] = 'must be at most {} characters'.format(length)
+
+
+def validate_task(body):
+    if not isinstance(body, dict):
+        return {}, {'task': 'must be an object'}
+
+    values = {field: body.get(field, None) for field in TASK_FIELDS}
+    values['status'] = body.get('status', 'Open')
+    errors = {}
+    for field in TASK_FIELDS:
+        if not values[field]:
+            errors[field] = 'is required'
+    if values['status'] not in TASK_STATUSES:
+        errors['status'] = 'must be one of ' + ', '.join(TASK_STATUSES)
+
+    if values['date_needed'] and 'date_needed' not in errors:
+        try:
+            values['date_needed'] = datetime.strptime(
+                str(values['date_needed']), '%Y-%m-%d').date()
+        except ValueError:
+            errors['date_needed'] = 'must be a date in YYYY-MM-DD format'
+
+    check_lengths(Task.__table__, values, errors)
+    return values, errors
+
+
+def validate_volunteer(body):
+    if not isinstance(body, dict):
+        return {}, {'volunteer': 'must be an object'}
+
+    # all fields are required
+    values = {field: body.get(field, None) for field in VOLUNTEER_FIELDS}
+    errors = {}
+    for field in VOLUNTEER_FIELDS:
+        if not values[field]:
+            errors[field] = 'is required'
+
+    check_lengths(Volunteer.__table__, values, errors)
+    return values, errors
+
+
+def validate_assignment(body):
+    # a change to one task's volunteer and/or status.  A volunteer_id of
+    # null takes the task's volunteer off it
+    if not isinstance(body, dict):
+        return {}, {'change': 'must be an object'}
+
+    values = {}
+    errors = {}
+    task_id = body.get('task_id', None)
+    if not isinstance(task_id, int) or isinstance(task_id, bool):
+        errors['task_id'] = 'must be a task id'
+    values['task_id'] = task_id
+
+    if 'volunteer_id' in body:
+        volunteer_id = body['volunteer_id']
+        if volunteer_id is not None and (not isinstance(volunteer_id, int) or
+                                         isinstance(volunteer_id, bool)):
+            errors['volunteer_id'] = 'must be a volunteer id or null'
+        values['volunteer_id'] = volunteer_id
+    if 'status' in body:
+        if body['status'] not in TASK_STATUSES:
+            errors['status'] = 'must be one of ' + ', '.join(TASK_STATUSES)
+        values['status'] = body['status']
+
+    if 'volunteer_id' not in body and 'status' not in body:
+        errors['change'] = 'must include volunteer_id or status'
+    return values, errors
+
+
+class FieldData:
+    # stands in for a bound form field, so that the validators declared on a
+    # form class can check a value without a request or a form instance
+    def __init__(self, data):
+        self.data = data
+        self.errors = []
+
+    def gettext(self, string):
+        return string
+
+    def ngettext(self, singular, plural, n):
+        return singular if n == 1 else plural
+
+
+def validate_with_form(form_class, row, fields):
+    # checks the fields of row with the validators and choices that
+    # form_class declares for them, so that imported rows follow the same
+    # rules as the gui forms
+    values = {}
+    errors = {}
+    for name in fields:
+        unbound = getattr(form_class, name)
+        value = row.get(name, None)
+        value = '' if value is None else str(value).strip()
+        field = FieldData(value)
+        try:
+            for validator in unbound.kwargs.get('validators', []):
+                validator(None, field)
+            choices = unbound.kwargs.get('choices', None)
+            if choices is not None and value not in [c[0] for c in choices]:
+                raise ValidationError('Not a valid choice')
+            if issubclass(unbound.field_class, DateField):
+                date_format = unbound.kwargs.get('format', '%Y-%m-%d')
+                try:
+                    value = datetime.strptime(value, date_format).date()
+                except ValueError:
+                    raise ValidationError('Not a valid date value')
+        except (ValidationError, StopValidation) as e:
+            errors[name] = str(e) or 'is invalid'
+        values[name] = value
+    return values, errors
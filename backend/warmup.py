@@ -0,0 +1,69 @@
+import glob
+import os
+from auth import jwks_cache, token_cache
+from cache import response_cache
+from db_pool import dispose_engines
+from metrics import METRICS_DIR, registry
+
+'''
+Preloading
+gunicorn.conf.py loads the app once, in the master process, and forks the
+workers from it, so the app, the OAuth client and the compiled templates are
+built once and shared copy-on-write.  warm_up() fills the caches every
+worker needs before the first worker starts: the Auth0 signing keys, every
+template, the cached public task lists and the volunteer names of the task
+form.  It then closes the connections it opened, so no worker inherits a
+connection.
+
+after_fork() runs in each new worker.  It gives the caches locks of their
+own, since a lock copied while a thread of the master held it would never be
+released, and drops the tokens the master verified.  The engines need
+nothing here: db_pool gives them new, empty pools in every forked child, so
+a worker only ever uses connections it opened itself.
+'''
+
+# requests made through the app to fill the response cache
+WARM_UP_URLS = ['/tasks/open', '/tasks']
+
+
+def warm_up(app):
+    if not jwks_cache.refresh():
+        app.logger.warning('Could not fetch the Auth0 signing keys, each '
+                           'worker will fetch them on its first request')
+
+    for name in app.jinja_env.list_templates(
+            filter_func=lambda name: name.endswith('.html')):
+        app.jinja_env.get_template(name)
+
+    client = app.test_client(use_cookies=False)
+    for url in WARM_UP_URLS:
+        res = client.get(url)
+        if res.status_code != 200:
+            app.logger.warning('Warming up %s returned %s', url,
+                               res.status_code)
+
+    # the volunteer names behind the task form's choices, which are not
+    # behind a public url.  Imported here, as importing app builds the app
+    from app import get_volunteer_names
+    with app.test_request_context():
+        get_volunteer_names()
+
+    # the warm up requests are not counted in the metrics
+    registry.reset()
+    response_cache.reset_stats()
+    clear_metrics_dir()
+    dispose_engines()
+
+
+def after_fork():
+    jwks_cache.after_fork()
+    token_cache.clear()
+    response_cache.backend.after_fork()
+
+
+def clear_metrics_dir():
+    # the metrics of the workers of an earlier run are not carried over
+    if not METRICS_DIR:
+        return
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics_*.json*')):
+        os.remove(path)